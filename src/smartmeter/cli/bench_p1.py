@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import sys
+
+from smartmeter.p1.benchmark import BENCHMARKS, compare_baseline, load_baseline, run_benchmarks, save_baseline
+from smartmeter.p1.emulator import METER_PROFILES
+
+
+def parse_args():
+    """Parse all supplied arguments and return an argparse namespace object
+
+    :rtype:             argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the parser, the framer and the acquisition path")
+    default_output_mode = "text"
+
+    parser.add_argument(
+        "-m",
+        "--meters",
+        action="store",
+        default=",".join(METER_PROFILES),
+        help=f"Comma separated meter families. Default: {','.join(METER_PROFILES)}"
+    )
+
+    parser.add_argument(
+        "-b",
+        "--benchmarks",
+        action="store",
+        default=",".join(BENCHMARKS),
+        help=f"Comma separated benchmarks. Default: {','.join(BENCHMARKS)}"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--telegrams",
+        action="store",
+        default=1000,
+        type=int,
+        help="Amount of telegrams per benchmark, end_to_end uses a fifth of it. Default: 1000"
+    )
+
+    parser.add_argument(
+        "--save",
+        action="store",
+        default=None,
+        help="Save the results as a baseline file. Default: off"
+    )
+
+    parser.add_argument(
+        "--compare",
+        action="store",
+        default=None,
+        help="Compare the results with a baseline file, exit with status 2 on a regression. Default: off"
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        action="store",
+        default=0.1,
+        type=float,
+        help="Allowed relative slowdown compared to the baseline. Default: 0.1"
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output-mode",
+        action="store",
+        choices=[
+            "json",
+            default_output_mode
+        ],
+        type=str,
+        default=default_output_mode,
+        help=f"Specify the type of output. Defaults to '{default_output_mode}'"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        "--debug",
+        action="store_true",
+        help="Show more verbose logging (debug). Default: off",
+        default=False
+    )
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig()
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    arguments = parse_args()
+
+    # Force log level to debug when specified on commandline:
+    if arguments.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    baseline = None
+    if arguments.compare:
+        if not os.path.isfile(arguments.compare):
+            logger.fatal(f"Baseline '{arguments.compare}' not found")
+            sys.exit(1)
+        baseline = load_baseline(arguments.compare)
+
+    try:
+        results = run_benchmarks(
+            meters=[meter.strip() for meter in arguments.meters.split(",")],
+            benchmarks=[name.strip() for name in arguments.benchmarks.split(",")],
+            telegrams=arguments.telegrams
+        )
+    except (KeyError, ValueError) as e:
+        logger.fatal(f"Invalid benchmark selection: {str(e)}")
+        sys.exit(1)
+
+    if arguments.output_mode == "json":
+        print(json.dumps([result.as_dict() for result in results], indent=4))
+    else:
+        print(f"{'benchmark':<24} {'rate':>14} {'unit':<10} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} "
+              f"{'peak B':>8} {'retained':>8}")
+        for result in results:
+            summary = result.as_dict()
+            print(f"{result.key:<24} {summary['rate']:>14.1f} {result.unit + '/s':<10} {summary['p50_us']:>10.2f} "
+                  f"{summary['p90_us']:>10.2f} {summary['p99_us']:>10.2f} {summary.get('peak_bytes', ''):>8} "
+                  f"{summary.get('retained_blocks', ''):>8}")
+
+    if arguments.save:
+        save_baseline(results, arguments.save)
+        logger.info(f"Baseline saved to {arguments.save}")
+
+    if baseline is not None:
+        regressions = compare_baseline(results, baseline, tolerance=arguments.tolerance)
+        for regression in regressions:
+            logger.warning(f"Regression: {regression}")
+        if regressions:
+            sys.exit(2)
+        logger.info(f"No regressions compared to {arguments.compare}")
+
+
+if __name__ == '__main__':
+    main()
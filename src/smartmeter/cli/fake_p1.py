@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import sys
+import time
+
+from smartmeter.p1.emulator import FakeMeter, METER_PROFILES
+
+
+def parse_args():
+    """Parse all supplied arguments and return an argparse namespace object
+
+    :rtype:             argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="Emulate a P1 meter on a pseudo-terminal")
+    default_meter = "iskra"
+
+    parser.add_argument(
+        "-m",
+        "--meter",
+        action="store",
+        choices=list(METER_PROFILES),
+        default=default_meter,
+        help=f"The meter family to emulate. Default: {default_meter}"
+    )
+
+    parser.add_argument(
+        "-i",
+        "--interval",
+        action="store",
+        default=None,
+        type=float,
+        help="Seconds between telegrams, 0 is as fast as possible. Default: the interval of the meter"
+    )
+
+    parser.add_argument(
+        "-b",
+        "--baudrate",
+        action="store",
+        default=None,
+        type=int,
+        help="Emulated line speed in bits per second, 0 is unlimited. Default: the baud rate of the meter"
+    )
+
+    parser.add_argument(
+        "-t",
+        "--telegrams",
+        action="store",
+        default=0,
+        type=int,
+        help="How many telegrams should be written. 0 is unlimited. Default: 0"
+    )
+
+    parser.add_argument(
+        "--noise",
+        action="store",
+        default=0.0,
+        type=float,
+        help="Probability of line noise per telegram. Default: 0.0"
+    )
+
+    parser.add_argument(
+        "--crc-errors",
+        action="store",
+        default=0.0,
+        type=float,
+        help="Probability of a wrong checksum per telegram. Default: 0.0"
+    )
+
+    parser.add_argument(
+        "--partial",
+        action="store",
+        default=0.0,
+        type=float,
+        help="Probability of a cut off telegram. Default: 0.0"
+    )
+
+    parser.add_argument(
+        "--burst-probability",
+        action="store",
+        default=0.0,
+        type=float,
+        help="Probability of a burst of telegrams per interval. Default: 0.0"
+    )
+
+    parser.add_argument(
+        "--burst-size",
+        action="store",
+        default=10,
+        type=int,
+        help="Amount of telegrams in a burst. Default: 10"
+    )
+
+    parser.add_argument(
+        "--seed",
+        action="store",
+        default=None,
+        type=int,
+        help="Seed of the random generator, for reproducible runs. Default: random"
+    )
+
+    parser.add_argument(
+        "-l",
+        "--link",
+        action="store",
+        default=None,
+        help="Create a symbolic link to the pseudo-terminal, e.g. /tmp/ttyP1. Default: off"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        "--debug",
+        action="store_true",
+        help="Show more verbose logging (debug). Default: off",
+        default=False
+    )
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig()
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    arguments = parse_args()
+
+    # Force log level to debug when specified on commandline:
+    if arguments.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    meter = FakeMeter(
+        arguments.meter,
+        interval=arguments.interval,
+        baudrate=arguments.baudrate,
+        noise=arguments.noise,
+        crc_errors=arguments.crc_errors,
+        partial=arguments.partial,
+        burst_probability=arguments.burst_probability,
+        burst_size=arguments.burst_size,
+        telegrams=arguments.telegrams,
+        seed=arguments.seed,
+        link=arguments.link
+    )
+
+    try:
+        meter.start()
+    except OSError as e:
+        logger.fatal(f"Can not create the pseudo-terminal: {str(e)}")
+        sys.exit(1)
+
+    logger.info(f"Emulating a {arguments.meter} meter on {arguments.link or meter.port}")
+    # The port to read from, e.g. for the 'port' of the configuration file:
+    print(arguments.link or meter.port, flush=True)
+
+    try:
+        while meter.running:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Give the reader the time to take the last telegram:
+        meter.drain()
+        meter.close()
+        logger.info(f"Statistics: {meter.as_dict()}")
+
+
+if __name__ == '__main__':
+    main()
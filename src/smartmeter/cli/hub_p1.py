@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import smartmeter.configuration.templates
+from smartmeter.configuration import load_meters_from_file
+from smartmeter.p1.aio import AsyncTelegramReader
+from smartmeter.p1.hub import DEFAULT_SOCKET, TelegramHub
+
+
+def parse_args():
+    """Parse all supplied arguments and return an argparse namespace object
+
+    :rtype:             argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="Read the P1 port(s) and share the telegrams with local subscribers")
+    default_config_file = "smartmeter.json"
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        action="store",
+        default=default_config_file,
+        help=f"Location of the configuration file. Default: {default_config_file}"
+    )
+
+    parser.add_argument(
+        "-s",
+        "--socket",
+        action="store",
+        default=DEFAULT_SOCKET,
+        help=f"The Unix domain socket to listen on. Default: {DEFAULT_SOCKET}"
+    )
+
+    parser.add_argument(
+        "-q",
+        "--max-queue",
+        action="store",
+        default=64,
+        type=int,
+        help="Amount of telegrams to buffer per subscriber before the oldest is dropped. Default: 64"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        "--debug",
+        action="store_true",
+        help="Show more verbose logging (debug). Default: off",
+        default=False
+    )
+    return parser.parse_args()
+
+
+async def publish_serial(hub: TelegramHub, name: str, serial_config):
+    """Publish all telegrams of one meter, tagged with the name of the meter"""
+    async with AsyncTelegramReader(serial_config, source=name) as reader:
+        async for telegram in reader:
+            hub.publish(telegram)
+
+
+async def run(arguments):
+    logger = logging.getLogger()
+
+    if os.path.isfile(arguments.config):
+        meters = load_meters_from_file(arguments.config)
+    else:
+        logger.info(f"Config file '{arguments.config}' not found, using the ISKRA_MT382 template")
+        serial_config = smartmeter.configuration.templates.ISKRA_MT382
+        meters = {serial_config.port: serial_config}
+
+    async with TelegramHub(arguments.socket, max_queue=arguments.max_queue) as hub:
+        await asyncio.gather(*[publish_serial(hub, name, serial_config) for name, serial_config in meters.items()])
+
+
+def main():
+    logging.basicConfig()
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    arguments = parse_args()
+
+    # Force log level to debug when specified on commandline:
+    if arguments.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    try:
+        asyncio.run(run(arguments))
+    except KeyboardInterrupt as e:
+        msg = "Interrupted by keyboard: {}".format(str(e))
+        logger.error(msg)
+        sys.exit(1)
+    except Exception as e:
+        msg = "Exception in hub: {}".format(str(e))
+        logger.fatal(msg)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+
+from smartmeter.p1.batch import parse_archive
+from smartmeter.p1.record import DEFAULT_SCHEMA, TelegramBatch
+from smartmeter.storage.archive import ArchiveWriter
+
+
+def parse_args():
+    """Parse all supplied arguments and return an argparse namespace object
+
+    :rtype:             argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="Parse a (large) capture file of telegrams in parallel")
+    default_output_mode = "summary"
+
+    parser.add_argument(
+        "archive",
+        action="store",
+        help="The capture file to parse"
+    )
+
+    parser.add_argument(
+        "-j",
+        "--processes",
+        action="store",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="Amount of worker processes. Default: the amount of CPUs"
+    )
+
+    parser.add_argument(
+        "--chunks",
+        action="store",
+        default=None,
+        type=int,
+        help="Amount of byte ranges to split the archive in. Default: 4 per process"
+    )
+
+    parser.add_argument(
+        "--no-crc",
+        action="store_true",
+        default=False,
+        help="Do not verify the checksum of the telegrams. Default: verify"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        "--debug",
+        action="store_true",
+        help="Show more verbose logging (debug). Default: off",
+        default=False
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output-mode",
+        action="store",
+        choices=[
+            "csv",
+            "archive",
+            default_output_mode
+        ],
+        type=str,
+        default=default_output_mode,
+        help=f"Specify the type of output. Defaults to '{default_output_mode}'"
+    )
+
+    parser.add_argument(
+        "--output",
+        action="store",
+        default=None,
+        help="The compressed archive to write for output mode 'archive', appended to when it exists"
+    )
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig()
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    arguments = parse_args()
+
+    # Force log level to debug when specified on commandline:
+    if arguments.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if not os.path.isfile(arguments.archive):
+        logger.fatal(f"Archive '{arguments.archive}' not found")
+        sys.exit(1)
+
+    writer = csv.writer(sys.stdout) if arguments.output_mode == "csv" else None
+    if writer is not None:
+        writer.writerow(TelegramBatch(DEFAULT_SCHEMA).column_names())
+
+    archive_writer = None
+    if arguments.output_mode == "archive":
+        if not arguments.output:
+            logger.fatal("Output mode 'archive' needs an --output file")
+            sys.exit(1)
+        try:
+            archive_writer = ArchiveWriter(arguments.output)
+        except (OSError, ValueError) as e:
+            logger.fatal(f"Can not open archive '{arguments.output}': {str(e)}")
+            sys.exit(1)
+
+    telegram_counter = 0
+    crc_errors = 0
+    started = time.perf_counter()
+
+    for chunk in parse_archive(
+            arguments.archive,
+            processes=arguments.processes,
+            chunks=arguments.chunks,
+            verify_crc=not arguments.no_crc
+    ):
+        telegram_counter += len(chunk)
+        crc_errors += chunk.crc_errors
+        if writer is not None:
+            writer.writerows(chunk.rows())
+        if archive_writer is not None:
+            archive_writer.extend(chunk)
+
+    if archive_writer is not None:
+        archive_writer.close()
+        logger.info(f"Wrote {archive_writer.records_written} records in {archive_writer.blocks_written} blocks, "
+                    f"{archive_writer.bytes_written} bytes, to {arguments.output}")
+
+    elapsed = time.perf_counter() - started
+    rate = telegram_counter / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Parsed {telegram_counter} telegrams ({crc_errors} invalid checksums) "
+                f"in {elapsed:.3f} seconds: {rate:.0f} telegrams/s")
+
+
+if __name__ == '__main__':
+    main()
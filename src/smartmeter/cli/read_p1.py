@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
+import datetime
+import json
 import logging
+import os
 from pprint import pformat
 import sys
 
 import smartmeter.configuration.templates
 # import smartmeter.p1.config
-from smartmeter.p1.data import Telegram
-from smartmeter.p1.read import parse_args, load_config, P1Connection
+from smartmeter.configuration import load_meters_from_file, load_sinks_from_file
+from smartmeter.library import get_queued_logger, LogSampler
+from smartmeter.library.metrics import MetricsFile, MetricsRegistry, MetricsServer
+from smartmeter.output.sinks import create_sinks, NdjsonSink, TimeSeriesSink
+from smartmeter.p1.history import TelegramHistory
+from smartmeter.p1.pipeline import TelegramPipeline
+from smartmeter.p1.read import parse_args, ReadTelegrams
+from smartmeter.p1.replay import ReplayTelegrams
 
 
 def main():
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    # Formatting and writing the log happens in a background thread, logging never blocks reading:
+    logger, logging_pipeline = get_queued_logger(level=logging.INFO)
 
     logging.info("Parsing arguments...")
     arguments = parse_args()
@@ -19,92 +28,167 @@ def main():
     # Force log level to debug when specified on commandline:
     if arguments.verbose:
         logger.setLevel(logging.DEBUG)
-    # logging.info("Reading config file: " + arguments.config)
-    # config = load_config(arguments.config)
 
-    # logger.debug("Config:\n" + str(config))
-
-    p1_data = Telegram()
-
-    conn = P1Connection(serial_config=smartmeter.configuration.templates.ISKRA_MT382)
+    reader = None
+
+    # Metrics are only recorded when they are exported:
+    metrics = None
+    exporters = []
+    if arguments.metrics_port is not None or arguments.metrics_file:
+        metrics = MetricsRegistry()
+        if arguments.metrics_port is not None:
+            exporters.append(MetricsServer(metrics, port=arguments.metrics_port))
+        if arguments.metrics_file:
+            exporters.append(MetricsFile(metrics, arguments.metrics_file, interval=arguments.metrics_interval))
+
+    if arguments.replay:
+        logger.info(f"Replaying capture file: {arguments.replay}")
+        source = ReplayTelegrams(arguments.replay, realtime=arguments.realtime, speed=arguments.speed)
+
+    else:
+        # Use the meters from the configuration file when available, otherwise the Iskra MT382 template:
+        if os.path.isfile(arguments.config):
+            logger.info("Reading config file: " + arguments.config)
+            meters = load_meters_from_file(arguments.config)
+        else:
+            logger.info(f"Config file '{arguments.config}' not found, using the ISKRA_MT382 template")
+            meters = [smartmeter.configuration.templates.ISKRA_MT382]
+
+        reader = ReadTelegrams(meters, metrics=metrics)
+
+        for name, conn in reader.connections.items():
+            logger.debug(f"{name}: {conn.serial_connection}")
+
+        # open comm:
+        try:
+            logger.info("Open connection...")
+            reader.open()
+            logger.info("Connection is open")
+        except Exception as e:
+            msg = "Exception while opening serial connection: {}".format(str(e))
+            logger.fatal(msg)
+            sys.exit(1)
 
-    logger.debug(str(conn.serial_connection))
+        source = reader
 
-    # open comm:
+    # The sinks of the configuration file, the store and NDJSON output of the commandline:
     try:
-        logger.info("Open connection...")
-        conn.serial_connection.open()
-        logger.info("Connection is open")
+        sinks = create_sinks(load_sinks_from_file(arguments.config)) if os.path.isfile(arguments.config) else []
+        if arguments.store:
+            sinks.append(TimeSeriesSink(arguments.store))
+        if arguments.output_mode == "ndjson":
+            sinks.append(NdjsonSink())
+        elif arguments.output_mode == "delta":
+            sinks.append(NdjsonSink(keyframe_interval=arguments.keyframe_interval))
     except Exception as e:
-        msg = "Exception while opening serial connection: {}".format(str(e))
+        msg = "Exception while creating the sinks: {}".format(str(e))
         logger.fatal(msg)
         sys.exit(1)
 
-    # Reading lines from ser:
-    telegram_counter = 0
-    telegram_list = []
-    telegram = []
+    for sink in sinks:
+        logger.debug(f"Sink: {sink.as_dict()}")
 
-    while True:
+    if metrics is not None:
+        # The index tells sinks of the same type apart, each series needs unique labels:
+        metrics.register_collector(lambda: [
+            ("p1_sink_written_total", "counter", "Telegrams written by a sink",
+             {"sink": sink.__class__.__name__, "index": str(index)}, sink.written)
+            for index, sink in enumerate(sinks)
+        ])
         try:
-            line = conn.serial_connection.readline().decode(encoding="utf-8").rstrip("\r\n")
-        except KeyboardInterrupt as e:
-            msg = "Interrupted by keyboard: {}".format(str(e))
-            logger.error(msg)
-            sys.exit(1)
-        except Exception as e:
-            msg = "Exception while reading from serial connection: {}".format(str(e))
+            for exporter in exporters:
+                exporter.start()
+        except OSError as e:
+            msg = "Exception while starting the metrics exporter: {}".format(str(e))
             logger.fatal(msg)
             sys.exit(1)
 
-        # Add the line to our telegram, but only if it is not the Null character:
-        if line != "\x00":
-            telegram.append(line)
-            p1_data.add_line(line)
-
-        logger.info(line)
-        # check if the first character is an exclamation mark
-        # (some smartmeter append some text after the exclamation mark)
-        if len(line) >= 1 and line[0] == "!":
-            # End of telegram found!
-
-            # Check if we also got a header. If not, let wait for another round:
-            if not p1_data.has_header():
-                logger.debug("End of telegram reached but we don't have a header, wait for another")
-
-            else:
-
-                # add the compiled telegram to our list:
-                telegram_list.append(telegram[:])
-
-                logger.debug(f"Content of telegram:\n{pformat(p1_data.telegram, indent=4)}")
-                if arguments.output_mode == "json":
-                    import json
-                    import datetime
-                    import sys
-                    data = p1_data.telegram
-                    data['datetime'] = datetime.datetime.now().isoformat()
-                    data['obiscodes'] = p1_data.OBIS_CODES.copy()
-                    print(json.dumps(data, indent=4))
-
-                    # Increase the overall counter:
-                    telegram_counter += 1
-
-            p1_data.clear()
-            # Empty our telegram for reuse:
-            telegram.clear()
-
-            # Exit our loop if the desired amount of telegrams has been reached:
-            if arguments.telegrams > 0 and arguments.telegrams == telegram_counter:
-                # Break from the loop if a telegram limit is set and the limit is reached:
-                break
-
-    # Dump our telegram_list to the logger:
-    logger.debug(f"Telegram list:\n{telegram_list}")
-
-    logger.info("Closing connection...")
-    conn.serial_connection.close()
-
+    # Reading telegrams from all meters, the reader thread only reads, the processing runs in a worker thread:
+    telegram_counter = 0
+    history = TelegramHistory(capacity=arguments.history)
+    telegram_sampler = LogSampler(every=arguments.log_every)
+
+    def process(p1_data):
+        nonlocal telegram_counter
+
+        if telegram_sampler():
+            # The header does not convert the values of the telegram, unlike p1_data.telegram:
+            logger.info("Telegram from %s: %s", p1_data.source, p1_data.header)
+
+        # add the compiled telegram to the history of recent telegrams:
+        history.append(p1_data)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Content of telegram:\n{pformat(p1_data.telegram, indent=4)}")
+        if arguments.output_mode == "json":
+            data = p1_data.telegram
+            data['datetime'] = datetime.datetime.now().isoformat()
+            data['source'] = p1_data.source
+            data['obiscodes'] = p1_data.OBIS_CODES
+            print(json.dumps(data, indent=4))
+
+        # Increase the overall counter:
+        telegram_counter += 1
+
+        # Stop reading if the desired amount of telegrams has been reached:
+        if arguments.telegrams > 0 and arguments.telegrams == telegram_counter:
+            pipeline.stop()
+
+    # Every sink is a handler of its own, a failing sink does not keep the telegram from the other sinks:
+    handlers = [process] + [sink.write for sink in sinks]
+    fields = [obis_id.strip() for obis_id in arguments.fields.split(",")] if arguments.fields else None
+    pipeline = TelegramPipeline(
+        source,
+        handlers,
+        max_queue=arguments.queue_size,
+        overflow=arguments.overflow,
+        fields=fields,
+        metrics=metrics
+    )
+
+    exit_code = 0
+    try:
+        pipeline.start()
+        pipeline.join()
+    except KeyboardInterrupt as e:
+        msg = "Interrupted by keyboard: {}".format(str(e))
+        logger.error(msg)
+        exit_code = 1
+    except Exception as e:
+        msg = "Exception while reading from serial connection: {}".format(str(e))
+        logger.fatal(msg)
+        exit_code = 1
+    finally:
+        # Process the queued telegrams and wait for the workers before the sinks are closed, nothing buffered is lost:
+        pipeline.stop(drain=True)
+        pipeline.join()
+        logger.info(f"Pipeline statistics: {pipeline.statistics()}")
+
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"Exception while closing sink {sink.__class__.__name__}: {str(e)}")
+            logger.info(f"Sink statistics: {sink.as_dict()}")
+
+        for exporter in exporters:
+            exporter.close()
+
+        # Dump the most recent telegrams to the logger:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Telegram history:\n{pformat(history.last(10), indent=4)}")
+
+        if reader is not None:
+            for statistics in reader.statistics.values():
+                logger.info(f"Statistics: {statistics.as_dict()}")
+
+            logger.info("Closing connection...")
+            reader.close()
+
+        logging_pipeline.stop()
+
+    if exit_code:
+        sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
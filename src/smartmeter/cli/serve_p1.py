@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+import smartmeter.configuration.templates
+from smartmeter.configuration import load_meters_from_file
+from smartmeter.p1.aio import AsyncTelegramReader
+from smartmeter.p1.replay import ReplayTelegrams
+from smartmeter.web.server import DEFAULT_DOCUMENT_ROOT, TelegramHttpServer
+
+
+def parse_args():
+    """Parse all supplied arguments and return an argparse namespace object
+
+    :rtype:             argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="Serve the live web view and push telegrams to the browsers")
+    default_config_file = "smartmeter.json"
+
+    parser.add_argument(
+        "-c",
+        "--config",
+        action="store",
+        default=default_config_file,
+        help=f"Location of the configuration file. Default: {default_config_file}"
+    )
+
+    parser.add_argument(
+        "--host",
+        action="store",
+        default="127.0.0.1",
+        help="The address to listen on. Default: 127.0.0.1"
+    )
+
+    parser.add_argument(
+        "-p",
+        "--port",
+        action="store",
+        default=8080,
+        type=int,
+        help="The port to listen on. Default: 8080"
+    )
+
+    parser.add_argument(
+        "--document-root",
+        action="store",
+        default=DEFAULT_DOCUMENT_ROOT,
+        help=f"Directory of the web view. Default: {DEFAULT_DOCUMENT_ROOT}"
+    )
+
+    parser.add_argument(
+        "--latest-file",
+        action="store",
+        default=None,
+        help="Also write every telegram atomically to this file. Default: off"
+    )
+
+    parser.add_argument(
+        "-r",
+        "--replay",
+        action="store",
+        default=None,
+        help="Replay a capture file in real-time instead of reading the serial port(s). Default: off"
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        "--debug",
+        action="store_true",
+        help="Show more verbose logging (debug). Default: off",
+        default=False
+    )
+    return parser.parse_args()
+
+
+async def publish_serial(server: TelegramHttpServer, serial_config):
+    """Publish all telegrams of one meter"""
+    async with AsyncTelegramReader(serial_config) as reader:
+        async for telegram in reader:
+            server.publish(telegram)
+
+
+async def publish_replay(server: TelegramHttpServer, filename: str):
+    """Publish the telegrams of a capture file, paced by their original timestamps"""
+    loop = asyncio.get_running_loop()
+    telegrams = iter(ReplayTelegrams(filename, realtime=True))
+    while True:
+        # The replay sleeps between telegrams, keep that out of the event loop:
+        telegram = await loop.run_in_executor(None, next, telegrams, None)
+        if telegram is None:
+            break
+        server.publish(telegram)
+
+
+async def serve(arguments):
+    logger = logging.getLogger()
+
+    async with TelegramHttpServer(
+            host=arguments.host,
+            port=arguments.port,
+            document_root=arguments.document_root,
+            latest_file=arguments.latest_file
+    ) as server:
+        if arguments.replay:
+            publishers = [publish_replay(server, arguments.replay)]
+        else:
+            if os.path.isfile(arguments.config):
+                meters = load_meters_from_file(arguments.config)
+            else:
+                logger.info(f"Config file '{arguments.config}' not found, using the ISKRA_MT382 template")
+                meters = {"p1": smartmeter.configuration.templates.ISKRA_MT382}
+            publishers = [publish_serial(server, serial_config) for serial_config in meters.values()]
+
+        await asyncio.gather(*publishers)
+        logger.info("No more telegrams, still serving the latest one")
+        await asyncio.Event().wait()
+
+
+def main():
+    logging.basicConfig()
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    arguments = parse_args()
+
+    # Force log level to debug when specified on commandline:
+    if arguments.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    try:
+        asyncio.run(serve(arguments))
+    except KeyboardInterrupt as e:
+        msg = "Interrupted by keyboard: {}".format(str(e))
+        logger.error(msg)
+        sys.exit(1)
+    except Exception as e:
+        msg = "Exception while serving: {}".format(str(e))
+        logger.fatal(msg)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 import json
+import logging
 import serial
 import sys
-
-from smartmeter.library import get_configured_logger
+from typing import Dict, List
 
 
 class SerialConfigException(ValueError):
@@ -143,6 +143,38 @@ class SerialConfig:
             raise SerialConfigException("Port invalid")
 
 
+def from_dict(configuration: dict) -> SerialConfig:
+    """Create a SerialConfig object from a dictionary, e.g. the 'p1' section of the configuration file
+
+    :param configuration:   A dictionary with (a subset of) the SerialConfig parameters
+    :type configuration:    dict
+
+    :rtype:                 SerialConfig
+
+    :exception:             SerialConfigException
+    """
+    parameters = ["baudrate", "bytesize", "parity", "stopbits", "xonxoff", "rtscts", "timeout", "port"]
+
+    unknown = set(configuration.keys()) - set(parameters)
+    if unknown:
+        raise SerialConfigException(f"Unknown serial parameters: {sorted(unknown)}. Valid parameters: {parameters}")
+
+    return SerialConfig(**configuration)
+
+
+def _read_file(filename: str) -> dict:
+    """Read the JSON configuration file, exit when the file can not be processed"""
+    logger = logging.getLogger(__name__)
+
+    try:
+        with open(filename) as file_handler:
+            return json.load(file_handler)
+    except (OSError, ValueError) as e:
+        msg = f"Can not process file '{filename}' because of eror: {str(e)}"
+        logger.critical(msg)
+        sys.exit(1)
+
+
 def load_from_file(filename: str) -> SerialConfig:
     """Load the configuration from a file
 
@@ -155,17 +187,65 @@ def load_from_file(filename: str) -> SerialConfig:
     :exception:         SerialConfigException
     :exception:         OSError
     """
+    configuration_file_content = _read_file(filename)
 
-    logger = get_configured_logger()
+    if "p1" not in configuration_file_content:
+        raise SerialConfigException(f"No 'p1' section found in '{filename}'")
 
-    try:
-        with open(filename) as file_handler:
-            configuration_file_content = json.load(file_handler)
-    except OSError as e:
-        msg = f"Can not process file '{filename}' because of eror: {str(e)}"
-        logger.critical(msg)
-        sys.exit(1)
+    return from_dict(configuration_file_content["p1"])
+
+
+def load_meters_from_file(filename: str) -> Dict[str, SerialConfig]:
+    """Load the configuration of all meters from a file
+
+    Multiple meters are configured in a 'meters' section, the key is the name of the meter:
+
+        {"meters": {"main": {"port": "/dev/ttyUSB0", ...}, "solar": {"port": "/dev/ttyUSB1", ...}}}
+
+    A file with only a 'p1' section is read as a single meter, named after its port.
+
+    :param filename:    The filename to use
+    :type filename:     str
+
+    :rtype:             Dict[str, SerialConfig]
+    :returns:           The SerialConfig objects by name of the meter
+
+    :exception:         SerialConfigException
+    """
+    configuration_file_content = _read_file(filename)
+
+    if "meters" in configuration_file_content:
+        return {
+            name: from_dict(meter_configuration)
+            for name, meter_configuration in configuration_file_content["meters"].items()
+        }
+
+    if "p1" in configuration_file_content:
+        serial_config = from_dict(configuration_file_content["p1"])
+        return {serial_config.port: serial_config}
+
+    raise SerialConfigException(f"No 'meters' or 'p1' section found in '{filename}'")
+
+
+def load_sinks_from_file(filename: str) -> List[dict]:
+    """Load the sink configuration from a file
+
+    The sinks are configured in a 'sinks' section, a list with the 'type' and parameters of every sink:
+
+        {"p1": {...}, "sinks": [{"type": "sqlite", "filename": "smartmeter.db", "batch_size": 100}]}
+
+    :param filename:    The filename to use
+    :type filename:     str
+
+    :rtype:             List[dict]
+    :returns:           The configuration of every sink, an empty list when the file has no 'sinks' section
+
+    :exception:         SerialConfigException
+    """
+    configuration_file_content = _read_file(filename)
+
+    sinks = configuration_file_content.get("sinks", [])
+    if not isinstance(sinks, list) or not all(isinstance(sink, dict) for sink in sinks):
+        raise SerialConfigException(f"The 'sinks' section of '{filename}' should be a list of objects")
 
-    # TODO:
-    #  - validate the dict we got from the configuration file
-    #  - return dict
+    return sinks
@@ -1,6 +1,11 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
 import time
 import sys
+from typing import TextIO, Tuple
 
 
 def get_configured_logger(
@@ -31,6 +36,18 @@ def get_configured_logger(
 
     logger = logging.getLogger(name)
 
+    _set_level(logger, level)
+
+    # First remove all handlers if any, to prevent multiple handlers:
+    logger.handlers = []
+
+    logger.addHandler(_stream_handler(sys.stdout))
+
+    return logger
+
+
+def _set_level(logger: logging.Logger, level: int = None):
+    """Set the level of a logger, WARNING when the level is not valid"""
     log_levels = [
         logging.CRITICAL,
         logging.ERROR,
@@ -45,17 +62,209 @@ def get_configured_logger(
 
     logger.setLevel(log_level)
 
-    handler = logging.StreamHandler(stream=sys.stdout)
+
+def _stream_handler(stream: TextIO) -> logging.Handler:
+    """The handler of the configured loggers: a stream, with UTC timestamps"""
+    handler = logging.StreamHandler(stream=stream)
 
     logging_format = "%(asctime)-15s UTC - %(name)s - %(levelname)s - %(message)s"
     formatter = logging.Formatter(fmt=logging_format)
     formatter.converter = time.gmtime
 
     handler.setFormatter(formatter)
+    return handler
+
+
+# Argument types which can not change after the call, a record with only these can be formatted later:
+_IMMUTABLE_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler which never blocks the logging thread
+
+    The message is formatted by the listener thread, unless the record has arguments which may change in the
+    meantime (e.g. a dict of a telegram). When the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+
+        # Counters:
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE_TYPES) for arg in args)):
+            # Format now, the arguments may be changed by the time the listener formats the record:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """A QueueListener which waits for room in a full queue to stop, instead of failing"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class LoggingPipeline:
+    """A queue-based logging setup, see get_queued_logger()"""
+
+    def __init__(self, handler: NonBlockingQueueHandler, listener: _QueueListener):
+        self.handler = handler
+        self.listener = listener
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    @property
+    def dropped(self) -> int:
+        """Amount of records dropped because the queue was full"""
+        return self.handler.dropped
+
+    def stop(self):
+        """Write all queued records and stop the background thread, can be called more than once"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self.listener.stop()
+        if self.handler.dropped:
+            sys.stderr.write(f"Logging queue was full, {self.handler.dropped} log records dropped\n")
+
+
+def get_queued_logger(
+        name: str = None,
+        level: int = None,
+        max_queue: int = 10000,
+        stream: TextIO = None
+) -> Tuple[logging.Logger, LoggingPipeline]:
+    """Create a logger like get_configured_logger(), but formatting and writing happen in a background thread
+
+    The logging calls only put the record in a bounded queue, they never wait for the output: a slow terminal or
+    disk does not block the serial reads. When the queue is full, records are dropped and counted. The background
+    thread is stopped at exit, after writing the queued records.
+
+    :param name:        The name of the logger to use. When left empty the RootLogger will be used
+    :type name:         str
+
+    :param level:       The desired level to use, see get_configured_logger(). Default value: WARNING
+    :type level:        int
+
+    :param max_queue:   Maximum amount of queued records. Default value: 10000
+    :type max_queue:    int
+
+    :param stream:      The stream to write the log to. Default value: sys.stderr, standard output is left to the
+                        output of the program (e.g. NDJSON)
+    :type stream:       TextIO
+
+    :rtype:             Tuple[logging.Logger, LoggingPipeline]
+    :returns:           The logger, and the pipeline to stop the background thread and to get the dropped records
+    """
+    logger = logging.getLogger(name)
+
+    _set_level(logger, level)
+
+    log_queue = queue.Queue(maxsize=max_queue)
+    handler = NonBlockingQueueHandler(log_queue)
+    stream = stream if stream is not None else sys.stderr
+    listener = _QueueListener(log_queue, _stream_handler(stream), respect_handler_level=True)
 
     # First remove all handlers if any, to prevent multiple handlers:
     logger.handlers = []
 
     logger.addHandler(handler)
 
-    return logger
+    pipeline = LoggingPipeline(handler, listener)
+    listener.start()
+    atexit.register(pipeline.stop)
+
+    return logger, pipeline
+
+
+class LogSampler:
+    """Decide whether a frequent message should be logged: the first one and then every n-th one, or at most once
+    per interval
+
+    Check the sampler before the logging call, the message is not even created when it is skipped:
+
+        sampler = LogSampler(every=100)
+        if sampler():
+            logger.info("Telegram %s (%d skipped)", header, sampler.skipped)
+    """
+
+    def __init__(self, every: int = 100, interval: float = None):
+        """
+        :param every:       Log one of every this amount of calls. Default value: 100
+        :type every:        int
+
+        :param interval:    Log at most once per this amount of seconds instead. Default value: off
+        :type interval:     float
+        """
+        if every < 1:
+            raise ValueError("every must be at least 1")
+
+        self.every = every
+        self.interval = interval
+        self._calls = 0
+        self._next_time = 0.0
+
+        # Counters:
+        self.skipped = 0
+
+    def __call__(self) -> bool:
+        if self.interval is not None:
+            now = time.monotonic()
+            if now < self._next_time:
+                self.skipped += 1
+                return False
+            self._next_time = now + self.interval
+        else:
+            self._calls += 1
+            if (self._calls - 1) % self.every:
+                self.skipped += 1
+                return False
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """A logging filter which passes the first and then every n-th record of every message, e.g. for a handler of
+    per-line or per-telegram logs of third party code. Prefer LogSampler in our own code, it skips creating the record.
+
+    Records are grouped by their unformatted message, so the arguments must be passed separately
+    (logger.info("Line %s", line)): every formatted f-string is a message of its own.
+    """
+
+    # Forget the counts when this amount of different messages is seen, to bound the memory use:
+    MAX_MESSAGES = 1024
+
+    def __init__(self, every: int = 100, name: str = ""):
+        """
+        :param every:   Pass one of every this amount of records with the same message. Default value: 100
+        :type every:    int
+
+        :param name:    See logging.Filter. Default value: all loggers
+        :type name:     str
+        """
+        super().__init__(name)
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.every = every
+        self._counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not super().filter(record):
+            return False
+        # Sample by the unformatted message, i.e. by logging call:
+        key = (record.name, record.msg if isinstance(record.msg, str) else id(record.msg))
+        count = self._counts.get(key, 0)
+        if not count and len(self._counts) >= self.MAX_MESSAGES:
+            self._counts.clear()
+        self._counts[key] = count + 1
+        return count % self.every == 0
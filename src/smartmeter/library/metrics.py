@@ -0,0 +1,329 @@
+"""A small in-process metrics registry with a Prometheus text exporter
+
+Instrumented classes take an optional registry: without one (the default) they skip all timing with a single
+'is None' check per chunk or telegram, so disabled metrics cost next to nothing. The hot path only updates plain
+counters and histograms; values which are counted anyway (e.g. the statistics of the framers and queues) are read
+by collectors when the metrics are exported.
+
+Updates are not locked. With several worker threads an update can get lost on an unlucky thread switch, which is
+acceptable for monitoring and much cheaper than a lock per update.
+
+    registry = MetricsRegistry()
+    parse_seconds = registry.histogram("p1_parse_seconds", "Time to parse a telegram")
+    ...
+    MetricsServer(registry, port=9100).start()
+"""
+import bisect
+import http.server
+import logging
+import math
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+# Upper bounds in seconds, from the parsing of one line up to a slow disk write:
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A collected sample: name, type ('counter' or 'gauge'), help text, labels and value
+Sample = Tuple[str, str, str, Dict[str, str], float]
+
+
+class Counter:
+    """A value which only increases"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Histogram:
+    """Counts of observed values (e.g. durations in seconds) per bucket, with their count and sum"""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        """
+        :param buckets:     The upper bounds of the buckets, in increasing order. Default value: DEFAULT_BUCKETS
+        :type buckets:      Iterable[float]
+        """
+        self.buckets = tuple(buckets)
+        # One count per bucket and one for the values above the largest bound:
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, quantile: float) -> float:
+        """Estimate a quantile, the upper bound of the bucket it falls in (infinity above the largest bound)"""
+        if not self.count:
+            return math.nan
+        rank = quantile * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+def _format_labels(labels: Dict[str, str], extra: str = None) -> str:
+    """Labels in the Prometheus text format, e.g. '{meter="main",le="0.5"}'"""
+    parts = [
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in sorted(labels.items())
+    ]
+    if extra is not None:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry:
+    """All metrics of a process, by name and labels"""
+
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], object] = {}
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, help_text: str, labels: Dict[str, str], factory: Callable):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                described = self._descriptions.setdefault(name, (kind, help_text))
+                if described[0] != kind:
+                    raise ValueError(f"Metric '{name}' is already registered as a {described[0]}")
+                metric = self._metrics[key] = factory()
+            return metric
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        """Get or create a counter
+
+        :param name:        The name of the metric, e.g. 'p1_telegrams_total'
+        :type name:         str
+
+        :param help_text:   The description of the metric
+        :type help_text:    str
+
+        :param labels:      The labels of this instance of the metric, e.g. meter='main'
+
+        :rtype:             Counter
+        """
+        return self._get("counter", name, help_text, labels, Counter)
+
+    def histogram(self, name: str, help_text: str = "", buckets: Iterable[float] = DEFAULT_BUCKETS,
+                  **labels) -> Histogram:
+        """Get or create a histogram, see counter()
+
+        :param buckets:     The upper bounds of the buckets. Default value: DEFAULT_BUCKETS
+        :type buckets:      Iterable[float]
+
+        :rtype:             Histogram
+        """
+        return self._get("histogram", name, help_text, labels, lambda: Histogram(buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Add a function which returns samples of values counted elsewhere, called on every export
+
+        :param collector:   Returns (name, 'counter' or 'gauge', help text, labels, value) tuples
+        :type collector:    Callable[[], Iterable[Sample]]
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format
+
+        :rtype:     str
+        """
+        logger = logging.getLogger(__name__)
+
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+            descriptions = dict(self._descriptions)
+            collectors = list(self._collectors)
+
+        families: Dict[str, List[str]] = {}
+        for (name, labels), metric in metrics:
+            lines = families.setdefault(name, [])
+            labels = dict(labels)
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), metric.counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels, 'le="' + _format_value(bound) + '"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(metric.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(metric.value)}")
+
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.error(f"Exception in metrics collector {getattr(collector, '__name__', collector)}: {str(e)}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                descriptions.setdefault(name, (kind, help_text))
+                families.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        output = []
+        for name, lines in families.items():
+            kind, help_text = descriptions[name]
+            if help_text:
+                output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+    def dump(self, filename: str):
+        """Write all metrics to a file, atomically, e.g. for the textfile collector of the Prometheus node exporter
+
+        :param filename:    The file to write
+        :type filename:     str
+        """
+        temporary_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(temporary_filename, "w", encoding="utf-8") as file_handler:
+            file_handler.write(self.render())
+        os.replace(temporary_filename, filename)
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the metrics of the registry of the server on any path"""
+
+    def do_GET(self):
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+
+class MetricsServer:
+    """Serve the metrics over HTTP in the Prometheus text format, from a background thread"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9100):
+        """
+        :param registry:    The metrics to serve
+        :type registry:     MetricsRegistry
+
+        :param host:        The address to listen on. Default value: 127.0.0.1
+        :type host:         str
+
+        :param port:        The port to listen on. Default value: 9100
+        :type port:         int
+        """
+        self.logger = logging.getLogger(__name__)
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start listening
+
+        :exception:     OSError when the port is in use
+        """
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), _MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        # The actual port, e.g. when port 0 was requested:
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        self.logger.debug(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+    def __enter__(self) -> 'MetricsServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MetricsFile:
+    """Dump the metrics to a file at a fixed interval, from a background thread"""
+
+    def __init__(self, registry: MetricsRegistry, filename: str, interval: float = 10.0):
+        """
+        :param registry:    The metrics to dump
+        :type registry:     MetricsRegistry
+
+        :param filename:    The file to (over)write
+        :type filename:     str
+
+        :param interval:    Seconds between dumps. Default value: 10.0
+        :type interval:     float
+        """
+        self.logger = logging.getLogger(__name__)
+        self.registry = registry
+        self.filename = filename
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-file", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop dumping, after a last dump"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._dump()
+
+    def __enter__(self) -> 'MetricsFile':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _dump(self):
+        try:
+            self.registry.dump(self.filename)
+        except OSError as e:
+            self.logger.error(f"Can not write the metrics to '{self.filename}': {str(e)}")
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self._dump()
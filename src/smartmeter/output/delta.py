@@ -0,0 +1,198 @@
+"""Change-only (delta) emission of telegrams
+
+Most values of consecutive telegrams are the same: the serial number, the tariff, the switch position and, within a
+few seconds, the energy registers too. The DeltaEncoder compares every telegram with the previous telegram of the same
+meter and emits only what changed, with a full keyframe at a fixed interval:
+
+    {"type":"keyframe","source":"/dev/ttyUSB0","sequence":0,"header":"/ISk5...","updatedatetime":...,"data":{...}}
+    {"type":"delta","source":"/dev/ttyUSB0","sequence":1,"updatedatetime":...,"data":{"1-0:1.7.0":0.17}}
+    {"type":"delta","source":"/dev/ttyUSB0","sequence":2,"updatedatetime":...,"data":{},"removed":["0-0:96.13.0"]}
+
+The DeltaDecoder rebuilds the full telegram from a keyframe and the deltas after it. The sequence number is counted
+per meter: a consumer which misses a message (or starts in the middle of a stream) waits for the next keyframe.
+"""
+import datetime
+import logging
+from typing import Dict, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import TelegramRecord
+
+
+TYPE_KEYFRAME = "keyframe"
+TYPE_DELTA = "delta"
+
+_MISSING = object()
+
+
+class _MeterState:
+    """The last emitted state of one meter"""
+
+    __slots__ = ("header", "data", "sequence", "since_keyframe")
+
+    def __init__(self):
+        self.header = None
+        self.data = {}
+        self.sequence = -1
+        self.since_keyframe = 0
+
+
+class DeltaEncoder:
+    """Turn telegrams into keyframe and delta messages"""
+
+    def __init__(self, keyframe_interval: int = 60):
+        """
+        :param keyframe_interval:   Emit a full keyframe every this amount of telegrams per meter, 1 emits keyframes
+                                    only. Default value: 60
+        :type keyframe_interval:    int
+        """
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+
+        self.keyframe_interval = keyframe_interval
+        self._meters: Dict[str, _MeterState] = {}
+
+        # Counters:
+        self.keyframes = 0
+        self.deltas = 0
+        self.values = 0
+        self.changed_values = 0
+
+    def encode(self, telegram: Union[Telegram, TelegramRecord]) -> dict:
+        """Encode one telegram
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+
+        :return:            A keyframe or delta message
+        :rtype:             dict
+        """
+        if isinstance(telegram, TelegramRecord):
+            header, updatedatetime, data = telegram.header, telegram.timestamp, telegram.data()
+        else:
+            header, updatedatetime, data = (telegram.telegram['header'], telegram.telegram['updatedatetime'],
+                                            telegram.telegram['data'])
+
+        state = self._meters.get(telegram.source)
+        if state is None:
+            state = self._meters[telegram.source] = _MeterState()
+
+        state.sequence += 1
+        self.values += len(data)
+
+        if state.header != header or state.since_keyframe >= self.keyframe_interval - 1:
+            state.header = header
+            state.data = dict(data)
+            state.since_keyframe = 0
+            self.keyframes += 1
+            self.changed_values += len(data)
+            return {
+                "type": TYPE_KEYFRAME,
+                "source": telegram.source,
+                "sequence": state.sequence,
+                "header": header,
+                "updatedatetime": updatedatetime,
+                "data": dict(data)
+            }
+
+        previous = state.data
+        changed = {obis_id: value for obis_id, value in data.items() if previous.get(obis_id, _MISSING) != value}
+        removed = [obis_id for obis_id in previous if obis_id not in data]
+
+        state.data = dict(data)
+        state.since_keyframe += 1
+        self.deltas += 1
+        self.changed_values += len(changed)
+
+        message = {
+            "type": TYPE_DELTA,
+            "source": telegram.source,
+            "sequence": state.sequence,
+            "updatedatetime": updatedatetime,
+            "data": changed
+        }
+        if removed:
+            message["removed"] = removed
+        return message
+
+    def reset(self, source: str = None):
+        """Forget the state of one or all meters, the next telegram of the meter is a keyframe
+
+        :param source:  The meter. Default value: all meters
+        :type source:   str
+        """
+        if source is None:
+            self._meters.clear()
+        else:
+            self._meters.pop(source, None)
+
+    def as_dict(self) -> dict:
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "values": self.values,
+            "changed_values": self.changed_values
+        }
+
+
+class DeltaDecoder:
+    """Rebuild full telegrams from keyframe and delta messages"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._meters: Dict[str, _MeterState] = {}
+
+        # Counters:
+        self.decoded = 0
+        self.skipped = 0
+        self.gaps = 0
+
+    def decode(self, message: dict) -> Union[dict, None]:
+        """Apply a message to the state of its meter
+
+        :param message:     A keyframe or delta message, as created by DeltaEncoder.encode()
+        :type message:      dict
+
+        :return:            The full telegram, in the format of smartmeter.output.ndjson.telegram_as_dict(). None when
+                            the state of the meter is unknown (no keyframe yet or a message was missed), or when the
+                            message is not a keyframe or delta.
+        :rtype:             Union[dict, None]
+        """
+        message_type = message.get("type")
+        source = message.get("source")
+
+        if message_type == TYPE_KEYFRAME:
+            state = self._meters.get(source)
+            if state is None:
+                state = self._meters[source] = _MeterState()
+            state.header = message["header"]
+            state.data = dict(message["data"])
+
+        elif message_type == TYPE_DELTA:
+            state = self._meters.get(source)
+            if state is None or state.sequence + 1 != message["sequence"]:
+                if state is not None:
+                    self.gaps += 1
+                    self.logger.debug(f"Message(s) of meter '{source}' missed, waiting for the next keyframe")
+                    del self._meters[source]
+                self.skipped += 1
+                return None
+
+            state.data.update(message["data"])
+            for obis_id in message.get("removed", ()):
+                state.data.pop(obis_id, None)
+
+        else:
+            return None
+
+        state.sequence = message["sequence"]
+        self.decoded += 1
+
+        return {
+            "type": "telegram",
+            "source": source,
+            "header": state.header,
+            "datetime": datetime.datetime.fromtimestamp(message["updatedatetime"]).isoformat(),
+            "updatedatetime": message["updatedatetime"],
+            "data": dict(state.data)
+        }
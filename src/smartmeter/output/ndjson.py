@@ -0,0 +1,170 @@
+"""Streaming newline delimited JSON (NDJSON) output
+
+The first line is a schema record with the description and type of every OBIS code, every following line is one
+telegram without indentation:
+
+    {"type":"schema","obiscodes":{"1-0:1.8.1":{"description":"...","type":"float"},...}}
+    {"type":"telegram","source":"/dev/ttyUSB0","header":"/ISk5\\2MT382-1003","datetime":"...","data":{...}}
+
+Lines are buffered and written when the buffer exceeds a size or age threshold. The age is also checked by a timer,
+so the last lines are written within the flush interval even when no further telegram arrives.
+"""
+import datetime
+import json
+import sys
+import threading
+import time
+from typing import TextIO, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import TelegramRecord
+
+
+# Compact JSON, without indentation and whitespace:
+encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+def telegram_as_dict(telegram: Union[Telegram, TelegramRecord]) -> dict:
+    """The JSON record of a telegram, as written by NdjsonWriter and served by the web server
+
+    :param telegram:    The parsed telegram or a record
+    :type telegram:     Union[Telegram, TelegramRecord]
+
+    :rtype:             dict
+    """
+    if isinstance(telegram, TelegramRecord):
+        header, updatedatetime, data = telegram.header, telegram.timestamp, telegram.data()
+    else:
+        header, updatedatetime, data = (telegram.telegram['header'], telegram.telegram['updatedatetime'],
+                                        telegram.telegram['data'])
+
+    return {
+        "type": "telegram",
+        "source": telegram.source,
+        "header": header,
+        "datetime": datetime.datetime.fromtimestamp(updatedatetime).isoformat(),
+        "updatedatetime": updatedatetime,
+        "data": data
+    }
+
+
+class NdjsonWriter:
+    """Write telegrams as NDJSON to a text stream"""
+
+    def __init__(
+            self,
+            stream: TextIO = None,
+            flush_bytes: int = 65536,
+            flush_interval: float = 1.0,
+            obis_codes: dict = None
+    ):
+        """
+        :param stream:          The stream to write to. Default value: sys.stdout
+        :type stream:           TextIO
+
+        :param flush_bytes:     Write the buffer when it holds at least this amount of characters. Default value: 65536
+        :type flush_bytes:      int
+
+        :param flush_interval:  Write the buffer at the latest this amount of seconds after the oldest line was added,
+                                0 writes every line immediately. Default value: 1.0
+        :type flush_interval:   float
+
+        :param obis_codes:      The OBIS code table for the schema record. Default value: Telegram.OBIS_CODES
+        :type obis_codes:       dict
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.obis_codes = obis_codes if obis_codes is not None else Telegram.OBIS_CODES
+
+        self._buffer = []
+        self._buffered = 0
+        self._oldest = None
+        self._schema_written = False
+        # Flushes the buffer when its oldest line is due, lines are added by the caller and written by the timer:
+        self._timer = None
+        self._lock = threading.Lock()
+
+        # Counters:
+        self.lines = 0
+
+    def __enter__(self) -> 'NdjsonWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_schema(self):
+        """Write the schema record, done automatically in front of the first telegram"""
+        self._schema_written = True
+        self._append(encode({
+            "type": "schema",
+            "obiscodes": {
+                obis_id: {"description": code['description'], "type": code['type']}
+                for obis_id, code in self.obis_codes.items()
+            }
+        }))
+
+    def write(self, telegram: Union[Telegram, TelegramRecord]):
+        """Write one telegram
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+        """
+        self.write_record(telegram_as_dict(telegram))
+
+    def write_record(self, record: dict):
+        """Write any other JSON serializable record, e.g. a closed rollup window
+
+        :param record:  The record, should have a 'type' key to tell it apart from telegrams
+        :type record:   dict
+        """
+        if not self._schema_written:
+            self.write_schema()
+        self._append(encode(record))
+
+    def _append(self, line: str):
+        with self._lock:
+            self._buffer.append(line)
+            self._buffer.append("\n")
+            self._buffered += len(line) + 1
+            self.lines += 1
+
+            now = time.monotonic()
+            if self._oldest is None:
+                self._oldest = now
+
+            if self._buffered >= self.flush_bytes or now - self._oldest >= self.flush_interval:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_due)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_due(self):
+        """Called by the timer, when the oldest buffered line is due"""
+        with self._lock:
+            # A flush in the meantime replaced or stopped this timer:
+            if self._timer is threading.current_thread():
+                self._timer = None
+                self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer:
+            self.stream.write("".join(self._buffer))
+            self.stream.flush()
+            self._buffer.clear()
+        self._buffered = 0
+        self._oldest = None
+
+    def flush(self):
+        """Write all buffered lines to the stream"""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Write all buffered lines, the stream is not closed"""
+        self.flush()
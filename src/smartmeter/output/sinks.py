@@ -0,0 +1,382 @@
+"""Sinks: the destinations the read loop feeds every telegram to
+
+Every sink has the same interface: write(telegram), flush() and close(). Sinks which write to disk buffer the
+telegrams and write them in batches, when the batch is full or the oldest buffered telegram is older than the flush
+interval (checked when a telegram is written, and by a timer when no next telegram arrives). One transaction per
+batch instead of one per telegram is what keeps a Raspberry Pi with an SD card up to speed, and spares the card.
+
+Sinks are configured in a 'sinks' section of the configuration file, next to the 'p1' section:
+
+    {
+        "p1": {...},
+        "sinks": [
+            {"type": "sqlite", "filename": "smartmeter.db", "batch_size": 100, "flush_interval": 5.0},
+            {"type": "ndjson", "filename": "telegrams.ndjson"},
+            {"type": "timeseries", "path": "store"},
+            {"type": "archive", "filename": "telegrams.smarch", "block_size": 3600}
+        ]
+    }
+"""
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from typing import List, Union
+
+from smartmeter.output.delta import DeltaEncoder
+from smartmeter.output.ndjson import NdjsonWriter
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import DEFAULT_SCHEMA, TelegramRecord, TelegramSchema, meter_timestamp
+from smartmeter.storage.archive import ArchiveWriter
+from smartmeter.storage.timeseries import TimeSeriesStore
+
+
+class SinkException(ValueError):
+    """Invalid sink configuration"""
+    pass
+
+
+class Sink:
+    """Base class of all sinks"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+        # Counters:
+        self.written = 0
+
+    def __enter__(self) -> 'Sink':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, telegram: Union[Telegram, TelegramRecord]):
+        """Write one telegram
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+        """
+        raise NotImplementedError()
+
+    def flush(self):
+        """Write all buffered telegrams"""
+        pass
+
+    def close(self):
+        """Write all buffered telegrams and release the resources of the sink"""
+        self.flush()
+
+    def as_dict(self) -> dict:
+        return {"sink": self.__class__.__name__, "written": self.written}
+
+
+class BatchedSink(Sink):
+    """Base class of the sinks which write telegrams in batches, subclasses implement write_batch()"""
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5.0, schema: TelegramSchema = None):
+        """
+        :param batch_size:      Write the buffered telegrams when this amount is reached. Default value: 100
+        :type batch_size:       int
+
+        :param flush_interval:  Write the buffered telegrams when the oldest one is older than this amount of seconds.
+                                Default value: 5.0
+        :type flush_interval:   float
+
+        :param schema:          The schema to buffer the telegrams with. Default value: DEFAULT_SCHEMA
+        :type schema:           TelegramSchema
+        """
+        super().__init__()
+
+        if batch_size < 1:
+            raise SinkException("batch_size must be at least 1")
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+
+        self._batch: List[TelegramRecord] = []
+        self._oldest = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+        # Counters:
+        self.batches = 0
+
+    def write(self, telegram: Union[Telegram, TelegramRecord]):
+        if not isinstance(telegram, TelegramRecord) or telegram.schema is not self.schema:
+            if isinstance(telegram, TelegramRecord):
+                telegram = telegram.to_telegram()
+            telegram = self.schema.record(telegram)
+
+        with self._lock:
+            self._batch.append(telegram)
+
+            now = time.monotonic()
+            if self._oldest is None:
+                self._oldest = now
+
+            if len(self._batch) >= self.batch_size or now - self._oldest >= self.flush_interval:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_due)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_due(self):
+        """Called by the timer, when the oldest buffered telegram is due"""
+        with self._lock:
+            # A flush in the meantime replaced or stopped this timer:
+            if self._timer is threading.current_thread():
+                self._timer = None
+                self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._batch:
+            self.write_batch(self._batch)
+            self.written += len(self._batch)
+            self.batches += 1
+            self._batch = []
+        self._oldest = None
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def write_batch(self, records: List[TelegramRecord]):
+        """Write a batch of records
+
+        :param records:     The records, in order of arrival
+        :type records:      List[TelegramRecord]
+        """
+        raise NotImplementedError()
+
+    def as_dict(self) -> dict:
+        return dict(super().as_dict(), batches=self.batches, buffered=len(self._batch))
+
+
+class SqliteSink(BatchedSink):
+    """Write telegrams to a SQLite database, one row per telegram and one column per OBIS code
+
+    The timestamp column is the time of the readings, see meter_timestamp().
+
+    The database runs in WAL mode with synchronous=NORMAL: a batch is one transaction, one prepared INSERT statement
+    executed for all rows of the batch.
+    """
+
+    SQL_TYPES = {"str": "TEXT", "int": "INTEGER", "float": "REAL", "timestamp": "REAL"}
+
+    def __init__(
+            self,
+            filename: str = "smartmeter.db",
+            table: str = "telegrams",
+            batch_size: int = 100,
+            flush_interval: float = 5.0,
+            schema: TelegramSchema = None
+    ):
+        """
+        :param filename:        The database file. Default value: smartmeter.db
+        :type filename:         str
+
+        :param table:           The table to insert the telegrams into, created when needed and extended with the
+                                columns of new OBIS codes. Default value: telegrams
+        :type table:            str
+
+        See BatchedSink for the other parameters.
+        """
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval, schema=schema)
+
+        if not table.isidentifier():
+            raise SinkException(f"Invalid table name '{table}'")
+
+        self.filename = filename
+        self.table = table
+
+        # The sink is written from other threads than the one which created it (the pipeline workers and the flush
+        # timer), but never concurrently:
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        columns = {
+            field: f"{field} {self.SQL_TYPES.get(data_type, 'REAL')}"
+            for field, data_type in zip(self.schema.fields, self.schema.types)
+        }
+        with self._connection:
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(timestamp REAL NOT NULL, source TEXT, header TEXT, {', '.join(columns.values())})"
+            )
+            existing = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+            for field, column in columns.items():
+                if field not in existing:
+                    self.logger.info(f"Adding column {field} to table '{table}'")
+                    self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_source_timestamp ON {table} (source, timestamp)"
+            )
+
+        names = ["timestamp", "source", "header"] + list(self.schema.fields)
+        self._insert = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+
+        self.logger.debug(f"Writing telegrams to table '{table}' of {filename}")
+
+    def write_batch(self, records: List[TelegramRecord]):
+        with self._connection:
+            self._connection.executemany(
+                self._insert,
+                [(meter_timestamp(record), record.source, record.header) + record.values() for record in records]
+            )
+
+    def close(self):
+        super().close()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class NdjsonSink(Sink):
+    """Write telegrams as NDJSON, see smartmeter.output.ndjson, optionally as keyframes and deltas"""
+
+    def __init__(
+            self,
+            filename: str = None,
+            flush_bytes: int = 65536,
+            flush_interval: float = 1.0,
+            keyframe_interval: int = None
+    ):
+        """
+        :param filename:            The file to append to. Default value: standard output
+        :type filename:             str
+
+        :param keyframe_interval:   Write only the changed values, with a full keyframe every this amount of
+                                    telegrams, see smartmeter.output.delta. Default value: off, full telegrams
+        :type keyframe_interval:    int
+
+        See NdjsonWriter for the other parameters.
+        """
+        super().__init__()
+        self.filename = filename
+        self.encoder = DeltaEncoder(keyframe_interval) if keyframe_interval is not None else None
+        self._file = open(filename, "a", encoding="utf-8") if filename is not None else None
+        self.writer = NdjsonWriter(
+            stream=self._file if self._file is not None else sys.stdout,
+            flush_bytes=flush_bytes,
+            flush_interval=flush_interval
+        )
+
+    def write(self, telegram: Union[Telegram, TelegramRecord]):
+        if self.encoder is not None:
+            self.writer.write_record(self.encoder.encode(telegram))
+        else:
+            self.writer.write(telegram)
+        self.written += 1
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def as_dict(self) -> dict:
+        if self.encoder is not None:
+            return dict(super().as_dict(), **self.encoder.as_dict())
+        return super().as_dict()
+
+
+class TimeSeriesSink(Sink):
+    """Append telegrams to a TimeSeriesStore, see smartmeter.storage.timeseries"""
+
+    def __init__(self, path: str, index_interval: int = 64):
+        """
+        :param path:            Directory of the store
+        :type path:             str
+
+        :param index_interval:  See TimeSeriesStore. Default value: 64
+        :type index_interval:   int
+        """
+        super().__init__()
+        self.path = path
+        self.store = TimeSeriesStore(path, index_interval=index_interval)
+
+    def write(self, telegram: Union[Telegram, TelegramRecord]):
+        if self.store.append(telegram):
+            self.written += 1
+
+    def close(self):
+        self.store.close()
+
+    def as_dict(self) -> dict:
+        return dict(super().as_dict(), dropped=self.store.records_dropped)
+
+
+class ArchiveSink(Sink):
+    """Append telegrams to a compressed archive, see smartmeter.storage.archive"""
+
+    def __init__(self, filename: str, block_size: int = 3600, compression_level: int = 6):
+        """
+        :param filename:    The archive file, appended to when it exists
+        :type filename:     str
+
+        See ArchiveWriter for the other parameters.
+        """
+        super().__init__()
+        self.filename = filename
+        self.writer = ArchiveWriter(filename, block_size=block_size, compression_level=compression_level)
+
+    def write(self, telegram: Union[Telegram, TelegramRecord]):
+        self.writer.append(telegram)
+        self.written += 1
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+    def as_dict(self) -> dict:
+        return dict(super().as_dict(), blocks=self.writer.blocks_written, bytes=self.writer.bytes_written)
+
+
+SINK_TYPES = {
+    "sqlite": SqliteSink,
+    "ndjson": NdjsonSink,
+    "timeseries": TimeSeriesSink,
+    "archive": ArchiveSink
+}
+
+
+def create_sink(configuration: dict) -> Sink:
+    """Create a sink from its configuration, e.g. an entry of the 'sinks' section of the configuration file
+
+    :param configuration:   The 'type' of the sink (one of SINK_TYPES) and the parameters of its class
+    :type configuration:    dict
+
+    :rtype:                 Sink
+
+    :exception:             SinkException
+    """
+    parameters = dict(configuration)
+    sink_type = parameters.pop("type", None)
+    if sink_type not in SINK_TYPES:
+        raise SinkException(f"Unknown sink type '{sink_type}'. Valid types: {list(SINK_TYPES)}")
+
+    try:
+        return SINK_TYPES[sink_type](**parameters)
+    except TypeError as e:
+        raise SinkException(f"Invalid parameters for sink '{sink_type}': {str(e)}")
+
+
+def create_sinks(configurations: List[dict]) -> List[Sink]:
+    """Create all configured sinks, see create_sink()
+
+    :rtype:     List[Sink]
+    """
+    return [create_sink(configuration) for configuration in configurations]
@@ -0,0 +1,160 @@
+"""asyncio support for reading telegrams from a P1 port
+
+The serial port is switched to non-blocking mode and watched by the event loop, so reading never blocks
+other coroutines (HTTP, storage, ...) running in the same loop. Only POSIX event loops are supported.
+"""
+import asyncio
+import logging
+from typing import Iterable, Union
+
+from smartmeter.configuration import SerialConfig
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.frame import TelegramFramer
+from smartmeter.p1.read import P1Connection
+
+
+class AsyncTelegramReader:
+    """Read parsed telegrams from a P1 port with an async iterator
+
+    Usage:
+
+        async with AsyncTelegramReader(serial_config) as reader:
+            async for telegram in reader:
+                ...
+    """
+
+    def __init__(
+            self,
+            serial_config: SerialConfig = None,
+            max_queue: int = 64,
+            framer: TelegramFramer = None,
+            fields: Iterable[str] = None,
+            source: str = None
+    ):
+        """
+        :param serial_config:   The serial configuration. Defaults to an standard SerialConfig object
+        :type serial_config:    smartmeter.configuration.SerialConfig
+
+        :param max_queue:       Amount of telegrams to buffer when the consumer is too slow, the oldest telegram is
+                                dropped when the buffer is full. Default value: 64
+        :type max_queue:        int
+
+        :param framer:          The framer to use. Defaults to a TelegramFramer with CRC verification
+        :type framer:           smartmeter.p1.frame.TelegramFramer
+
+        :param fields:          Only parse these OBIS codes, see Telegram. Default value: all known OBIS codes
+        :type fields:           Iterable[str]
+
+        :param source:          Name of the meter, set as the source of every telegram. Default value: the port
+        :type source:           str
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.connection = P1Connection(serial_config=serial_config)
+        self.framer = framer if framer is not None else TelegramFramer()
+        self.fields = tuple(fields) if fields is not None else None
+        self.source = source if source is not None else self.serial_config.port
+        self.max_queue = max_queue
+
+        # Created by open(), inside the running event loop (before Python 3.10 a queue binds to the current loop):
+        self._queue = None
+        self._loop = None
+        self._fileno = None
+
+        # Counters:
+        self.telegrams = 0
+        self.dropped_telegrams = 0
+
+    @property
+    def serial_config(self) -> SerialConfig:
+        return self.connection.serial_config
+
+    def open(self):
+        """Open the serial port and start watching it in the running event loop"""
+        serial_connection = self.connection.serial_connection
+
+        # The event loop tells us when data is available, reads should never block:
+        serial_connection.timeout = 0
+        serial_connection.open()
+
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._fileno = serial_connection.fileno()
+        self._loop.add_reader(self._fileno, self._on_readable)
+        self.logger.debug(f"Watching {self.serial_config.port} for telegrams")
+
+    def close(self):
+        """Stop watching and close the serial port"""
+        if self._fileno is not None:
+            self._loop.remove_reader(self._fileno)
+            self._fileno = None
+            # Wake up a consumer waiting for the next telegram:
+            self._put(None)
+
+        if self.connection.serial_connection.is_open:
+            self.connection.serial_connection.close()
+
+    async def __aenter__(self) -> 'AsyncTelegramReader':
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __aiter__(self) -> 'AsyncTelegramReader':
+        return self
+
+    async def __anext__(self) -> Telegram:
+        return await self.read()
+
+    async def read(self) -> Telegram:
+        """Wait for the next complete telegram
+
+        A warning is logged each time no telegram arrives within the configured serial timeout.
+
+        :rtype:     smartmeter.p1.data.Telegram
+
+        :exception: StopAsyncIteration when the reader is closed
+        :exception: serial.SerialException when reading from the port failed
+        """
+        while True:
+            if self._queue is None or (self._fileno is None and self._queue.empty()):
+                raise StopAsyncIteration
+
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=self.serial_config.timeout or None)
+            except asyncio.TimeoutError:
+                self.logger.warning(f"No telegram received on {self.serial_config.port} "
+                                    f"within {self.serial_config.timeout} seconds")
+                continue
+
+            if item is None:
+                raise StopAsyncIteration
+            if isinstance(item, Exception):
+                raise item
+            return item
+
+    def _on_readable(self):
+        """Callback of the event loop: read everything waiting on the port and queue complete telegrams"""
+        serial_connection = self.connection.serial_connection
+        try:
+            chunk = serial_connection.read(serial_connection.in_waiting or 1)
+        except Exception as e:
+            self.logger.error(f"Exception while reading from serial connection: {str(e)}")
+            self._put(e)
+            self.close()
+            return
+
+        for frame in self.framer.feed(chunk):
+            telegram = Telegram.parse_bytes(frame, source=self.source, fields=self.fields)
+            if not telegram.has_header():
+                continue
+            self.telegrams += 1
+            self._put(telegram)
+
+    def _put(self, item: Union[Telegram, Exception, None]):
+        """Queue an item for the consumer (None marks the end), drop the oldest telegram when the queue is full"""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped_telegrams += 1
+        self._queue.put_nowait(item)
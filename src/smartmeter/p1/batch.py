@@ -0,0 +1,154 @@
+"""Parallel parsing of large telegram archives
+
+The archive is split into byte ranges on telegram boundaries ('/' header lines), each range is parsed by a worker
+process. Workers hand back compact column arrays (TelegramBatch) instead of a dictionary per telegram, the results
+are returned in the original order.
+"""
+import concurrent.futures
+import logging
+import mmap
+import os
+from typing import Iterator, List, Tuple
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.frame import check_crc, iter_frames
+from smartmeter.p1.record import TelegramBatch
+from smartmeter.p1.replay import frame_timestamp
+
+
+HEADER_PREFIXES = tuple(header.encode("ascii") for header in Telegram.TELEGRAM_HEADERS)
+
+
+class ParsedChunk(TelegramBatch):
+    """The parsed telegrams of one byte range of an archive"""
+
+    def __init__(self, start: int, end: int):
+        """
+        :param start:   Offset of the first byte of the range in the archive
+        :type start:    int
+
+        :param end:     Offset of the end of the range (exclusive)
+        :type end:      int
+        """
+        super().__init__()
+        self.start = start
+        self.end = end
+        self.crc_errors = 0
+
+
+def split_archive(filename: str, chunks: int) -> List[Tuple[int, int]]:
+    """Split an archive into byte ranges, each range starts at a telegram header
+
+    :param filename:    The archive to split
+    :type filename:     str
+
+    :param chunks:      The desired amount of ranges, fewer ranges are returned for small archives
+    :type chunks:       int
+
+    :rtype:             List[Tuple[int, int]]
+    :returns:           (start, end) offsets of the ranges, the end is exclusive
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+
+    boundaries = [0]
+    with open(filename, "rb") as file_handler, \
+            mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for chunk in range(1, chunks):
+            position = max(size * chunk // chunks, boundaries[-1])
+            while True:
+                position = data.find(b"\n/", position, size)
+                if position < 0:
+                    break
+                position += 1
+                if data[position:position + 16].startswith(HEADER_PREFIXES):
+                    break
+            if position < 0:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_range(filename: str, start: int, end: int, verify_crc: bool = True) -> ParsedChunk:
+    """Parse all telegrams in a byte range of an archive, used by the worker processes
+
+    :param filename:    The archive
+    :type filename:     str
+
+    :param start:       Offset of the range
+    :type start:        int
+
+    :param end:         Offset of the end of the range (exclusive)
+    :type end:          int
+
+    :param verify_crc:  Skip telegrams with an invalid checksum. Default value: True
+    :type verify_crc:   bool
+
+    :rtype:             ParsedChunk
+    """
+    chunk = ParsedChunk(start, end)
+
+    with open(filename, "rb") as file_handler, \
+            mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for frame_start, end_marker, frame_end in iter_frames(data, start, end):
+            frame = data[frame_start:frame_end]
+
+            if verify_crc and check_crc(frame, end_marker - frame_start) is False:
+                chunk.crc_errors += 1
+                continue
+
+            telegram = Telegram.parse_bytes(frame)
+            if telegram.has_header():
+                chunk.append(telegram, frame_timestamp(frame))
+
+    return chunk
+
+
+def parse_archive(
+        filename: str,
+        processes: int = None,
+        chunks: int = None,
+        verify_crc: bool = True
+) -> Iterator[ParsedChunk]:
+    """Parse an archive with a pool of worker processes
+
+    :param filename:    The archive to parse
+    :type filename:     str
+
+    :param processes:   Amount of worker processes. Default value: the amount of CPUs
+    :type processes:    int
+
+    :param chunks:      Amount of byte ranges to split the archive in. Default value: 4 per process
+    :type chunks:       int
+
+    :param verify_crc:  Skip telegrams with an invalid checksum. Default value: True
+    :type verify_crc:   bool
+
+    :return:            The parsed ranges, in the order of the archive
+    :rtype:             Iterator[ParsedChunk]
+    """
+    logger = logging.getLogger(__name__)
+
+    processes = processes if processes is not None else os.cpu_count() or 1
+    chunks = chunks if chunks is not None else processes * 4
+
+    ranges = split_archive(filename, chunks)
+    logger.debug(f"Parsing {filename} in {len(ranges)} ranges with {processes} processes")
+
+    if processes == 1:
+        for start, end in ranges:
+            yield parse_range(filename, start, end, verify_crc)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        yield from executor.map(
+            parse_range,
+            [filename] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+            [verify_crc] * len(ranges)
+        )
@@ -0,0 +1,411 @@
+"""Benchmarks of the parser, the framer and the complete acquisition path
+
+All benchmarks run on synthetic telegrams of the meter families of smartmeter.p1.emulator, so they need no
+hardware:
+- parse_line:   Telegram.parse_line() of every line of a telegram
+- add_line:     building a telegram line by line with Telegram.add_line(), as the serial readers used to do
+- parse:        Telegram.parse() of a complete telegram
+- parse_bytes:  Telegram.parse_bytes() of a complete raw telegram
+- framing:      TelegramFramer.feed() of a raw byte stream in serial sized chunks
+- end_to_end:   a FakeMeter on a pseudo-terminal, read by ReadTelegrams through a TelegramPipeline into NDJSON. The
+                latency is measured from writing the last byte of a telegram to its NDJSON line.
+
+Every benchmark reports its throughput, percentiles of the time per telegram (per chunk for framing) and, for the
+parsers, the memory allocated per telegram. Results can be saved as a baseline and compared with a later run:
+
+    results = run_benchmarks(["kaifa"])
+    save_baseline(results, "baseline.json")
+    regressions = compare_baseline(run_benchmarks(["kaifa"]), load_baseline("baseline.json"))
+"""
+import gc
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from smartmeter.output.ndjson import telegram_as_dict
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.emulator import FakeMeter, METER_PROFILES, MeterSimulation
+from smartmeter.p1.frame import TelegramFramer
+from smartmeter.p1.pipeline import OVERFLOW_BLOCK, TelegramPipeline
+from smartmeter.p1.read import ReadTelegrams
+
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples: Sequence[float], percent: float) -> float:
+    """The nearest-rank percentile of sorted samples, 0.0 when there are no samples"""
+    if not samples:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(samples) + 0.5)) - 1, 0)
+    return samples[min(rank, len(samples) - 1)]
+
+
+class BenchmarkResult:
+    """The outcome of one benchmark"""
+
+    def __init__(self, name: str, meter: str, unit: str, count: int, elapsed: float, samples: List[float]):
+        """
+        :param name:        Name of the benchmark, e.g. 'parse_line'
+        :type name:         str
+
+        :param meter:       The meter family of the telegrams
+        :type meter:        str
+
+        :param unit:        What was counted, e.g. 'lines' or 'telegrams'
+        :type unit:         str
+
+        :param count:       Amount of units processed
+        :type count:        int
+
+        :param elapsed:     Total time in seconds
+        :type elapsed:      float
+
+        :param samples:     Time in seconds of every measured operation (a telegram or chunk)
+        :type samples:      List[float]
+        """
+        self.name = name
+        self.meter = meter
+        self.unit = unit
+        self.count = count
+        self.elapsed = elapsed
+        self.samples = sorted(samples)
+        self.extra = {}
+
+    @property
+    def key(self) -> str:
+        """Identifies the benchmark in a baseline"""
+        return f"{self.name}/{self.meter}"
+
+    @property
+    def rate(self) -> float:
+        """Units per second"""
+        return self.count / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        result = {
+            "name": self.name,
+            "meter": self.meter,
+            "unit": self.unit,
+            "count": self.count,
+            "elapsed": round(self.elapsed, 6),
+            "rate": round(self.rate, 1)
+        }
+        for percent in PERCENTILES:
+            # Microseconds per operation:
+            result[f"p{percent}_us"] = round(percentile(self.samples, percent) * 1e6, 2)
+        result.update(self.extra)
+        return result
+
+    def __repr__(self):
+        return f"BenchmarkResult({self.as_dict()})"
+
+
+def synthetic_telegrams(meter: str, count: int, seed: int = 0) -> List[bytes]:
+    """Consecutive raw telegrams of a simulated meter
+
+    :param meter:   The meter family, one of METER_PROFILES
+    :type meter:    str
+
+    :param count:   Amount of telegrams
+    :type count:    int
+
+    :param seed:    Seed of the random generator. Default value: 0
+    :type seed:     int
+
+    :rtype:         List[bytes]
+    """
+    profile = METER_PROFILES[meter]
+    simulation = MeterSimulation(profile, random.Random(seed), start=1_600_000_000.0)
+    telegrams = []
+    for _ in range(count):
+        simulation.step(profile.interval)
+        telegrams.append(simulation.telegram())
+    return telegrams
+
+
+def _time_each(operation: Callable, items: Iterable) -> Tuple[float, List[float]]:
+    """Run the operation for every item, return the total time and the time of every call"""
+    clock = time.perf_counter
+    samples = []
+    started = clock()
+    for item in items:
+        before = clock()
+        operation(item)
+        samples.append(clock() - before)
+    return clock() - started, samples
+
+
+def measure_allocations(operation: Callable, items: Sequence) -> dict:
+    """Memory allocated per call of the operation, traced with tracemalloc
+
+    :return:    'peak_bytes': the average peak of memory allocated during a call, 'retained_blocks': the average
+                amount of memory blocks still allocated after a call (should be 0, anything else is a leak or a cache)
+    :rtype:     dict
+    """
+    if not items:
+        return {"peak_bytes": 0, "retained_blocks": 0.0}
+
+    # Warm up caches (e.g. compiled regular expressions) before measuring:
+    operation(items[0])
+
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    for item in items:
+        operation(item)
+    gc.collect()
+    retained_blocks = (sys.getallocatedblocks() - blocks_before) / len(items)
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    peaks = 0
+    try:
+        for item in items:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            operation(item)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks += peak - current
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    return {"peak_bytes": round(peaks / len(items)), "retained_blocks": round(retained_blocks, 3)}
+
+
+def _parse_lines(lines: List[str]):
+    parse_line = Telegram.parse_line
+    for line in lines:
+        parse_line(line)
+
+
+def _add_lines(lines: List[str]):
+    telegram = Telegram()
+    for line in lines:
+        telegram.add_line(line)
+    return telegram.telegram
+
+
+def _parse_block(text: str):
+    return Telegram.parse(text).telegram
+
+
+def _parse_raw(raw: bytes):
+    return Telegram.parse_bytes(raw).telegram
+
+
+def bench_parse_line(meter: str, telegrams: int = 1000) -> BenchmarkResult:
+    """Throughput of Telegram.parse_line() in lines per second, samples per telegram"""
+    texts = [[line for line in raw.decode("ascii").split("\r\n") if line]
+             for raw in synthetic_telegrams(meter, telegrams)]
+    _parse_lines(texts[0])
+    elapsed, samples = _time_each(_parse_lines, texts)
+    result = BenchmarkResult("parse_line", meter, "lines", sum(len(lines) for lines in texts), elapsed, samples)
+    result.extra["telegrams_per_second"] = round(telegrams / elapsed, 1) if elapsed > 0 else 0.0
+    result.extra.update(measure_allocations(_parse_lines, texts[:min(telegrams, 200)]))
+    return result
+
+
+def bench_add_line(meter: str, telegrams: int = 1000) -> BenchmarkResult:
+    """Throughput of building complete telegrams with Telegram.add_line(), in telegrams per second"""
+    texts = [[line for line in raw.decode("ascii").split("\r\n") if line]
+             for raw in synthetic_telegrams(meter, telegrams)]
+    _add_lines(texts[0])
+    elapsed, samples = _time_each(_add_lines, texts)
+    result = BenchmarkResult("add_line", meter, "telegrams", telegrams, elapsed, samples)
+    result.extra["lines_per_second"] = round(sum(len(lines) for lines in texts) / elapsed, 1) if elapsed > 0 else 0.0
+    result.extra.update(measure_allocations(_add_lines, texts[:min(telegrams, 200)]))
+    return result
+
+
+def bench_parse(meter: str, telegrams: int = 1000) -> BenchmarkResult:
+    """Throughput of Telegram.parse() of complete telegrams, in telegrams per second"""
+    texts = [raw.decode("ascii") for raw in synthetic_telegrams(meter, telegrams)]
+    _parse_block(texts[0])
+    elapsed, samples = _time_each(_parse_block, texts)
+    result = BenchmarkResult("parse", meter, "telegrams", telegrams, elapsed, samples)
+    result.extra.update(measure_allocations(_parse_block, texts[:min(telegrams, 200)]))
+    return result
+
+
+def bench_parse_bytes(meter: str, telegrams: int = 1000) -> BenchmarkResult:
+    """Throughput of Telegram.parse_bytes() of complete raw telegrams, in telegrams per second"""
+    raws = synthetic_telegrams(meter, telegrams)
+    _parse_raw(raws[0])
+    elapsed, samples = _time_each(_parse_raw, raws)
+    result = BenchmarkResult("parse_bytes", meter, "telegrams", telegrams, elapsed, samples)
+    result.extra.update(measure_allocations(_parse_raw, raws[:min(telegrams, 200)]))
+    return result
+
+
+def bench_framing(meter: str, telegrams: int = 1000, chunk_size: int = 256) -> BenchmarkResult:
+    """Throughput of TelegramFramer.feed() in bytes per second, samples per chunk
+
+    :param chunk_size:  Bytes per feed() call, like the reads of a serial port. Default value: 256
+    :type chunk_size:   int
+    """
+    stream = b"".join(synthetic_telegrams(meter, telegrams))
+    chunks = [stream[offset:offset + chunk_size] for offset in range(0, len(stream), chunk_size)]
+    framer = TelegramFramer()
+    elapsed, samples = _time_each(framer.feed, chunks)
+    result = BenchmarkResult("framing", meter, "bytes", len(stream), elapsed, samples)
+    result.extra["telegrams_per_second"] = round(framer.frames / elapsed, 1) if elapsed > 0 else 0.0
+    result.extra["frames"] = framer.frames
+    return result
+
+
+def bench_end_to_end(
+        meter: str,
+        telegrams: int = 200,
+        interval: float = 0.01,
+        timeout: float = 30.0
+) -> BenchmarkResult:
+    """Latency of the complete acquisition path, from the last byte of a telegram written by a FakeMeter to its
+    NDJSON line, and the throughput in telegrams per second
+
+    :param interval:    Seconds between the telegrams of the fake meter. Default value: 0.01
+    :type interval:     float
+
+    :param timeout:     Maximum seconds to wait for all telegrams. Default value: 30.0
+    :type timeout:      float
+    """
+    logger = logging.getLogger(__name__)
+    fake_meter = FakeMeter(meter, interval=interval, baudrate=0, telegrams=telegrams, seed=0)
+    fake_meter.open()
+    latencies = []
+    output_bytes = 0
+
+    def emit(telegram: Telegram):
+        nonlocal output_bytes
+        output_bytes += len(json.dumps(telegram_as_dict(telegram), separators=(",", ":")))
+        done = time.monotonic()
+        if fake_meter.write_times:
+            latencies.append(done - fake_meter.write_times.popleft())
+        if len(latencies) >= telegrams:
+            pipeline.stop(drain=True)
+
+    reader = ReadTelegrams([fake_meter.serial_config(timeout=1)])
+    pipeline = TelegramPipeline(reader, [emit], overflow=OVERFLOW_BLOCK, poll_interval=0.1)
+    try:
+        # Open the port before the meter starts, opening flushes the input buffer:
+        reader.open()
+        started = time.monotonic()
+        pipeline.start()
+        fake_meter.start()
+        pipeline.join(timeout)
+        elapsed = time.monotonic() - started
+    finally:
+        pipeline.stop()
+        reader.close()
+        fake_meter.close()
+
+    if len(latencies) < telegrams:
+        logger.warning(f"End-to-end benchmark of {meter}: {len(latencies)} of {telegrams} telegrams received")
+
+    result = BenchmarkResult("end_to_end", meter, "telegrams", len(latencies), elapsed, latencies)
+    result.extra["output_bytes"] = output_bytes
+    result.extra["dropped"] = pipeline.queue.dropped + pipeline.invalid_telegrams
+    return result
+
+
+BENCHMARKS = {
+    "parse_line": bench_parse_line,
+    "add_line": bench_add_line,
+    "parse": bench_parse,
+    "parse_bytes": bench_parse_bytes,
+    "framing": bench_framing,
+    "end_to_end": bench_end_to_end
+}
+
+
+def run_benchmarks(
+        meters: Iterable[str] = None,
+        benchmarks: Iterable[str] = None,
+        telegrams: int = 1000
+) -> List[BenchmarkResult]:
+    """Run benchmarks for meter families
+
+    :param meters:      The meter families, see METER_PROFILES. Default value: all families
+    :type meters:       Iterable[str]
+
+    :param benchmarks:  The benchmarks to run, see BENCHMARKS. Default value: all benchmarks
+    :type benchmarks:   Iterable[str]
+
+    :param telegrams:   Amount of telegrams per benchmark, the end-to-end benchmark uses a fifth of it.
+                        Default value: 1000
+    :type telegrams:    int
+
+    :rtype:             List[BenchmarkResult]
+    """
+    logger = logging.getLogger(__name__)
+    meters = list(meters) if meters is not None else list(METER_PROFILES)
+    benchmarks = list(benchmarks) if benchmarks is not None else list(BENCHMARKS)
+
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {unknown}, expected any of {', '.join(BENCHMARKS)}")
+
+    results = []
+    for meter in meters:
+        for name in benchmarks:
+            count = max(telegrams // 5, 1) if name == "end_to_end" else telegrams
+            logger.debug(f"Running benchmark {name} of {meter} with {count} telegrams")
+            results.append(BENCHMARKS[name](meter, count))
+    return results
+
+
+def save_baseline(results: List[BenchmarkResult], filename: str):
+    """Write results as a baseline file (JSON)"""
+    baseline = {
+        "created": time.time(),
+        "python": sys.version.split()[0],
+        "results": {result.key: result.as_dict() for result in results}
+    }
+    with open(filename, "w") as file_handler:
+        json.dump(baseline, file_handler, indent=2)
+
+
+def load_baseline(filename: str) -> Dict[str, dict]:
+    """Read a baseline file, return the results by key ('<benchmark>/<meter>')"""
+    with open(filename) as file_handler:
+        return json.load(file_handler)["results"]
+
+
+def compare_baseline(results: List[BenchmarkResult], baseline: Dict[str, dict], tolerance: float = 0.1) -> List[str]:
+    """Compare results with a baseline
+
+    :param results:     The results of this run
+    :type results:      List[BenchmarkResult]
+
+    :param baseline:    The results of the baseline, see load_baseline()
+    :type baseline:     Dict[str, dict]
+
+    :param tolerance:   Allowed relative slowdown of the throughput and the median time. Default value: 0.1 (10%)
+    :type tolerance:    float
+
+    :return:            A description of every regression, empty when there are none
+    :rtype:             List[str]
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.key)
+        if reference is None:
+            continue
+        current = result.as_dict()
+
+        if reference["rate"] and current["rate"] < reference["rate"] * (1 - tolerance):
+            regressions.append(
+                f"{result.key}: {current['rate']} {result.unit}/s, was {reference['rate']} "
+                f"({current['rate'] / reference['rate'] - 1:+.1%})"
+            )
+        if reference["p50_us"] and current["p50_us"] > reference["p50_us"] * (1 + tolerance):
+            regressions.append(
+                f"{result.key}: median {current['p50_us']} us, was {reference['p50_us']} "
+                f"({current['p50_us'] / reference['p50_us'] - 1:+.1%})"
+            )
+    return regressions
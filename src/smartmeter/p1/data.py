@@ -1,11 +1,135 @@
+import datetime
 import re
-from typing import Union
+from typing import Iterable, Tuple, Union
 import time
 
 
+# Generic pattern of an OBIS key/value line, e.g. '1-0:1.8.1(11380.757*kWh)', the value can have more groups:
+OBIS_LINE_REGEX = re.compile(r'(?P<OBIS_ID>[0-9]-[0-9]:[0-9.]+)\((?P<OBIS_VALUE>.*)\)$')
+
+# Offset to UTC of the DST flag of a DSMR timestamp, S(ummer) or W(inter) time in the Netherlands and Belgium:
+TIMESTAMP_OFFSETS = {
+    "S": datetime.timezone(datetime.timedelta(hours=2)),
+    "W": datetime.timezone(datetime.timedelta(hours=1))
+}
+
+
+def parse_timestamp(value: str) -> float:
+    """Convert a DSMR timestamp (YYMMDDhhmmssX) to seconds since the epoch
+
+    :param value:   The timestamp, e.g. '101209113020W'. Without DST flag the time is interpreted as local time
+    :type value:    str
+
+    :rtype:         float
+
+    :exception:     ValueError when the value is not a valid timestamp
+    """
+    if len(value) < 12 or not value[:12].isdigit():
+        raise ValueError(f"Invalid timestamp '{value}'")
+    timestamp = datetime.datetime(
+        2000 + int(value[0:2]), int(value[2:4]), int(value[4:6]), int(value[6:8]), int(value[8:10]), int(value[10:12]),
+        tzinfo=TIMESTAMP_OFFSETS.get(value[12:13])
+    )
+    return timestamp.timestamp()
+
+
+def parse_event_log(value: str) -> Tuple[Tuple[float, int], ...]:
+    """Convert a power failure event log to (end of failure, duration in seconds) pairs
+
+    The raw value holds the amount of events, the OBIS id of the events and a (timestamp)(duration) pair per event,
+    e.g. '2)(0-0:96.7.19)(101208152415W)(0000000240*s)(101208151004W)(0000000301*s'.
+
+    :param value:   The raw value, all groups without the outer parentheses
+    :type value:    str
+
+    :rtype:         Tuple[Tuple[float, int], ...]
+
+    :exception:     ValueError when the value is not a valid event log
+    """
+    groups = value.split(")(")
+    count = int(groups[0])
+    events = groups[2:]
+    if count and len(events) < 2 * count:
+        raise ValueError(f"Event log with {count} events has {len(events) // 2} events")
+    return tuple(
+        (parse_timestamp(events[2 * event]), int(events[2 * event + 1].split("*")[0]))
+        for event in range(count)
+    )
+
+
+# Converters for the 'type' field of the OBIS_CODES table:
+OBIS_TYPE_CONVERTERS = {
+    "float": float,
+    "int": int,
+    "str": str,
+    "timestamp": parse_timestamp,
+    "events": parse_event_log
+}
+
+# Types with a single number or string as value, other types (the event log) are lists:
+SCALAR_TYPES = ("float", "int", "str", "timestamp")
+
+# Patterns of the values in the OBIS_CODES table:
+_DECIMAL = r"[0-9]+(\.[0-9]+)?"
+_TIMESTAMP = r"[0-9]{12}[SW]?"
+
+
+def _mbus_obis_codes(channel: int) -> dict:
+    """The OBIS codes of one M-Bus channel (gas, water or heat meter)
+
+    The reading has two groups: the capture time and the value, e.g. '0-1:24.2.1(101209112500W)(12785.123*m3)'.
+    The value is stored under the OBIS id, the capture time under the OBIS id with a '.timestamp' suffix.
+    """
+    return {
+        f"0-{channel}:24.1.0":
+            {
+                "description": f"Device type of M-Bus channel {channel}",
+                "value_regex": r"[0-9]+",
+                "type": "int"
+            },
+        f"0-{channel}:96.1.0":
+            {
+                "description": f"Equipment identifier of M-Bus channel {channel}",
+                "value_regex": r"[A-Za-z0-9]+",
+                "type": "str"
+            },
+        f"0-{channel}:24.2.1":
+            {
+                "description": f"Last 5-minute reading of M-Bus channel {channel} (e.g. gas in m3)",
+                "value_regex": _DECIMAL,
+                "type": "float",
+                "group": 1
+            },
+        f"0-{channel}:24.2.1.timestamp":
+            {
+                "description": f"Capture time of the last reading of M-Bus channel {channel}",
+                "value_regex": _TIMESTAMP,
+                "type": "timestamp",
+                "line": f"0-{channel}:24.2.1",
+                "group": 0
+            }
+    }
+
+
+def _phase_obis_codes(obis_ids: Tuple[str, str, str], description: str, value_regex: str, data_type: str) -> dict:
+    """The OBIS codes of a value per phase, the description is formatted with the phase (L1, L2 and L3)"""
+    return {
+        obis_id: {
+            "description": description.format(phase=phase),
+            "value_regex": value_regex,
+            "type": data_type
+        }
+        for obis_id, phase in zip(obis_ids, ("L1", "L2", "L3"))
+    }
+
+
 class Telegram:
     """
     A class representing the P1 data structure
+
+    The OBIS_CODES table maps the OBIS id of a line to the description, value pattern and type of its value. Lines
+    with more than one (...) group select one group with 'group' (counted from 0). More than one value can be read
+    from the same line by entries with a 'line' key: the OBIS id of the line they are read from.
     """
 
     TELEGRAM_HEADERS = [
@@ -18,6 +142,18 @@ class Telegram:
     ]
 
     OBIS_CODES = {
+        "1-3:0.2.8":
+            {
+                "description": "Version information for P1 output",
+                "value_regex": r"[0-9]+",
+                "type": "str"
+            },
+        "0-0:1.0.0":
+            {
+                "description": "Date-time stamp of the P1 message",
+                "value_regex": _TIMESTAMP,
+                "type": "timestamp"
+            },
         "0-0:96.1.1":
             {
                 "description": "Serial number",
@@ -57,19 +193,19 @@ class Telegram:
         "1-0:1.7.0":
             {
                 "description": "Actual electricity power delivered(+P) in 1 Watt resolution",
-                "value_regex": r"[0-9]+\.[0-9]{2}",
+                "value_regex": r"[0-9]+\.[0-9]{2,3}",
                 "type": "float"
             },
         "1-0:2.7.0":
             {
                 "description": "Actual electricity power received(-P) in 1 Watt resolution",
-                "value_regex": r"[0-9]+\.[0-9]{2}",
+                "value_regex": r"[0-9]+\.[0-9]{2,3}",
                 "type": "float"
             },
         "0-0:17.0.0":
             {
                 "description": "Maximum power per phase in kW resolution",
-                "value_regex": r"[0-9]+\.[0-9]{2}",
+                "value_regex": r"[0-9]+\.[0-9]{1,3}",
                 "type": "float"
             },
         "0-0:96.3.10":
@@ -78,6 +214,30 @@ class Telegram:
                 "value_regex": r"[0-9]",
                 "type": "int"
             },
+        "0-0:96.7.21":
+            {
+                "description": "Number of power failures in any phase",
+                "value_regex": r"[0-9]+",
+                "type": "int"
+            },
+        "0-0:96.7.9":
+            {
+                "description": "Number of long power failures in any phase",
+                "value_regex": r"[0-9]+",
+                "type": "int"
+            },
+        "1-0:99.97.0":
+            {
+                "description": "Power failure event log: (end of failure, duration in seconds) per event",
+                "value_regex": r".*",
+                "type": "events"
+            },
+        **_phase_obis_codes(
+            ("1-0:32.32.0", "1-0:52.32.0", "1-0:72.32.0"), "Number of voltage sags in phase {phase}", r"[0-9]+", "int"
+        ),
+        **_phase_obis_codes(
+            ("1-0:32.36.0", "1-0:52.36.0", "1-0:72.36.0"), "Number of voltage swells in phase {phase}", r"[0-9]+", "int"
+        ),
         "0-0:96.13.1":
             {
                 "description": "Message numeric",
@@ -89,13 +249,64 @@ class Telegram:
                 "description": "Message string",
                 "value_regex": r".*",
                 "type": "str"
-            }
+            },
+        **_phase_obis_codes(
+            ("1-0:32.7.0", "1-0:52.7.0", "1-0:72.7.0"), "Instantaneous voltage {phase} in V resolution",
+            _DECIMAL, "float"
+        ),
+        **_phase_obis_codes(
+            ("1-0:31.7.0", "1-0:51.7.0", "1-0:71.7.0"), "Instantaneous current {phase} in A resolution",
+            _DECIMAL, "float"
+        ),
+        **_phase_obis_codes(
+            ("1-0:21.7.0", "1-0:41.7.0", "1-0:61.7.0"), "Instantaneous active power {phase} (+P) in W resolution",
+            _DECIMAL, "float"
+        ),
+        **_phase_obis_codes(
+            ("1-0:22.7.0", "1-0:42.7.0", "1-0:62.7.0"), "Instantaneous active power {phase} (-P) in W resolution",
+            _DECIMAL, "float"
+        ),
+        **_mbus_obis_codes(1),
+        **_mbus_obis_codes(2),
+        **_mbus_obis_codes(3),
+        **_mbus_obis_codes(4)
     }
 
-    def __init__(self):
+    # Dispatch tables compiled from TELEGRAM_HEADERS and OBIS_CODES by compile_obis_codes():
+    _HEADER_PREFIXES = ()
+    _OBIS_PARSERS = {}
+    _LINE_FIELDS = {}
+    _TELEGRAM_REGEX = None
+    # The same for raw telegrams, see parse_bytes():
+    _HEADER_PREFIXES_BYTES = ()
+    _LINE_IDS = {}
+    _TELEGRAM_BYTES_REGEX = None
+
+    def __init__(self, source: str = None, fields: Iterable[str] = None):
         """
         Create an empty instance of the Telegram class
+
+        Values are stored unconverted and converted on first access: by value() for a single OBIS code, or all at once
+        when the 'telegram' property is read.
+
+        :param source:  Name of the meter (port) this telegram was read from
+        :type source:   str
+
+        :param fields:  Only parse these OBIS codes, all other lines are skipped with a prefix check.
+                        Default value: all known OBIS codes
+        :type fields:   Iterable[str]
         """
+        self.source = source
+        self.fields = tuple(fields) if fields is not None else None
+        self._field_set = None
+        self._field_prefixes = None
+        if self.fields is not None:
+            self._field_set = frozenset(self.fields)
+            # The OBIS ids of the lines the fields are read from, without duplicates:
+            lines = [self._OBIS_PARSERS[obis_id][3] if obis_id in self._OBIS_PARSERS else obis_id
+                     for obis_id in self.fields]
+            self._field_prefixes = tuple(line_id + "(" for line_id in dict.fromkeys(lines))
+
         # Set the internal variable for storing a telegram to an empty dictionary:
         self._telegram = {
             "header": "",
@@ -103,39 +314,120 @@ class Telegram:
             "updatedatetime": float(0)
          }
 
+        # Raw values by OBIS id of the line, which are not converted yet. Either a str or, for a telegram parsed by
+        # parse_bytes(), the (start, end) offsets of the value in self._buffer:
+        self._pending = {}
+        self._buffer = None
+
     def add_line(self, line: str):
         """
         Add the parsed content of the line to the class instance
 
-        :param line:    The unparsed line
-        :type line:     str
+        :param line:    The unparsed line, raw lines are decoded as UTF-8
+        :type line:     Union[str, bytes]
         """
         # Make sure the parameter 'line' is a str:
-        line = str(line)
+        if isinstance(line, (bytes, bytearray, memoryview)):
+            line = str(line, "utf-8", "replace").rstrip("\r\n")
+        elif not isinstance(line, str):
+            line = str(line)
 
         # Identify the type of line:
         if len(line) == 0:
             # Empty line, we can ignore this one...
-            pass
+            return
 
         # Check if the line is a header line:
-        for headertype in self.TELEGRAM_HEADERS:
-            if line.startswith(headertype):
-                # line is a header of type 'headertype'
-                self._telegram['header'] = line
-                self.__update_datetime()
-                pass
+        if line.startswith(self._HEADER_PREFIXES):
+            self._telegram['header'] = line
+            self.__update_datetime()
+            return
+
+        # Skip the lines outside the subscription without running the regular expression:
+        if self._field_prefixes is not None and not line.startswith(self._field_prefixes):
+            return
 
         # Check if the line is an OBIS line:
-        parsed_line = self.parse_line(line)
-        if parsed_line is not None:
-            self._telegram['data'].update({parsed_line['obis_id']: parsed_line['obis_value']})
-            self.__update_datetime()
+        matches = OBIS_LINE_REGEX.search(line)
+        if matches:
+            obis_id, obis_value = matches.group('OBIS_ID', 'OBIS_VALUE')
+            line_fields = self._LINE_FIELDS.get(obis_id)
+            if line_fields is not None:
+                for field in line_fields:
+                    self._telegram['data'].pop(field, None)
+                self._pending[obis_id] = obis_value
+                self.__update_datetime()
 
     @property
     def telegram(self):
+        if self._pending:
+            self._convert_pending()
         return self._telegram
 
+    def _convert_pending(self):
+        """Convert all values which are not converted yet, in the order of the telegram"""
+        data = self._telegram['data']
+        parsers = self._OBIS_PARSERS
+        field_set = self._field_set
+        converted = {}
+        text = None
+        if self._buffer is not None:
+            # Decode the raw telegram once instead of every value. The offsets are byte offsets, which are the same
+            # in the text as long as it is plain ASCII (as the P1 port is):
+            text = str(self._buffer, "utf-8", "replace")
+            if len(text) != len(self._buffer):
+                text = None
+        for line_id, obis_value in self._pending.items():
+            if obis_value.__class__ is tuple:
+                obis_value = self._decode_span(obis_value) if text is None else text[obis_value[0]:obis_value[1]]
+            for obis_id in self._LINE_FIELDS[line_id]:
+                if field_set is not None and obis_id not in field_set:
+                    continue
+                value = data[obis_id] if obis_id in data else self._convert_value(parsers[obis_id], obis_value)
+                if value is not None:
+                    converted[obis_id] = value
+        self._pending.clear()
+
+        # Values which are not part of the telegram text, e.g. set by hand, are kept after the parsed ones:
+        for obis_id, value in data.items():
+            converted.setdefault(obis_id, value)
+        data.clear()
+        data.update(converted)
+
+    def value(self, obis_id: str, default=None):
+        """Get the value of one OBIS code, only this value is converted
+
+        :param obis_id:     The OBIS id, e.g. '1-0:1.7.0'
+        :type obis_id:      str
+
+        :param default:     Returned when the telegram has no (valid) value for the OBIS code. Default value: None
+
+        :return:            The converted value
+        """
+        data = self._telegram['data']
+        if obis_id in data:
+            return data[obis_id]
+
+        parser = self._OBIS_PARSERS.get(obis_id)
+        if parser is None or (self._field_set is not None and obis_id not in self._field_set):
+            return default
+        obis_value = self._pending.get(parser[3])
+        if obis_value is None:
+            return default
+        if obis_value.__class__ is tuple:
+            obis_value = self._decode_span(obis_value)
+
+        value = self._convert_value(parser, obis_value)
+        if value is None:
+            return default
+        data[obis_id] = value
+        return value
+
+    @property
+    def header(self) -> str:
+        """The header line of the telegram, without converting the values like the telegram property does"""
+        return self._telegram['header']
+
     def has_header(self):
         if len(self._telegram.get("header", "")) > 0:
             return True
@@ -156,7 +448,221 @@ class Telegram:
         """Reset the internal variables, acts as a new instance
         """
         self._telegram.clear()
-        self.__init__()
+        self.__init__(source=self.source, fields=self.fields)
+
+    @classmethod
+    def compile_obis_codes(cls):
+        """Compile TELEGRAM_HEADERS and OBIS_CODES into the dispatch tables used by the parser
+
+        Called once when this module is imported. Subclasses which change TELEGRAM_HEADERS or OBIS_CODES
+        should call this method again to rebuild their own tables.
+        """
+        cls._HEADER_PREFIXES = tuple(cls.TELEGRAM_HEADERS)
+
+        cls._OBIS_PARSERS = {
+            obis_id: (
+                re.compile(obis_code['value_regex']).search,
+                OBIS_TYPE_CONVERTERS.get(obis_code['type'], str),
+                obis_code['description'],
+                obis_code.get('line', obis_id),
+                obis_code.get('group')
+            )
+            for obis_id, obis_code in cls.OBIS_CODES.items()
+        }
+
+        # The OBIS ids of the values read from every line:
+        line_fields = {}
+        for obis_id, parser in cls._OBIS_PARSERS.items():
+            line_fields.setdefault(parser[3], []).append(obis_id)
+        cls._LINE_FIELDS = {line_id: tuple(obis_ids) for line_id, obis_ids in line_fields.items()}
+
+        # One pattern matching either a header line or an OBIS line, to parse a whole telegram in a single pass:
+        headers = "|".join(re.escape(header) for header in cls.TELEGRAM_HEADERS)
+        telegram_pattern = (
+            r'^(?:(?P<HEADER>(?:' + headers + r').*?)|'
+            r'.*?(?P<OBIS_ID>[0-9]-[0-9]:[0-9.]+)\((?P<OBIS_VALUE>.*)\))\r?$'
+        )
+        cls._TELEGRAM_REGEX = re.compile(telegram_pattern, re.MULTILINE)
+
+        cls._HEADER_PREFIXES_BYTES = tuple(header.encode("utf-8") for header in cls.TELEGRAM_HEADERS)
+        cls._LINE_IDS = {line_id.encode("ascii"): line_id for line_id in cls._LINE_FIELDS}
+        cls._TELEGRAM_BYTES_REGEX = re.compile(telegram_pattern.encode("utf-8"), re.MULTILINE)
+
+    @staticmethod
+    def _convert_value(parser: tuple, obis_value: str):
+        """Extract and convert a raw OBIS value with a compiled parser from the dispatch table
+
+        :return:    The converted value, None when the raw value does not match or can not be converted
+        """
+        search, converter, _, _, group = parser
+        if group is not None:
+            # Select one group of a value like '101209112500W)(12785.123*m3':
+            groups = obis_value.split(")(")
+            if group >= len(groups):
+                return None
+            obis_value = groups[group]
+
+        obis_value_match = search(obis_value)
+        if obis_value_match:
+            try:
+                return converter(obis_value_match.group(0))
+            except (ValueError, IndexError):
+                # E.g. an empty numeric value like '0-0:96.13.1()' or an incomplete event log
+                return None
+        return None
+
+    @classmethod
+    def parse(cls, block: str, source: str = None, fields: Iterable[str] = None) -> 'Telegram':
+        """Parse a complete telegram in a single pass
+
+        The values are converted on first access, see value().
+
+        :param block:   The unparsed telegram, all lines from the header up to and including the '!' line
+        :type block:    str
+
+        :param source:  Name of the meter (port) the telegram was read from
+        :type source:   str
+
+        :param fields:  Only parse these OBIS codes. Default value: all known OBIS codes
+        :type fields:   Iterable[str]
+
+        :return:        A new instance holding the parsed telegram
+        :rtype:         Telegram
+        """
+        telegram = cls(source=source, fields=fields)
+        if telegram.fields is not None:
+            telegram._parse_fields(block)
+            telegram.__update_datetime()
+            return telegram
+
+        pending = telegram._pending
+        line_fields = cls._LINE_FIELDS
+
+        for matches in cls._TELEGRAM_REGEX.finditer(block):
+            header, obis_id, obis_value = matches.group('HEADER', 'OBIS_ID', 'OBIS_VALUE')
+            if header is not None:
+                telegram._telegram['header'] = header
+                continue
+
+            if obis_id in line_fields:
+                pending[obis_id] = obis_value
+
+        telegram.__update_datetime()
+        return telegram
+
+    @classmethod
+    def parse_bytes(
+            cls,
+            buffer: Union[bytes, bytearray, memoryview],
+            source: str = None,
+            fields: Iterable[str] = None
+    ) -> 'Telegram':
+        """Parse a raw telegram without decoding it, e.g. a frame of TelegramFramer
+
+        The lines are found by offset in the buffer: only the header and the values which are used are decoded, see
+        value(). The telegram keeps a reference to the buffer, its content should not change while the telegram is
+        used (the frames of TelegramFramer are never changed).
+
+        :param buffer:  The raw telegram, all bytes from the header up to and including the '!' line. Any bytes-like
+                        object: bytes, bytearray, memoryview or mmap
+        :type buffer:   Union[bytes, bytearray, memoryview]
+
+        :param source:  Name of the meter (port) the telegram was read from
+        :type source:   str
+
+        :param fields:  Only parse these OBIS codes. Default value: all known OBIS codes
+        :type fields:   Iterable[str]
+
+        :return:        A new instance holding the parsed telegram
+        :rtype:         Telegram
+        """
+        telegram = cls(source=source, fields=fields)
+        telegram._buffer = buffer
+        pending = telegram._pending
+
+        if telegram.fields is not None and hasattr(buffer, "find"):
+            telegram._parse_fields_bytes(buffer)
+            telegram.__update_datetime()
+            return telegram
+
+        line_ids = cls._LINE_IDS
+        if telegram.fields is not None:
+            # E.g. a memoryview, which can not be searched: match all lines, keep the subscribed ones
+            subscribed = {prefix[:-1] for prefix in telegram._field_prefixes}
+            line_ids = {raw_id: line_id for raw_id, line_id in line_ids.items() if line_id in subscribed}
+
+        for matches in cls._TELEGRAM_BYTES_REGEX.finditer(buffer):
+            obis_id = matches.group('OBIS_ID')
+            if obis_id is None:
+                telegram._telegram['header'] = telegram._decode_span(matches.span('HEADER'))
+                continue
+
+            line_id = line_ids.get(obis_id)
+            if line_id is not None:
+                pending[line_id] = matches.span('OBIS_VALUE')
+
+        telegram.__update_datetime()
+        return telegram
+
+    def _decode_span(self, span: Tuple[int, int]) -> str:
+        """Decode a part of the buffer of a telegram parsed by parse_bytes()"""
+        start, end = span
+        return str(self._buffer[start:end], "utf-8", "replace")
+
+    def _parse_fields_bytes(self, buffer):
+        """Find the header and the subscribed OBIS lines of a raw telegram with plain byte searches, see
+        _parse_fields()
+        """
+        line_end = buffer.find(b"\n")
+        first_line = bytes(buffer[:line_end if line_end >= 0 else len(buffer)]).rstrip(b"\r")
+        if first_line.startswith(self._HEADER_PREFIXES_BYTES):
+            self._telegram['header'] = str(first_line, "utf-8", "replace")
+
+        line_fields = self._LINE_FIELDS
+        for prefix in self._field_prefixes:
+            line_id = prefix[:-1]
+            if line_id not in line_fields:
+                continue
+            raw_prefix = b"\n" + prefix.encode("ascii")
+            start = buffer.find(raw_prefix)
+            if start < 0:
+                continue
+            start += len(raw_prefix)
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                end = len(buffer)
+            if buffer[end - 1:end] == b"\r":
+                end -= 1
+            if buffer[end - 1:end] == b")":
+                self._pending[line_id] = (start, end - 1)
+
+    def _parse_fields(self, block: str):
+        """Find the header and the subscribed OBIS lines of a telegram with plain string searches
+
+        Only the subscribed lines are looked at, the rest of the telegram is never split or matched.
+        """
+        header_prefixes = self._HEADER_PREFIXES
+        for line in block.splitlines():
+            if line.startswith(header_prefixes):
+                self._telegram['header'] = line
+                break
+            if line:
+                # The header is the first line of a telegram, this is not a telegram:
+                break
+
+        line_fields = self._LINE_FIELDS
+        for prefix in self._field_prefixes:
+            line_id = prefix[:-1]
+            if line_id not in line_fields:
+                continue
+            start = block.find("\n" + prefix)
+            if start < 0:
+                continue
+            start += len(prefix) + 1
+            end = block.find("\n", start)
+            line_end = block[start:end if end >= 0 else len(block)].rstrip("\r")
+            if line_end.endswith(")"):
+                self._pending[line_id] = line_end[:-1]
 
     @classmethod
     def parse_line(cls, line: str) -> Union[dict, None]:
@@ -174,35 +680,27 @@ class Telegram:
                         If the line is not a valuid OBIS key/value pair 'None' is returned
         :rtype:         Union[dict, None]
         """
-        matches = re.search(r'(?P<OBIS_ID>[01]-[01]:[0-9.]+)\((?P<OBIS_VALUE>.*)\)$', line)
+        matches = OBIS_LINE_REGEX.search(line)
 
         if matches:
             # We've found an OBIS key/value pair, get the id and value
-            obis_id, obis_value = matches.groupdict().values()
-
-            if obis_id in cls.OBIS_CODES.keys():
-                # The found OBIS_ID is found in the OBIS_CODES dictionary, lets parse the found value
-                parse_regex = cls.OBIS_CODES[obis_id]['value_regex']
-                parse_type = cls.OBIS_CODES[obis_id]['type']
-                parse_description = cls.OBIS_CODES[obis_id]['description']
-
-                obis_value_match = re.search(parse_regex, obis_value)
-                if obis_value_match:
-                    # Convert to the correct type:
-                    if parse_type == 'float':
-                        return_value = float(obis_value_match.group(0))
-                    elif parse_type == 'int':
-                        return_value = int(obis_value_match.group(0))
-                    else:
-                        # Use default str:
-                        return_value = obis_value_match.group(0)
-
-                    obis_object = {
+            obis_id, obis_value = matches.group('OBIS_ID', 'OBIS_VALUE')
+
+            # The main value of the line, e.g. the reading of an M-Bus line and not its capture time:
+            line_fields = cls._LINE_FIELDS.get(obis_id)
+            if line_fields is not None:
+                obis_id = line_fields[0]
+                parser = cls._OBIS_PARSERS[obis_id]
+                # The found OBIS_ID is found in the dispatch table, lets parse the found value
+                return_value = cls._convert_value(parser, obis_value)
+                if return_value is not None:
+                    return {
                         "obis_id": obis_id,
                         "obis_value": return_value,
                         "data_type": type(return_value),
-                        "description": parse_description
+                        "description": parser[2]
                     }
-                    return obis_object
-        else:
-            return None
+        return None
+
+
+Telegram.compile_obis_codes()
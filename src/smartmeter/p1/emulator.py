@@ -0,0 +1,464 @@
+"""A fake P1 meter on a pseudo-terminal, for load and soak testing without hardware
+
+The FakeMeter opens a pseudo-terminal and streams synthetic telegrams to it, paced like a real serial line. Any
+reader can open the slave side like a serial port:
+
+    with FakeMeter("kaifa", interval=0.1) as meter:
+        reader = ReadTelegrams([meter.serial_config()])
+
+The telegrams follow the header family of the chosen meter (see METER_PROFILES): DSMR 2.2 meters send a short
+telegram without checksum every 10 seconds, DSMR 4 and 5 meters add timestamps, power per phase, gas readings
+and a CRC16 checksum. The registers increase realistically, the actual power is a random walk.
+
+Faults are injected at random, with configurable rates:
+- noise:        random bytes between telegrams and flipped bytes within telegrams
+- CRC errors:   a telegram with a wrong checksum (only meters with a checksum)
+- partial:      a telegram which is cut off, the next one starts right after it
+- bursts:       several telegrams written back-to-back, e.g. a meter catching up after a hiccup
+"""
+import collections
+import logging
+import os
+import random
+import select
+import threading
+import time
+import tty
+from typing import Callable, List, NamedTuple
+
+from smartmeter.configuration import SerialConfig
+from smartmeter.p1.frame import crc16
+
+
+class MeterProfile(NamedTuple):
+    """The properties of a meter family"""
+    header: str
+    dsmr: int
+    baudrate: int
+    bytesize: int
+    parity: str
+    interval: float
+
+
+# One profile per header family of Telegram.TELEGRAM_HEADERS:
+METER_PROFILES = {
+    "iskra": MeterProfile("/ISk5\\2MT382-1003", 2, 9600, 7, "E", 10.0),
+    "kaifa": MeterProfile("/KFM5KAIFA-METER", 4, 115200, 8, "N", 10.0),
+    "kamstrup": MeterProfile("/KMP5 ZABF001587315111", 2, 9600, 7, "E", 10.0),
+    "landis_gyr": MeterProfile("/XMX5LGBBFFB231237741", 4, 115200, 8, "N", 10.0),
+    "sagemcom": MeterProfile("/Ene5\\T210-D ESMR5.0", 5, 115200, 8, "N", 1.0)
+}
+
+
+class MeterSimulation:
+    """The state of a simulated meter: registers which increase and a fluctuating power"""
+
+    def __init__(self, profile: MeterProfile, rng: random.Random, start: float = None):
+        """
+        :param profile:     The meter family
+        :type profile:      MeterProfile
+
+        :param rng:         The random generator, seeded for reproducible telegrams
+        :type rng:          random.Random
+
+        :param start:       Time of the first telegram in seconds since the epoch. Default value: now
+        :type start:        float
+        """
+        self.profile = profile
+        self.rng = rng
+        self.clock = start if start is not None else time.time()
+
+        self.serial_number = "".join(f"{ord(c):02X}" for c in f"E00{rng.randrange(10 ** 13):013d}")
+        self.gas_serial_number = "".join(f"{ord(c):02X}" for c in f"G00{rng.randrange(10 ** 13):013d}")
+        self.delivered = [rng.uniform(1000, 20000), rng.uniform(1000, 20000)]
+        self.received = [rng.uniform(0, 500), rng.uniform(0, 500)]
+        self.gas = rng.uniform(1000, 10000)
+        self.power = rng.uniform(0.1, 1.5)
+        self.solar = 0.0
+        self.power_failures = rng.randrange(20)
+        self.long_power_failures = rng.randrange(5)
+
+    @property
+    def tariff(self) -> int:
+        """Tariff 2 (normal) on weekdays from 7 to 23, otherwise 1 (low)"""
+        local_time = time.localtime(self.clock)
+        return 2 if local_time.tm_wday < 5 and 7 <= local_time.tm_hour < 23 else 1
+
+    def step(self, seconds: float):
+        """Advance the clock and the registers"""
+        rng = self.rng
+        self.clock += seconds
+        self.power = min(max(self.power + rng.gauss(0, 0.05), 0.05), 12.0)
+        self.solar = min(max(self.solar + rng.gauss(0, 0.02), 0.0), 4.0)
+        net = self.power - self.solar
+        if net >= 0:
+            self.delivered[self.tariff - 1] += net * seconds / 3600
+        else:
+            self.received[self.tariff - 1] -= net * seconds / 3600
+        self.gas += max(rng.gauss(0.0001, 0.0002), 0) * seconds
+
+    @staticmethod
+    def _timestamp(seconds: float) -> str:
+        """A DSMR timestamp in local time, with the summer/winter flag"""
+        local_time = time.localtime(seconds)
+        return time.strftime("%y%m%d%H%M%S", local_time) + ("S" if local_time.tm_isdst > 0 else "W")
+
+    def lines(self) -> List[str]:
+        """The OBIS lines of the current state, in the order of the meter family"""
+        net = self.power - self.solar
+        delivering, receiving = max(net, 0.0), max(-net, 0.0)
+        dsmr = self.profile.dsmr
+
+        if dsmr < 4:
+            return [
+                f"0-0:96.1.1({self.serial_number})",
+                f"1-0:1.8.1({self.delivered[0]:09.3f}*kWh)",
+                f"1-0:1.8.2({self.delivered[1]:09.3f}*kWh)",
+                f"1-0:2.8.1({self.received[0]:09.3f}*kWh)",
+                f"1-0:2.8.2({self.received[1]:09.3f}*kWh)",
+                f"0-0:96.14.0({self.tariff:04d})",
+                f"1-0:1.7.0({delivering:07.2f}*kW)",
+                f"1-0:2.7.0({receiving:07.2f}*kW)",
+                "0-0:17.0.0(0999.00*kW)",
+                "0-0:96.3.10(1)",
+                "0-0:96.13.1()",
+                "0-0:96.13.0()"
+            ]
+
+        rng = self.rng
+        phases = [delivering * share for share in (0.5, 0.3, 0.2)]
+        voltages = [rng.gauss(230.0, 1.5) for _ in range(3)]
+        lines = [
+            f"1-3:0.2.8({50 if dsmr >= 5 else 42})",
+            f"0-0:1.0.0({self._timestamp(self.clock)})",
+            f"0-0:96.1.1({self.serial_number})",
+            f"1-0:1.8.1({self.delivered[0]:010.3f}*kWh)",
+            f"1-0:1.8.2({self.delivered[1]:010.3f}*kWh)",
+            f"1-0:2.8.1({self.received[0]:010.3f}*kWh)",
+            f"1-0:2.8.2({self.received[1]:010.3f}*kWh)",
+            f"0-0:96.14.0({self.tariff:04d})",
+            f"1-0:1.7.0({delivering:06.3f}*kW)",
+            f"1-0:2.7.0({receiving:06.3f}*kW)",
+            f"0-0:96.7.21({self.power_failures:05d})",
+            f"0-0:96.7.9({self.long_power_failures:05d})",
+            f"1-0:99.97.0(1)(0-0:96.7.19)({self._timestamp(self.clock - 86400 * 30)})(0000000240*s)",
+            "1-0:32.32.0(00000)",
+            "1-0:52.32.0(00000)",
+            "1-0:72.32.0(00000)",
+            "1-0:32.36.0(00000)",
+            "1-0:52.36.0(00000)",
+            "1-0:72.36.0(00000)",
+            "0-0:96.13.0()",
+        ]
+        if dsmr >= 5:
+            lines += [f"1-0:{obis}.7.0({voltage:05.1f}*V)" for obis, voltage in zip((32, 52, 72), voltages)]
+        lines += [f"1-0:{obis}.7.0({round(power * 1000 / voltage):03d}*A)"
+                  for obis, power, voltage in zip((31, 51, 71), phases, voltages)]
+        lines += [f"1-0:{obis}.7.0({power:06.3f}*kW)" for obis, power in zip((21, 41, 61), phases)]
+        lines += [f"1-0:{obis}.7.0({receiving / 3:06.3f}*kW)" for obis in (22, 42, 62)]
+
+        # The gas meter reports every 5 minutes (DSMR 5) or every hour (DSMR 4):
+        capture_interval = 300 if dsmr >= 5 else 3600
+        lines += [
+            "0-1:24.1.0(003)",
+            f"0-1:96.1.0({self.gas_serial_number})",
+            f"0-1:24.2.1({self._timestamp(self.clock - self.clock % capture_interval)})({self.gas:09.3f}*m3)"
+        ]
+        return lines
+
+    def telegram(self, corrupt_crc: bool = False) -> bytes:
+        """The raw telegram of the current state
+
+        :param corrupt_crc:     Send a wrong checksum. Default value: False
+        :type corrupt_crc:      bool
+
+        :rtype:                 bytes
+        """
+        body = "\r\n".join([self.profile.header, ""] + self.lines() + ["!"]).encode("ascii")
+        if self.profile.dsmr < 4:
+            return body + b"\r\n"
+        crc = crc16(body)
+        if corrupt_crc:
+            crc ^= 1 << self.rng.randrange(16)
+        return body + f"{crc:04X}\r\n".encode("ascii")
+
+
+class FakeMeter:
+    """Stream synthetic telegrams to a pseudo-terminal, from a background thread
+
+    The writes are non-blocking, like a real meter the fake meter does not wait for a slow reader: bytes which do not
+    fit in the buffer of the terminal are lost (counted as overrun_bytes).
+    """
+
+    def __init__(
+            self,
+            meter: str = "iskra",
+            interval: float = None,
+            baudrate: int = None,
+            noise: float = 0.0,
+            crc_errors: float = 0.0,
+            partial: float = 0.0,
+            burst_probability: float = 0.0,
+            burst_size: int = 10,
+            telegrams: int = 0,
+            seed: int = None,
+            link: str = None
+    ):
+        """
+        :param meter:               The meter family, one of METER_PROFILES. Default value: iskra
+        :type meter:                str
+
+        :param interval:            Seconds between telegrams, 0 sends as fast as the line allows.
+                                    Default value: the interval of the meter family
+        :type interval:             float
+
+        :param baudrate:            Bits per second of the emulated line (10 bits per byte), 0 writes without pacing.
+                                    Default value: the baud rate of the meter family
+        :type baudrate:             int
+
+        :param noise:               Probability per telegram of line noise. Default value: 0.0
+        :type noise:                float
+
+        :param crc_errors:          Probability per telegram of a wrong checksum. Default value: 0.0
+        :type crc_errors:           float
+
+        :param partial:             Probability per telegram of cutting it off. Default value: 0.0
+        :type partial:              float
+
+        :param burst_probability:   Probability per interval of a burst of telegrams. Default value: 0.0
+        :type burst_probability:    float
+
+        :param burst_size:          Amount of telegrams in a burst. Default value: 10
+        :type burst_size:           int
+
+        :param telegrams:           Stop after this amount of telegrams, 0 is unlimited. Default value: 0
+        :type telegrams:            int
+
+        :param seed:                Seed of the random generator, for reproducible runs. Default value: random
+        :type seed:                 int
+
+        :param link:                Create a symbolic link with this path to the terminal, e.g. to use a fixed port
+                                    name in the configuration file. Default value: no link
+        :type link:                 str
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if meter not in METER_PROFILES:
+            raise ValueError(f"Unknown meter '{meter}', expected one of {', '.join(METER_PROFILES)}")
+
+        self.meter = meter
+        self.profile = METER_PROFILES[meter]
+        self.interval = interval if interval is not None else self.profile.interval
+        self.baudrate = baudrate if baudrate is not None else self.profile.baudrate
+        self.noise = noise
+        self.crc_errors = crc_errors if self.profile.dsmr >= 4 else 0.0
+        self.partial = partial
+        self.burst_probability = burst_probability
+        self.burst_size = burst_size
+        self.telegrams = telegrams
+        self.link = link
+
+        self.rng = random.Random(seed)
+        self.simulation = MeterSimulation(self.profile, self.rng)
+
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self.port = None
+
+        # Monotonic time at which the last bytes of every complete telegram were written, e.g. to measure latency:
+        self.write_times = collections.deque(maxlen=65536)
+
+        # Counters:
+        self.telegrams_written = 0
+        self.bytes_written = 0
+        self.overrun_bytes = 0
+        self.noisy_telegrams = 0
+        self.corrupted_telegrams = 0
+        self.partial_telegrams = 0
+        self.bursts = 0
+
+    def open(self):
+        """Create the pseudo-terminal, the slave side is available as self.port"""
+        self._master, self._slave = os.openpty()
+        # Pass all bytes unchanged, e.g. no '\r' to '\n' translation:
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+
+        if self.link is not None:
+            if os.path.islink(self.link):
+                os.unlink(self.link)
+            os.symlink(self.port, self.link)
+
+        self.logger.debug(f"Fake {self.meter} meter on {self.port}")
+
+    def close(self):
+        """Stop streaming and remove the pseudo-terminal"""
+        self.stop()
+        if self.link is not None and os.path.islink(self.link):
+            os.unlink(self.link)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+
+    def start(self):
+        """Start streaming from a background thread, the terminal is opened when needed"""
+        if self._master is None:
+            self.open()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name=f"fake-{self.meter}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop streaming"""
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def join(self, timeout: float = None):
+        """Wait until all telegrams are written, only ends by itself when the amount of telegrams is limited"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def __enter__(self) -> 'FakeMeter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def serial_config(self, timeout: int = 20) -> SerialConfig:
+        """The configuration to read the fake meter with
+
+        :param timeout:     See SerialConfig. Default value: 20
+        :type timeout:      int
+
+        :rtype:             SerialConfig
+        """
+        return SerialConfig(
+            baudrate=self.profile.baudrate,
+            bytesize=self.profile.bytesize,
+            parity=self.profile.parity,
+            stopbits=1,
+            timeout=timeout,
+            port=self.port
+        )
+
+    def run(self):
+        """Stream telegrams until stopped or the amount of telegrams is reached"""
+        rng = self.rng
+        next_interval = time.monotonic()
+
+        while not self._stopping.is_set():
+            count = 1
+            if self.burst_probability and rng.random() < self.burst_probability:
+                count = self.burst_size
+                self.bursts += 1
+
+            for _ in range(count):
+                if self.telegrams and self.telegrams_written >= self.telegrams:
+                    return
+                self.simulation.step(self.interval or self.profile.interval)
+                partial_telegrams = self.partial_telegrams
+                telegram = self._faulty_telegram()
+                complete = self.partial_telegrams == partial_telegrams
+                self._write(telegram, paced=count == 1, on_last_chunk=self.write_times.append if complete else None)
+                self.telegrams_written += 1
+
+            next_interval += self.interval
+            delay = next_interval - time.monotonic()
+            if delay > 0:
+                self._stopping.wait(delay)
+            else:
+                # Do not try to catch up after falling behind, e.g. after a burst:
+                next_interval = time.monotonic()
+
+    def _faulty_telegram(self) -> bytes:
+        """The next telegram, with the faults injected at random"""
+        rng = self.rng
+        corrupt_crc = self.crc_errors and rng.random() < self.crc_errors
+        if corrupt_crc:
+            self.corrupted_telegrams += 1
+        telegram = self.simulation.telegram(corrupt_crc=corrupt_crc)
+
+        if self.noise and rng.random() < self.noise:
+            self.noisy_telegrams += 1
+            garbage = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 32)))
+            telegram = bytearray(garbage + telegram)
+            # Flip a byte of the telegram itself, which is only detected by the checksum:
+            position = len(garbage) + rng.randrange(1, len(telegram) - len(garbage))
+            telegram[position] ^= 1 << rng.randrange(7)
+            telegram = bytes(telegram)
+
+        if self.partial and rng.random() < self.partial:
+            self.partial_telegrams += 1
+            telegram = telegram[:rng.randrange(1, telegram.rindex(b"!"))]
+
+        return telegram
+
+    def _write(self, data: bytes, paced: bool = True, on_last_chunk: Callable[[float], None] = None):
+        """Write to the terminal, paced by the baud rate
+
+        :param data:            The bytes to write
+        :param paced:           Pace the bytes by the baud rate, a burst is written at once
+        :param on_last_chunk:   Called with the monotonic time right before the last chunk is written. A reader can
+                                complete the telegram as soon as it is written, so it must be recorded before.
+        """
+        chunk_size = 256
+        seconds_per_byte = 10 / self.baudrate if self.baudrate and paced else 0.0
+        started = time.monotonic()
+
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            if on_last_chunk is not None and offset + chunk_size >= len(data):
+                on_last_chunk(time.monotonic())
+            try:
+                written = os.write(self._master, chunk)
+            except BlockingIOError:
+                written = 0
+            except OSError as e:
+                self.logger.error(f"Can not write to {self.port}, stopping: {str(e)}")
+                self._stopping.set()
+                return
+            self.bytes_written += written
+            self.overrun_bytes += len(chunk) - written
+
+            if seconds_per_byte:
+                delay = started + (offset + len(chunk)) * seconds_per_byte - time.monotonic()
+                if delay > 0:
+                    self._stopping.wait(delay)
+
+    def drain(self, timeout: float = 1.0) -> bool:
+        """Wait until the reader took all written bytes, or the timeout expired
+
+        :return:    True when the buffer of the terminal is empty
+        :rtype:     bool
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([self._slave], [], [], 0)
+            if not readable:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def as_dict(self) -> dict:
+        return {
+            "meter": self.meter,
+            "port": self.port,
+            "telegrams": self.telegrams_written,
+            "bytes": self.bytes_written,
+            "overrun_bytes": self.overrun_bytes,
+            "noisy_telegrams": self.noisy_telegrams,
+            "corrupted_telegrams": self.corrupted_telegrams,
+            "partial_telegrams": self.partial_telegrams,
+            "bursts": self.bursts
+        }
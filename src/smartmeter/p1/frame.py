@@ -0,0 +1,221 @@
+"""Byte level framing of P1 telegrams
+
+A telegram starts with a '/' header line and ends with a line starting with '!'. DSMR 4 and 5 meters put
+a CRC16 checksum (4 hex characters) directly after the '!', calculated over all bytes from the '/' up to
+and including the '!'. Older meters send the '!' without checksum, optionally followed by some text.
+"""
+import logging
+from typing import Iterator, List, Optional, Tuple
+
+
+def _build_crc16_table() -> List[int]:
+    """Build the lookup table for CRC16/ARC (polynomial 0x8005, reflected as 0xA001)"""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _build_crc16_table()
+
+HEX_DIGITS = frozenset(b"0123456789ABCDEFabcdef")
+
+
+def crc16(data: bytes, crc: int = 0) -> int:
+    """Calculate the CRC16 checksum as used by DSMR telegrams
+
+    :param data:    The bytes to calculate the checksum over
+    :type data:     bytes
+
+    :param crc:     The checksum to continue from. Default value: 0
+    :type crc:      int
+
+    :rtype:         int
+    """
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def check_crc(frame: bytes, end_marker: int) -> Optional[bool]:
+    """Verify the checksum of a complete frame
+
+    :param frame:       The frame, starting with '/'
+    :type frame:        bytes
+
+    :param end_marker:  Position of the '!' in the frame
+    :type end_marker:   int
+
+    :return:            True or False when the frame has a checksum, None when it has no checksum
+    :rtype:             Optional[bool]
+    """
+    checksum = frame[end_marker + 1:end_marker + 5]
+    if len(checksum) != 4 or not HEX_DIGITS.issuperset(checksum):
+        return None
+    return crc16(frame[:end_marker + 1]) == int(checksum, 16)
+
+
+def iter_frames(data, start: int = 0, end: int = None) -> Iterator[Tuple[int, int, int]]:
+    """Find all complete frames in a buffer without copying it, e.g. a memory mapped capture file
+
+    Incomplete frames (a new header before the end marker) are skipped. The last frame may end at the end of the
+    buffer without a line ending.
+
+    :param data:    The buffer to search, any object with find() and rfind() like bytes, bytearray or mmap
+    :param start:   Offset to start searching. Default value: 0
+    :param end:     Offset to stop searching. Default value: end of the buffer
+
+    :return:        Tuples of (start, end marker, end) offsets of each frame, the end is exclusive
+    :rtype:         Iterator[Tuple[int, int, int]]
+    """
+    if end is None:
+        end = len(data)
+
+    position = start
+    while position < end:
+        frame_start = data.find(b"/", position, end)
+        if frame_start < 0:
+            return
+
+        end_marker = data.find(b"!", frame_start, end)
+        if end_marker < 0:
+            return
+
+        restart = data.rfind(b"/", frame_start + 1, end_marker)
+        if restart >= 0:
+            position = restart
+            continue
+
+        line_end = data.find(b"\n", end_marker, end)
+        frame_end = line_end + 1 if line_end >= 0 else end
+
+        yield frame_start, end_marker, frame_end
+        position = frame_end
+
+
+class TelegramFramer:
+    """Incrementally find complete telegrams in a stream of raw bytes
+
+    Feed chunks of any size with feed(), complete telegrams are returned as bytes from the '/' up to and
+    including the line ending of the '!' line. Frames with an invalid CRC are dropped.
+    """
+
+    def __init__(self, verify_crc: bool = True, require_crc: bool = False, max_frame_size: int = 16384):
+        """
+        :param verify_crc:      Verify the CRC16 checksum when the meter sends one. Default value: True
+        :type verify_crc:       bool
+
+        :param require_crc:     Drop frames without a checksum (DSMR 2/3 meters). Default value: False
+        :type require_crc:      bool
+
+        :param max_frame_size:  Drop a frame when no end is found within this amount of bytes. Default value: 16384
+        :type max_frame_size:   int
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.verify_crc = verify_crc
+        self.require_crc = require_crc
+        self.max_frame_size = max_frame_size
+
+        self._buffer = bytearray()
+
+        # Counters:
+        self.frames = 0
+        self.crc_errors = 0
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add raw bytes to the framer
+
+        :param chunk:   Raw bytes as read from the serial port
+        :type chunk:    bytes
+
+        :return:        All telegrams completed by this chunk, can be empty
+        :rtype:         List[bytes]
+        """
+        buffer = self._buffer
+        buffer += chunk
+        frames = []
+
+        while True:
+            start = buffer.find(b"/")
+            if start < 0:
+                # No start of a telegram, everything in the buffer is noise:
+                self.dropped_bytes += len(buffer)
+                buffer.clear()
+                break
+            if start > 0:
+                self.dropped_bytes += start
+                del buffer[:start]
+
+            end_marker = buffer.find(b"!")
+            if end_marker < 0:
+                self._check_size(buffer)
+                break
+
+            # A new header before the end marker means we lost the end of the previous telegram:
+            restart = buffer.rfind(b"/", 1, end_marker)
+            if restart >= 0:
+                self.logger.debug("Incomplete telegram dropped, found a new header before the end marker")
+                self.dropped_frames += 1
+                self.dropped_bytes += restart
+                del buffer[:restart]
+                continue
+
+            line_end = buffer.find(b"\n", end_marker)
+            if line_end < 0:
+                # Wait for the checksum and line ending:
+                self._check_size(buffer)
+                break
+
+            frame = bytes(buffer[:line_end + 1])
+            del buffer[:line_end + 1]
+
+            if self._valid(frame, end_marker):
+                self.frames += 1
+                frames.append(frame)
+            else:
+                self.dropped_frames += 1
+
+        return frames
+
+    def _check_size(self, buffer: bytearray):
+        """Drop the pending frame when it grows beyond max_frame_size"""
+        if len(buffer) > self.max_frame_size:
+            self.logger.debug(f"No end of telegram found within {self.max_frame_size} bytes, frame dropped")
+            self.dropped_frames += 1
+            self.dropped_bytes += len(buffer)
+            buffer.clear()
+
+    def _valid(self, frame: bytes, end_marker: int) -> bool:
+        """Check the checksum of a complete frame
+
+        :param frame:       The frame, starting with '/'
+        :param end_marker:  Position of the '!' in the frame
+        """
+        if not self.verify_crc and not self.require_crc:
+            return True
+
+        crc_valid = check_crc(frame, end_marker)
+
+        if crc_valid is None:
+            if self.require_crc:
+                self.logger.debug("Telegram without checksum dropped")
+                return False
+            return True
+
+        if self.verify_crc and not crc_valid:
+            self.logger.debug("Telegram with invalid checksum dropped")
+            self.crc_errors += 1
+            return False
+
+        return True
+
+    def reset(self):
+        """Discard all buffered bytes"""
+        self._buffer.clear()
@@ -0,0 +1,259 @@
+"""A fixed capacity history of the most recent telegrams
+
+The history is a ring buffer of arrays, laid out like a TelegramBatch: one array('d') per numeric OBIS code and
+dictionary encoded strings. All arrays are allocated once, so the memory use does not grow with the amount of
+telegrams seen. When the history is full, every new telegram overwrites the oldest one.
+"""
+from array import array
+import math
+import threading
+from typing import List, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import DEFAULT_SCHEMA, TelegramRecord, TelegramSchema
+
+
+class TelegramHistory:
+    """Ring buffer of the most recent telegrams with a small query API
+
+    Telegrams are expected in order of arrival, i.e. with non-decreasing timestamps (since() relies on that). The
+    history can be shared between threads: appending and querying are guarded by a lock.
+    """
+
+    def __init__(self, capacity: int = 3600, schema: TelegramSchema = None):
+        """
+        :param capacity:    Maximum amount of telegrams to keep. Default value: 3600 (one hour of DSMR 5 telegrams)
+        :type capacity:     int
+
+        :param schema:      The schema of the stored telegrams. Default value: DEFAULT_SCHEMA
+        :type schema:       TelegramSchema
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = capacity
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+
+        self.timestamps = array('d', [math.nan]) * capacity
+        self.sources = array('I', [0]) * capacity
+        self.headers = array('I', [0]) * capacity
+        self.columns = [
+            array('I', [0]) * capacity if data_type == 'str' else array('d', [math.nan]) * capacity
+            for data_type in self.schema.types
+        ]
+        self.dictionary = [None]
+
+        self._dictionary_index = {None: 0}
+        self._string_columns = [column for column in self.columns if column.typecode == 'I']
+        self._next = 0
+        self._length = 0
+        self._lock = threading.Lock()
+
+        # Counters:
+        self.appended = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _encode(self, value) -> int:
+        """Get the dictionary index of a string, add it when needed"""
+        index = self._dictionary_index.get(value)
+        if index is None:
+            index = self._dictionary_index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return index
+
+    def _compact_dictionary(self):
+        """Remove the strings which are no longer referenced by any stored telegram
+
+        Strings are rarely unique per telegram (source, header, serial number), but a text message can be. Compacting
+        keeps the dictionary bounded by the capacity of the history.
+        """
+        columns = [self.sources, self.headers] + self._string_columns
+        positions = [self._position(index) for index in range(self._length)]
+
+        mapping = {0: 0}
+        dictionary = [None]
+        for column in columns:
+            for position in positions:
+                old_index = column[position]
+                new_index = mapping.get(old_index)
+                if new_index is None:
+                    new_index = mapping[old_index] = len(dictionary)
+                    dictionary.append(self.dictionary[old_index])
+                column[position] = new_index
+
+        self.dictionary = dictionary
+        self._dictionary_index = {value: index for index, value in enumerate(dictionary)}
+
+    def append(self, telegram: Union[Telegram, TelegramRecord], timestamp: float = None):
+        """Add a telegram or a record, overwriting the oldest one when the history is full
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+
+        :param timestamp:   Time of the telegram. Default value: the time of the telegram or record
+        :type timestamp:    float
+        """
+        if isinstance(telegram, TelegramRecord):
+            source, header = telegram.source, telegram.header
+            timestamp = timestamp if timestamp is not None else telegram.timestamp
+            values = [telegram.get(obis_id) for obis_id in self.schema.obis_ids]
+        else:
+            source, header = telegram.source, telegram.telegram['header']
+            timestamp = timestamp if timestamp is not None else telegram.telegram['updatedatetime']
+            data = telegram.telegram['data']
+            values = [data.get(obis_id) for obis_id in self.schema.obis_ids]
+
+        with self._lock:
+            if len(self.dictionary) > 2 * self.capacity + 16:
+                self._compact_dictionary()
+
+            position = self._next
+            self.timestamps[position] = timestamp
+            self.sources[position] = self._encode(source)
+            self.headers[position] = self._encode(header)
+
+            for column, value in zip(self.columns, values):
+                if column.typecode == 'I':
+                    column[position] = self._encode(value)
+                else:
+                    column[position] = value if value is not None else math.nan
+
+            self._next = (position + 1) % self.capacity
+            if self._length < self.capacity:
+                self._length += 1
+            self.appended += 1
+
+    def clear(self):
+        """Remove all telegrams"""
+        with self._lock:
+            self._next = 0
+            self._length = 0
+            self.dictionary = [None]
+            self._dictionary_index = {None: 0}
+
+    def _position(self, index: int) -> int:
+        """Position in the arrays of the index-th oldest telegram"""
+        return (self._next - self._length + index) % self.capacity
+
+    def _record(self, position: int) -> TelegramRecord:
+        values = []
+        for column, data_type in zip(self.columns, self.schema.types):
+            value = column[position]
+            if data_type == 'str':
+                value = self.dictionary[value]
+            elif math.isnan(value):
+                value = None
+            elif data_type == 'int':
+                value = int(value)
+            values.append(value)
+
+        return self.schema.new_record(
+            source=self.dictionary[self.sources[position]],
+            header=self.dictionary[self.headers[position]],
+            timestamp=self.timestamps[position],
+            values=tuple(values)
+        )
+
+    def __getitem__(self, index: int) -> TelegramRecord:
+        """Get a telegram by age, 0 is the oldest and -1 the most recent one"""
+        with self._lock:
+            if index < 0:
+                index += self._length
+            if not 0 <= index < self._length:
+                raise IndexError("TelegramHistory index out of range")
+            return self._record(self._position(index))
+
+    def _select(self, first: int, source: str = None) -> List[TelegramRecord]:
+        """The telegrams from the first-th oldest one up to the most recent one, optionally of one meter"""
+        if source is not None:
+            source_index = self._dictionary_index.get(source)
+            if source_index is None:
+                return []
+        records = []
+        for index in range(first, self._length):
+            position = self._position(index)
+            if source is None or self.sources[position] == source_index:
+                records.append(self._record(position))
+        return records
+
+    def last(self, count: int, source: str = None) -> List[TelegramRecord]:
+        """The most recent telegrams, oldest first
+
+        :param count:   Maximum amount of telegrams
+        :type count:    int
+
+        :param source:  Only telegrams of this meter. Default value: all meters
+        :type source:   str
+
+        :rtype:         List[TelegramRecord]
+        """
+        if count <= 0:
+            return []
+        with self._lock:
+            if source is None:
+                return self._select(max(self._length - count, 0))
+            return self._select(0, source)[-count:]
+
+    def since(self, timestamp: float, source: str = None) -> List[TelegramRecord]:
+        """All telegrams at or after a point in time, oldest first
+
+        :param timestamp:   Seconds since the epoch
+        :type timestamp:    float
+
+        :param source:      Only telegrams of this meter. Default value: all meters
+        :type source:       str
+
+        :rtype:             List[TelegramRecord]
+        """
+        with self._lock:
+            # Binary search for the first telegram at or after the timestamp:
+            low, high = 0, self._length
+            while low < high:
+                middle = (low + high) // 2
+                if self.timestamps[self._position(middle)] < timestamp:
+                    low = middle + 1
+                else:
+                    high = middle
+            return self._select(low, source)
+
+    def latest(self, obis_id: str, source: str = None, default=None):
+        """The most recent value of an OBIS code, telegrams without the code are skipped
+
+        :param obis_id:     The OBIS id, e.g. '1-0:1.7.0'
+        :type obis_id:      str
+
+        :param source:      Only telegrams of this meter. Default value: all meters
+        :type source:       str
+
+        :param default:     Returned when no stored telegram has the code. Default value: None
+
+        :exception:         KeyError when the OBIS id is not part of the schema
+        """
+        field = self.schema.index[obis_id]
+        column = self.columns[field]
+        data_type = self.schema.types[field]
+
+        with self._lock:
+            source_index = self._dictionary_index.get(source) if source is not None else None
+            if source is not None and source_index is None:
+                return default
+
+            for index in range(self._length - 1, -1, -1):
+                position = self._position(index)
+                if source_index is not None and self.sources[position] != source_index:
+                    continue
+                value = column[position]
+                if data_type == 'str':
+                    if value:
+                        return self.dictionary[value]
+                elif not math.isnan(value):
+                    return int(value) if data_type == 'int' else value
+        return default
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the history, constant for a given capacity and schema"""
+        arrays = [self.timestamps, self.sources, self.headers] + self.columns
+        return sum(column.itemsize * len(column) for column in arrays)
@@ -0,0 +1,351 @@
+"""Local fan-out of telegrams to many subscribers over a Unix domain socket
+
+A serial port can be opened by one process only. The hub owns the port(s) and broadcasts every parsed telegram to
+all connected subscribers, so storage, dashboards and alerting can share one meter without parsing it again.
+
+Every message on the socket is a frame: a 4 byte length (network order), a 1 byte kind and the payload.
+- KIND_SCHEMA:  sent once after connecting, the OBIS code table (JSON) the records are encoded with
+- KIND_RECORD:  one telegram, encoded by encode_record()
+
+Each subscriber has a bounded queue. When a subscriber is too slow, its oldest frames are dropped, the reader and the
+other subscribers are never stalled.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import struct
+from typing import Dict, Iterator, List, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import DEFAULT_SCHEMA, TelegramRecord, TelegramSchema
+
+
+DEFAULT_SOCKET = "/tmp/smartmeter-p1.sock"
+
+FRAME_HEADER = struct.Struct("!IB")
+KIND_SCHEMA = 0
+KIND_RECORD = 1
+
+_DOUBLE = struct.Struct("!d")
+_LENGTH = struct.Struct("!H")
+
+
+def _pack_string(value: Union[str, None]) -> bytes:
+    # Length 0xFFFF marks None:
+    if value is None:
+        return _LENGTH.pack(0xFFFF)
+    encoded = value.encode("utf-8")[:0xFFFE]
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_string(payload: bytes, offset: int):
+    length, = _LENGTH.unpack_from(payload, offset)
+    offset += _LENGTH.size
+    if length == 0xFFFF:
+        return None, offset
+    return payload[offset:offset + length].decode("utf-8"), offset + length
+
+
+def encode_record(record: TelegramRecord) -> bytes:
+    """Encode a record as the payload of a KIND_RECORD frame
+
+    Layout: timestamp (double), source, header, then every OBIS value in the order of the schema: a double (NaN when
+    missing) for numbers, a length prefixed UTF-8 string for strings.
+
+    :param record:  The record to encode
+    :type record:   TelegramRecord
+
+    :rtype:         bytes
+    """
+    parts = [_DOUBLE.pack(record.timestamp), _pack_string(record.source), _pack_string(record.header)]
+    for data_type, value in zip(record.schema.types, record.values()):
+        if data_type == 'str':
+            parts.append(_pack_string(value))
+        else:
+            parts.append(_DOUBLE.pack(value if value is not None else math.nan))
+    return b"".join(parts)
+
+
+def decode_record(payload: bytes, schema: TelegramSchema = None) -> TelegramRecord:
+    """Decode the payload of a KIND_RECORD frame
+
+    :param payload:     The payload
+    :type payload:      bytes
+
+    :param schema:      The schema the record was encoded with. Default value: DEFAULT_SCHEMA
+    :type schema:       TelegramSchema
+
+    :rtype:             TelegramRecord
+    """
+    schema = schema if schema is not None else DEFAULT_SCHEMA
+
+    timestamp, = _DOUBLE.unpack_from(payload, 0)
+    source, offset = _unpack_string(payload, _DOUBLE.size)
+    header, offset = _unpack_string(payload, offset)
+
+    values = []
+    for data_type in schema.types:
+        if data_type == 'str':
+            value, offset = _unpack_string(payload, offset)
+        else:
+            value, = _DOUBLE.unpack_from(payload, offset)
+            offset += _DOUBLE.size
+            if math.isnan(value):
+                value = None
+            elif data_type == 'int':
+                value = int(value)
+        values.append(value)
+
+    return schema.new_record(source=source, header=header, timestamp=timestamp, values=tuple(values))
+
+
+def frame(kind: int, payload: bytes) -> bytes:
+    """Prefix a payload with the frame header"""
+    return FRAME_HEADER.pack(len(payload), kind) + payload
+
+
+def _schema_payload(schema: TelegramSchema) -> bytes:
+    return json.dumps({
+        obis_id: {"type": data_type, "description": description}
+        for obis_id, data_type, description in zip(schema.obis_ids, schema.types, schema.descriptions)
+    }).encode("utf-8")
+
+
+def _schema_from_payload(payload: bytes) -> TelegramSchema:
+    obis_codes = json.loads(payload.decode("utf-8"))
+    if tuple(obis_codes) == DEFAULT_SCHEMA.obis_ids:
+        return DEFAULT_SCHEMA
+    return TelegramSchema(obis_codes)
+
+
+class _Subscriber:
+    """The connection of one subscriber of the hub"""
+
+    def __init__(self, writer: asyncio.StreamWriter, max_queue: int):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+
+    def put(self, data: Union[bytes, None]):
+        """Queue a frame, None disconnects the subscriber"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+
+class TelegramHub:
+    """Broadcast telegrams to all subscribers connected to a Unix domain socket"""
+
+    def __init__(self, path: str = DEFAULT_SOCKET, max_queue: int = 64, schema: TelegramSchema = None):
+        """
+        :param path:        The Unix domain socket. Default value: /tmp/smartmeter-p1.sock
+        :type path:         str
+
+        :param max_queue:   Amount of frames to buffer per subscriber, the oldest frame is dropped when the buffer is
+                            full. Default value: 64
+        :type max_queue:    int
+
+        :param schema:      The schema to encode the records with. Default value: DEFAULT_SCHEMA
+        :type schema:       TelegramSchema
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.path = path
+        self.max_queue = max_queue
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+
+        self._server = None
+        self._subscribers: List[_Subscriber] = []
+        self._schema_frame = frame(KIND_SCHEMA, _schema_payload(self.schema))
+
+        # Counters:
+        self.published = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def dropped(self) -> Dict[str, int]:
+        """Frames dropped per subscriber"""
+        return {str(subscriber.writer.get_extra_info("peername") or id(subscriber)): subscriber.dropped
+                for subscriber in self._subscribers}
+
+    async def start(self):
+        """Start listening, a stale socket file of a previous run is removed"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        self.logger.info(f"Hub listening on {self.path}")
+
+    async def close(self):
+        """Stop listening and disconnect all subscribers"""
+        server, self._server = self._server, None
+        if server is not None:
+            server.close()
+        # Wake up the subscribers waiting for a frame and disconnect them first: wait_closed() waits for all
+        # connections to be closed (as of Python 3.12.1)
+        for subscriber in list(self._subscribers):
+            subscriber.put(None)
+            subscriber.writer.close()
+        if server is not None:
+            await server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def __aenter__(self) -> 'TelegramHub':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def publish(self, telegram: Union[Telegram, TelegramRecord]):
+        """Encode a telegram once and queue it for all subscribers
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+        """
+        if not isinstance(telegram, TelegramRecord) or telegram.schema is not self.schema:
+            if isinstance(telegram, TelegramRecord):
+                telegram = telegram.to_telegram()
+            telegram = self.schema.record(telegram)
+
+        data = frame(KIND_RECORD, encode_record(telegram))
+        for subscriber in self._subscribers:
+            subscriber.put(data)
+        self.published += 1
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Send the schema and then all queued frames to one subscriber until it disconnects"""
+        subscriber = _Subscriber(writer, self.max_queue)
+        self._subscribers.append(subscriber)
+        self.logger.debug(f"Subscriber connected, {len(self._subscribers)} subscribers")
+        try:
+            writer.write(self._schema_frame)
+            while True:
+                data = await subscriber.queue.get()
+                if data is None:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._subscribers.remove(subscriber)
+            writer.close()
+            if subscriber.dropped:
+                self.logger.info(f"Subscriber disconnected, {subscriber.dropped} frames dropped")
+
+
+class HubSubscriber:
+    """Receive records from a TelegramHub, with a blocking iterator
+
+    Usage:
+
+        with HubSubscriber() as subscriber:
+            for record in subscriber:
+                ...
+    """
+
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: float = None):
+        """
+        :param path:    The Unix domain socket of the hub. Default value: /tmp/smartmeter-p1.sock
+        :type path:     str
+
+        :param timeout: Socket timeout in seconds. Default value: block forever
+        :type timeout:  float
+        """
+        self.path = path
+        self.timeout = timeout
+        self.schema = DEFAULT_SCHEMA
+
+        self._socket = None
+        self._file = None
+
+    def open(self):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        self._socket.connect(self.path)
+        self._file = self._socket.makefile("rb")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def __enter__(self) -> 'HubSubscriber':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self) -> Iterator[TelegramRecord]:
+        """Yield records until the hub closes the connection"""
+        while True:
+            header = self._file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            length, kind = FRAME_HEADER.unpack(header)
+            payload = self._file.read(length)
+            if len(payload) < length:
+                return
+
+            if kind == KIND_SCHEMA:
+                self.schema = _schema_from_payload(payload)
+            elif kind == KIND_RECORD:
+                yield decode_record(payload, self.schema)
+
+
+class AsyncHubSubscriber:
+    """Receive records from a TelegramHub, with an async iterator"""
+
+    def __init__(self, path: str = DEFAULT_SOCKET):
+        """
+        :param path:    The Unix domain socket of the hub. Default value: /tmp/smartmeter-p1.sock
+        :type path:     str
+        """
+        self.path = path
+        self.schema = DEFAULT_SCHEMA
+
+        self._reader = None
+        self._writer = None
+
+    async def open(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def __aenter__(self) -> 'AsyncHubSubscriber':
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __aiter__(self) -> 'AsyncHubSubscriber':
+        return self
+
+    async def __anext__(self) -> TelegramRecord:
+        while True:
+            try:
+                length, kind = FRAME_HEADER.unpack(await self._reader.readexactly(FRAME_HEADER.size))
+                payload = await self._reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                raise StopAsyncIteration
+
+            if kind == KIND_SCHEMA:
+                self.schema = _schema_from_payload(payload)
+            elif kind == KIND_RECORD:
+                return decode_record(payload, self.schema)
@@ -0,0 +1,376 @@
+"""Staged processing of telegrams: a reader thread, a bounded queue and processing workers
+
+The reader thread only reads the serial port(s) and frames the telegrams, it never waits for parsing, logging or
+output. When the processing falls behind, the queue fills up and its overflow policy decides which telegrams are
+lost, instead of the serial buffer of the kernel silently overflowing:
+- OVERFLOW_DROP_OLDEST: drop the oldest queued telegram, the workers always get the most recent data (default)
+- OVERFLOW_DROP_NEWEST: drop the telegram which does not fit, the queued ones are kept
+- OVERFLOW_BLOCK:       the reader waits for room in the queue, nothing is dropped by the queue (the serial port may
+                        still overflow when the processing is too slow for a long time)
+"""
+import collections
+import inspect
+import logging
+import threading
+import time
+from typing import Callable, Iterable, List
+
+from smartmeter.library import LogSampler
+from smartmeter.library.metrics import MetricsRegistry
+from smartmeter.p1.data import Telegram
+
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+
+class QueueClosed(Exception):
+    """Raised by BoundedQueue.get() when the queue is closed and empty"""
+
+
+class BoundedQueue:
+    """A thread-safe FIFO queue with a maximum size and an overflow policy"""
+
+    def __init__(self, maxsize: int = 1024, overflow: str = OVERFLOW_DROP_OLDEST):
+        """
+        :param maxsize:     Maximum amount of queued items. Default value: 1024
+        :type maxsize:      int
+
+        :param overflow:    What to do when the queue is full, one of OVERFLOW_POLICIES.
+                            Default value: OVERFLOW_DROP_OLDEST
+        :type overflow:     str
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow}', expected one of {', '.join(OVERFLOW_POLICIES)}")
+
+        self.maxsize = maxsize
+        self.overflow = overflow
+
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+
+        # Counters:
+        self.put_count = 0
+        self.dropped = 0
+        self.high_water_mark = 0
+        self.blocked_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, item) -> bool:
+        """Queue an item, applying the overflow policy when the queue is full
+
+        :return:    False when an item was dropped (or the queue is closed)
+        :rtype:     bool
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self.put_count += 1
+            accepted = True
+
+            if len(self._items) >= self.maxsize:
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                    accepted = False
+                elif self.overflow == OVERFLOW_DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                else:
+                    started = time.monotonic()
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._not_full.wait()
+                    self.blocked_time += time.monotonic() - started
+                    if self._closed:
+                        return False
+
+            self._items.append(item)
+            if len(self._items) > self.high_water_mark:
+                self.high_water_mark = len(self._items)
+            self._not_empty.notify()
+            return accepted
+
+    def get(self, timeout: float = None):
+        """Remove and return the oldest item
+
+        :param timeout:     Maximum time to wait in seconds. Default value: wait forever
+
+        :exception:         QueueClosed when the queue is closed and all items are taken
+        :exception:         TimeoutError when no item arrived within the timeout
+        """
+        with self._lock:
+            if not self._not_empty.wait_for(lambda: self._items or self._closed, timeout):
+                raise TimeoutError("No item available within the timeout")
+            if not self._items:
+                raise QueueClosed()
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def close(self, discard: bool = False):
+        """Stop accepting items and wake up all waiting threads
+
+        :param discard:     Also discard the queued items, otherwise they can still be taken. Default value: False
+        :type discard:      bool
+        """
+        with self._lock:
+            self._closed = True
+            if discard:
+                self.dropped += len(self._items)
+                self._items.clear()
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def as_dict(self) -> dict:
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "overflow": self.overflow,
+            "queued": self.put_count,
+            "dropped": self.dropped,
+            "high_water_mark": self.high_water_mark,
+            "blocked_time": round(self.blocked_time, 3)
+        }
+
+
+def handler_name(handler: Callable) -> str:
+    """The name of a handler in logs and metrics: the class of a bound method, e.g. a sink, else its qualified name
+
+    :rtype:     str
+    """
+    if inspect.ismethod(handler):
+        return handler.__self__.__class__.__name__
+    return getattr(handler, "__qualname__", repr(handler))
+
+
+class TelegramPipeline:
+    """Read, parse and process telegrams in separate stages
+
+    The reader is any object with a read_frames(timeout) method (ReadTelegrams, ReplayTelegrams), returning a list of
+    (source, raw telegram) tuples, or None when there is nothing left to read. Every parsed telegram is passed to all
+    handlers, in order. With more than one worker, the handlers must be thread-safe and telegrams of the same meter
+    may be handled out of order.
+
+    Usage:
+
+        pipeline = TelegramPipeline(reader, [handler])
+        pipeline.start()
+        pipeline.join()
+    """
+
+    def __init__(
+            self,
+            reader,
+            handlers: List[Callable[[Telegram], None]],
+            max_queue: int = 1024,
+            overflow: str = OVERFLOW_DROP_OLDEST,
+            workers: int = 1,
+            poll_interval: float = 1.0,
+            fields: Iterable[str] = None,
+            metrics: MetricsRegistry = None
+    ):
+        """
+        :param reader:          The source of the raw telegrams
+        :type reader:           Union[ReadTelegrams, ReplayTelegrams]
+
+        :param handlers:        Called with every parsed telegram
+        :type handlers:         List[Callable[[Telegram], None]]
+
+        :param max_queue:       Amount of raw telegrams to buffer between the reader and the workers.
+                                Default value: 1024
+        :type max_queue:        int
+
+        :param overflow:        The overflow policy of the queue, one of OVERFLOW_POLICIES.
+                                Default value: OVERFLOW_DROP_OLDEST
+        :type overflow:         str
+
+        :param workers:         Amount of processing threads. Default value: 1
+        :type workers:          int
+
+        :param poll_interval:   Maximum seconds the reader waits for data before checking for a stop. Default value: 1.0
+        :type poll_interval:    float
+
+        :param fields:          Only parse these OBIS codes, see Telegram. Default value: all known OBIS codes
+        :type fields:           Iterable[str]
+
+        :param metrics:         Record the time spent parsing and in every handler, and export the counters of the
+                                pipeline and its queue. Default value: off
+        :type metrics:          MetricsRegistry
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.reader = reader
+        self.handlers = list(handlers)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.fields = tuple(fields) if fields is not None else None
+        self.queue = BoundedQueue(max_queue, overflow)
+
+        self._stopping = threading.Event()
+        # Log dropped telegrams at most every few seconds, an overloaded pipeline drops many:
+        self._drop_sampler = LogSampler(interval=5.0)
+        self._reader_thread = None
+        self._worker_threads = []
+        self._lock = threading.Lock()
+
+        # Counters:
+        self.frames = 0
+        self.telegrams = 0
+        self.invalid_telegrams = 0
+        self.handler_errors = 0
+
+        self._parse_seconds = None
+        self._handler_seconds = None
+        if metrics is not None:
+            self._parse_seconds = metrics.histogram(
+                "p1_parse_seconds", "Time to parse a telegram, values are converted when the handlers use them"
+            )
+            # The index tells handlers with the same name apart, e.g. two sinks of the same type:
+            self._handler_seconds = [
+                metrics.histogram("p1_handler_seconds", "Time spent in a telegram handler, e.g. a sink",
+                                  handler=handler_name(handler), index=str(index))
+                for index, handler in enumerate(self.handlers)
+            ]
+            metrics.register_collector(self.collect_metrics)
+
+    def start(self):
+        """Start the reader thread and the workers"""
+        self._reader_thread = threading.Thread(target=self._read, name="p1-reader", daemon=True)
+        self._worker_threads = [
+            threading.Thread(target=self._work, name=f"p1-worker-{number}", daemon=True)
+            for number in range(self.workers)
+        ]
+        for thread in self._worker_threads:
+            thread.start()
+        self._reader_thread.start()
+
+    def stop(self, drain: bool = False):
+        """Stop reading, can be called from a handler
+
+        :param drain:   Process the telegrams which are already queued, otherwise they are discarded.
+                        Default value: False
+        :type drain:    bool
+        """
+        self._stopping.set()
+        self.queue.close(discard=not drain)
+
+    def join(self, timeout: float = None):
+        """Wait until the reader has finished and the workers processed all queued telegrams
+
+        :param timeout:     Maximum seconds to wait per thread. Default value: wait forever
+        :type timeout:      float
+        """
+        current = threading.current_thread()
+        for thread in [self._reader_thread] + self._worker_threads:
+            if thread is not None and thread is not current:
+                # Wait in short steps, a blocking join can not be interrupted by the keyboard:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while thread.is_alive() and (deadline is None or time.monotonic() < deadline):
+                    thread.join(0.2)
+
+    def __enter__(self) -> 'TelegramPipeline':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop(drain=exc_type is None)
+        self.join()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in [self._reader_thread] + self._worker_threads if thread is not None)
+
+    def statistics(self) -> dict:
+        return {
+            "frames": self.frames,
+            "telegrams": self.telegrams,
+            "invalid_telegrams": self.invalid_telegrams,
+            "handler_errors": self.handler_errors,
+            "queue": self.queue.as_dict()
+        }
+
+    def collect_metrics(self) -> List[tuple]:
+        """The counters of the pipeline as metrics samples, see MetricsRegistry.register_collector()"""
+        queue = self.queue
+        return [
+            ("p1_telegrams_total", "counter", "Parsed telegrams", {}, self.telegrams),
+            ("p1_invalid_telegrams_total", "counter", "Telegrams without a known header", {}, self.invalid_telegrams),
+            ("p1_handler_errors_total", "counter", "Exceptions raised by telegram handlers", {}, self.handler_errors),
+            ("p1_queue_dropped_total", "counter", "Telegrams dropped by the queue overflow policy", {}, queue.dropped),
+            ("p1_queue_size", "gauge", "Telegrams waiting to be processed", {}, len(queue)),
+            ("p1_queue_high_water_mark", "gauge", "Largest amount of queued telegrams", {}, queue.high_water_mark),
+            ("p1_queue_blocked_seconds_total", "counter", "Time the reader waited for room in the queue", {},
+             queue.blocked_time)
+        ]
+
+    def _read(self):
+        """The reader stage: only reading and framing, everything else is left to the workers"""
+        try:
+            while not self._stopping.is_set():
+                frames = self.reader.read_frames(self.poll_interval)
+                if frames is None:
+                    self.logger.debug("Reader has no more telegrams")
+                    break
+                for frame in frames:
+                    self.frames += 1
+                    if not self.queue.put(frame) and self.queue.overflow != OVERFLOW_BLOCK and self._drop_sampler():
+                        self.logger.debug(f"Queue full, telegram dropped ({self.queue.dropped} dropped)")
+        except Exception as e:
+            self.logger.error(f"Exception in the reader, stopping: {str(e)}")
+        finally:
+            # Let the workers finish the queued telegrams:
+            self.queue.close()
+
+    def _work(self):
+        """A worker stage: parse the raw telegrams and run the handlers"""
+        while True:
+            try:
+                source, frame = self.queue.get()
+            except QueueClosed:
+                return
+
+            if self._parse_seconds is None:
+                telegram = Telegram.parse_bytes(frame, source=source, fields=self.fields)
+            else:
+                started = time.perf_counter()
+                telegram = Telegram.parse_bytes(frame, source=source, fields=self.fields)
+                self._parse_seconds.observe(time.perf_counter() - started)
+
+            if not telegram.has_header():
+                with self._lock:
+                    self.invalid_telegrams += 1
+                continue
+
+            with self._lock:
+                self.telegrams += 1
+
+            handler_seconds = self._handler_seconds
+            for number, handler in enumerate(self.handlers):
+                try:
+                    if handler_seconds is None:
+                        handler(telegram)
+                    else:
+                        started = time.perf_counter()
+                        handler(telegram)
+                        handler_seconds[number].observe(time.perf_counter() - started)
+                except Exception as e:
+                    with self._lock:
+                        self.handler_errors += 1
+                    self.logger.error(f"Exception in telegram handler {handler_name(handler)}: "
+                                      f"{str(e)}")
@@ -1,10 +1,16 @@
 import argparse
 import json
 import logging
+import selectors
 import serial
+import time
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 
 # from smartmeter.p1.config import SerialConfig
 from smartmeter.configuration import SerialConfig
+from smartmeter.library.metrics import MetricsRegistry
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.frame import TelegramFramer
 
 
 def load_config(json_file: str) -> dict:
@@ -26,6 +32,20 @@ def load_config(json_file: str) -> dict:
     return config
 
 
+def positive_int(value: str) -> int:
+    """An argparse type: an integer of at least 1
+
+    :exception:     argparse.ArgumentTypeError when the value is not a positive integer
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
 def parse_args():
     """Parse all supplied arguments and return an argparse namespace object
 
@@ -67,12 +87,121 @@ def parse_args():
         action="store",
         choices=[
             "json",
+            "ndjson",
+            "delta",
             default_output_mode
         ],
         type=str,
         default=default_output_mode,
         help=f"Specify the type of output. Defaults to '{default_output_mode}'"
     )
+
+    parser.add_argument(
+        "-s",
+        "--store",
+        action="store",
+        default=None,
+        help="Directory of the time-series store to append all telegrams to. Default: off"
+    )
+
+    parser.add_argument(
+        "-r",
+        "--replay",
+        action="store",
+        default=None,
+        help="Read telegrams from a capture file instead of the serial port(s). Default: off"
+    )
+
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        default=False,
+        help="Replay the capture file paced by the original timestamps. Default: as fast as possible"
+    )
+
+    parser.add_argument(
+        "--speed",
+        action="store",
+        default=1.0,
+        type=float,
+        help="Speed factor for --realtime, e.g. 60 replays one minute per second. Default: 1.0"
+    )
+
+    parser.add_argument(
+        "--queue-size",
+        action="store",
+        default=1024,
+        type=positive_int,
+        help="Amount of telegrams to buffer between reading and processing. Default: 1024"
+    )
+
+    parser.add_argument(
+        "--overflow",
+        action="store",
+        choices=[
+            "drop_oldest",
+            "drop_newest",
+            "block"
+        ],
+        default="drop_oldest",
+        help="What to do with telegrams when the buffer is full. Default: drop_oldest"
+    )
+
+    parser.add_argument(
+        "--history",
+        action="store",
+        default=3600,
+        type=positive_int,
+        help="Amount of recent telegrams to keep in memory. Default: 3600"
+    )
+
+    parser.add_argument(
+        "--keyframe-interval",
+        action="store",
+        default=60,
+        type=int,
+        help="Output mode 'delta' writes a full telegram every this amount of telegrams, otherwise only the changed "
+             "values. Default: 60"
+    )
+
+    parser.add_argument(
+        "-f",
+        "--fields",
+        action="store",
+        default=None,
+        help="Comma separated OBIS codes to parse, e.g. '1-0:1.7.0,1-0:2.7.0'. Default: all known OBIS codes"
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        action="store",
+        default=None,
+        type=int,
+        help="Serve metrics in the Prometheus text format on this port (127.0.0.1). Default: off"
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        action="store",
+        default=None,
+        help="Write metrics in the Prometheus text format to this file. Default: off"
+    )
+
+    parser.add_argument(
+        "--metrics-interval",
+        action="store",
+        default=10.0,
+        type=float,
+        help="Seconds between writes of the metrics file. Default: 10.0"
+    )
+
+    parser.add_argument(
+        "--log-every",
+        action="store",
+        default=1,
+        type=positive_int,
+        help="Log one of every this amount of telegrams. Default: 1 (every telegram)"
+    )
     return parser.parse_args()
 
 
@@ -119,12 +248,239 @@ class P1Connection:
         self.serial_connection.port = self.serial_config.port
 
 
+class PortStatistics:
+    """Throughput and error counters of a single port"""
+
+    def __init__(self, name: str):
+        """
+        :param name:    The name of the meter (port)
+        :type name:     str
+        """
+        self.name = name
+        self.started = time.monotonic()
+        self.bytes_read = 0
+        self.telegrams = 0
+        self.dropped_telegrams = 0
+        self.crc_errors = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_read / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def telegrams_per_second(self) -> float:
+        return self.telegrams / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "elapsed": round(self.elapsed, 3),
+            "bytes_read": self.bytes_read,
+            "bytes_per_second": round(self.bytes_per_second, 1),
+            "telegrams": self.telegrams,
+            "telegrams_per_second": round(self.telegrams_per_second, 3),
+            "dropped_telegrams": self.dropped_telegrams,
+            "crc_errors": self.crc_errors
+        }
+
+    def __repr__(self):
+        return f"PortStatistics({self.as_dict()})"
+
+
 class ReadTelegrams:
-    """A class to provide the means to read data from the P1 port"""
+    """A class to provide the means to read data from one or more P1 ports
+
+    All ports are serviced from one thread with a selector. Every telegram is tagged with the name of the
+    meter it was read from (Telegram.source).
+    """
 
-    def __init__(self, configuration: dict):
+    def __init__(
+            self,
+            configuration: Union[List[SerialConfig], Dict[str, SerialConfig]],
+            chunk_size: int = 4096,
+            fields: Iterable[str] = None,
+            metrics: MetricsRegistry = None
+    ):
         """
-        :param configuration:   A dictionary containing all needed paramters
-        :type configuration:    dict
+        :param configuration:   The serial configuration of all meters, either a list (named after the port)
+                                or a dictionary by name of the meter
+        :type configuration:    Union[List[SerialConfig], Dict[str, SerialConfig]]
+
+        :param chunk_size:      Maximum amount of bytes read from a port at once. Default value: 4096
+        :type chunk_size:       int
+
+        :param fields:          Only parse these OBIS codes, see Telegram. Default value: all known OBIS codes
+        :type fields:           Iterable[str]
+
+        :param metrics:         Record the time spent waiting for and framing data, and export the port statistics.
+                                Default value: off
+        :type metrics:          MetricsRegistry
         """
+        self.logger = logging.getLogger(__name__)
+
+        if not isinstance(configuration, dict):
+            configuration = {serial_config.port: serial_config for serial_config in configuration}
         self.configuration = configuration
+        self.chunk_size = chunk_size
+        self.fields = tuple(fields) if fields is not None else None
+
+        self.connections = {name: P1Connection(serial_config=config) for name, config in configuration.items()}
+        self.framers = {name: TelegramFramer() for name in configuration}
+        self.statistics = {name: PortStatistics(name) for name in configuration}
+
+        self._selector = None
+
+        self._read_wait = None
+        self._framing = None
+        if metrics is not None:
+            self._read_wait = metrics.histogram("p1_read_wait_seconds", "Time spent waiting for data from any meter")
+            self._framing = {
+                name: metrics.histogram("p1_framing_seconds", "Time to frame a chunk of serial data", meter=name)
+                for name in configuration
+            }
+            metrics.register_collector(self.collect_metrics)
+
+    def open(self):
+        """Open all ports, ports which can not be opened are logged and skipped
+
+        :exception: serial.SerialException when none of the ports could be opened
+        """
+        self._selector = selectors.DefaultSelector()
+
+        for name, connection in self.connections.items():
+            serial_connection = connection.serial_connection
+            # The selector tells us when data is available, reads should never block:
+            serial_connection.timeout = 0
+            try:
+                serial_connection.open()
+            except serial.SerialException as e:
+                self.logger.error(f"Can not open serial connection of meter '{name}': {str(e)}")
+                continue
+            self._selector.register(serial_connection.fileno(), selectors.EVENT_READ, name)
+            self.logger.debug(f"Opened serial connection of meter '{name}' on {connection.serial_config.port}")
+
+        if not self._selector.get_map():
+            raise serial.SerialException("None of the serial connections could be opened")
+
+    def close(self):
+        """Close all ports"""
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+        for connection in self.connections.values():
+            if connection.serial_connection.is_open:
+                connection.serial_connection.close()
+
+    def __enter__(self) -> 'ReadTelegrams':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self) -> Iterator[Telegram]:
+        """Yield telegrams of all meters as they arrive, until all ports are closed"""
+        while self._selector is not None and self._selector.get_map():
+            yield from self.read()
+
+    def read(self, timeout: float = None) -> List[Telegram]:
+        """Wait for data on any of the ports and return all telegrams completed by it
+
+        :param timeout:     Maximum time to wait in seconds. Defaults to the largest serial timeout of all meters
+        :type timeout:      float
+
+        :return:            The telegrams, can be empty when the timeout expired
+        :rtype:             List[Telegram]
+        """
+        if timeout is None:
+            timeout = max(config.timeout for config in self.configuration.values()) or None
+
+        events = self._select(timeout)
+        if not events:
+            self.logger.warning(f"No data received from any meter within {timeout} seconds")
+
+        telegrams = []
+        for name, frame in self._read_events(events):
+            telegram = Telegram.parse_bytes(frame, source=name, fields=self.fields)
+            if telegram.has_header():
+                telegrams.append(telegram)
+        return telegrams
+
+    def read_frames(self, timeout: float = None) -> Union[List[Tuple[str, bytes]], None]:
+        """Wait for data on any of the ports and return all raw telegrams completed by it, without parsing them
+
+        :param timeout:     Maximum time to wait in seconds. Default value: wait forever
+        :type timeout:      float
+
+        :return:            Tuples of (name of the meter, raw telegram), can be empty when the timeout expired.
+                            None when all ports are closed
+        :rtype:             Union[List[Tuple[str, bytes]], None]
+        """
+        if self._selector is None or not self._selector.get_map():
+            return None
+        return self._read_events(self._select(timeout))
+
+    def _select(self, timeout: float = None) -> list:
+        """Wait for data on any of the ports"""
+        if self._read_wait is None:
+            return self._selector.select(timeout)
+        started = time.perf_counter()
+        events = self._selector.select(timeout)
+        self._read_wait.observe(time.perf_counter() - started)
+        return events
+
+    def _read_events(self, events) -> List[Tuple[str, bytes]]:
+        """Read the ports which have data available and feed the framers"""
+        frames = []
+        for key, _ in events:
+            name = key.data
+            serial_connection = self.connections[name].serial_connection
+            try:
+                chunk = serial_connection.read(min(serial_connection.in_waiting or 1, self.chunk_size))
+            except Exception as e:
+                self.logger.error(f"Exception while reading from meter '{name}', closing it: {str(e)}")
+                self._selector.unregister(key.fd)
+                serial_connection.close()
+                continue
+
+            framer = self.framers[name]
+            statistics = self.statistics[name]
+            statistics.bytes_read += len(chunk)
+
+            if self._framing is None:
+                completed = framer.feed(chunk)
+            else:
+                started = time.perf_counter()
+                completed = framer.feed(chunk)
+                self._framing[name].observe(time.perf_counter() - started)
+
+            for frame in completed:
+                statistics.telegrams += 1
+                frames.append((name, frame))
+
+            statistics.dropped_telegrams = framer.dropped_frames
+            statistics.crc_errors = framer.crc_errors
+
+        return frames
+
+    def collect_metrics(self) -> List[tuple]:
+        """The statistics of all ports as metrics samples, see MetricsRegistry.register_collector()"""
+        samples = []
+        for name, statistics in self.statistics.items():
+            framer = self.framers[name]
+            labels = {"meter": name}
+            samples += [
+                ("p1_bytes_read_total", "counter", "Bytes read from the serial port", labels, statistics.bytes_read),
+                ("p1_frames_total", "counter", "Complete telegrams found by the framer", labels, framer.frames),
+                ("p1_dropped_frames_total", "counter", "Incomplete or invalid telegrams dropped by the framer",
+                 labels, framer.dropped_frames),
+                ("p1_crc_errors_total", "counter", "Telegrams with an invalid checksum", labels, framer.crc_errors),
+                ("p1_dropped_bytes_total", "counter", "Bytes outside of any telegram (noise)", labels,
+                 framer.dropped_bytes)
+            ]
+        return samples
@@ -0,0 +1,345 @@
+"""Compact representations of parsed telegrams
+
+A TelegramSchema describes the known OBIS codes once: ids, field names, types and descriptions. Records and batches
+refer to the schema instead of carrying the metadata themselves.
+
+- TelegramRecord: one telegram, a __slots__ class with one field per OBIS code of the schema
+- TelegramBatch:  many telegrams, stored column wise in arrays
+"""
+from array import array
+import math
+import re
+import sys
+from typing import Iterator, List, Union
+
+from smartmeter.p1.data import SCALAR_TYPES, Telegram
+
+
+# The timestamp of the meter (DSMR 4/5):
+TIMESTAMP_OBIS_CODE = "0-0:1.0.0"
+
+
+def field_name(obis_id: str) -> str:
+    """Convert an OBIS id to a valid attribute name, e.g. '1-0:1.8.1' becomes 'obis_1_0_1_8_1'
+
+    :param obis_id:     The OBIS id
+    :type obis_id:      str
+
+    :rtype:             str
+    """
+    return "obis_" + re.sub(r'[^0-9A-Za-z]', '_', obis_id)
+
+
+class TelegramRecord:
+    """Base class of the records created by TelegramSchema, holds the fields which are not OBIS values"""
+
+    __slots__ = ("source", "header", "timestamp")
+
+    # Set on the subclass created by the schema:
+    schema = None
+
+    def __init__(self, source: str = None, header: str = "", timestamp: float = 0.0, values: tuple = None):
+        """
+        :param source:      Name of the meter (port) the telegram was read from
+        :type source:       str
+
+        :param header:      The header line of the telegram
+        :type header:       str
+
+        :param timestamp:   Time of the telegram in seconds since the epoch
+        :type timestamp:    float
+
+        :param values:      The OBIS values in the order of the schema, None for missing values
+        :type values:       tuple
+        """
+        self.source = source
+        self.header = header
+        self.timestamp = timestamp
+
+        if values is None:
+            values = (None,) * len(self.schema.fields)
+        for field, value in zip(self.schema.fields, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_telegram(cls, telegram: Telegram, timestamp: float = None) -> 'TelegramRecord':
+        """Create a record from a parsed telegram
+
+        :param telegram:    The parsed telegram
+        :type telegram:     smartmeter.p1.data.Telegram
+
+        :param timestamp:   Time of the telegram. Default value: the update time of the telegram
+        :type timestamp:    float
+
+        :rtype:             TelegramRecord
+        """
+        data = telegram.telegram['data']
+        return cls(
+            source=telegram.source,
+            header=sys.intern(telegram.telegram['header']),
+            timestamp=timestamp if timestamp is not None else telegram.telegram['updatedatetime'],
+            values=tuple(data.get(obis_id) for obis_id in cls.schema.obis_ids)
+        )
+
+    def to_telegram(self) -> Telegram:
+        """Convert the record back to a Telegram object
+
+        :rtype:     smartmeter.p1.data.Telegram
+        """
+        telegram = Telegram(source=self.source)
+        telegram.telegram['header'] = self.header
+        telegram.telegram['updatedatetime'] = self.timestamp
+        telegram.telegram['data'] = self.data()
+        return telegram
+
+    def values(self) -> tuple:
+        """The OBIS values in the order of the schema"""
+        return tuple(getattr(self, field) for field in self.schema.fields)
+
+    def data(self) -> dict:
+        """The available OBIS values by OBIS id, like Telegram.telegram['data']"""
+        return {
+            obis_id: value
+            for obis_id, value in zip(self.schema.obis_ids, self.values())
+            if value is not None
+        }
+
+    def __getitem__(self, obis_id: str):
+        return getattr(self, self.schema.fields[self.schema.index[obis_id]])
+
+    def __reduce__(self):
+        # The record class is created at runtime, pickle the record by its schema:
+        return self.schema.new_record, (self.source, self.header, self.timestamp, self.values())
+
+    def get(self, obis_id: str, default=None):
+        """Get a value by OBIS id, like dict.get()"""
+        position = self.schema.index.get(obis_id)
+        if position is None:
+            return default
+        value = getattr(self, self.schema.fields[position])
+        return value if value is not None else default
+
+    def __eq__(self, other):
+        if not isinstance(other, TelegramRecord):
+            return NotImplemented
+        return (self.schema is other.schema and self.source == other.source and self.header == other.header and
+                self.timestamp == other.timestamp and self.values() == other.values())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(source={self.source!r}, header={self.header!r}, " \
+               f"timestamp={self.timestamp!r}, data={self.data()!r})"
+
+
+def meter_timestamp(telegram: Union[Telegram, 'TelegramRecord']) -> float:
+    """The time of the readings of a telegram: the timestamp of the meter ('0-0:1.0.0'), or the time the telegram
+    was received when it has none (DSMR 2/3)
+
+    :param telegram:    The parsed telegram or a record
+    :type telegram:     Union[Telegram, TelegramRecord]
+
+    :return:            Seconds since the epoch
+    :rtype:             float
+    """
+    if isinstance(telegram, TelegramRecord):
+        timestamp = telegram.get(TIMESTAMP_OBIS_CODE)
+        return timestamp if timestamp is not None else telegram.timestamp
+    timestamp = telegram.value(TIMESTAMP_OBIS_CODE)
+    return timestamp if timestamp is not None else telegram.telegram['updatedatetime']
+
+
+class TelegramSchema:
+    """The fixed layout of records and batches, shared by all of them"""
+
+    def __init__(self, obis_codes: dict = None):
+        """
+        :param obis_codes:  The OBIS code table to use, codes which do not have a single value (the event log) are
+                            left out. Default value: Telegram.OBIS_CODES
+        :type obis_codes:   dict
+        """
+        obis_codes = obis_codes if obis_codes is not None else Telegram.OBIS_CODES
+        obis_codes = {obis_id: code for obis_id, code in obis_codes.items() if code['type'] in SCALAR_TYPES}
+        self._obis_codes = obis_codes
+
+        self.obis_ids = tuple(sys.intern(obis_id) for obis_id in obis_codes)
+        self.fields = tuple(field_name(obis_id) for obis_id in self.obis_ids)
+        self.types = tuple(obis_codes[obis_id]['type'] for obis_id in self.obis_ids)
+        self.descriptions = tuple(obis_codes[obis_id]['description'] for obis_id in self.obis_ids)
+        self.index = {obis_id: position for position, obis_id in enumerate(self.obis_ids)}
+
+        self.record_class = type("TelegramRecord", (TelegramRecord,), {"__slots__": self.fields, "schema": self})
+
+    def __len__(self) -> int:
+        return len(self.obis_ids)
+
+    def __reduce__(self):
+        # Unpickle the default schema as the same object, other schemas are rebuilt from their OBIS code table:
+        if self is DEFAULT_SCHEMA:
+            return "DEFAULT_SCHEMA"
+        return TelegramSchema, (self._obis_codes,)
+
+    def new_record(self, source: str = None, header: str = "", timestamp: float = 0.0, values: tuple = None):
+        """Create a record of this schema, see TelegramRecord for the parameters
+
+        :rtype:     TelegramRecord
+        """
+        return self.record_class(source=source, header=header, timestamp=timestamp, values=values)
+
+    def record(self, telegram: Telegram, timestamp: float = None) -> TelegramRecord:
+        """Create a record of this schema from a parsed telegram
+
+        :rtype:     TelegramRecord
+        """
+        return self.record_class.from_telegram(telegram, timestamp)
+
+    def as_dict(self) -> dict:
+        """The schema as a dictionary by OBIS id, e.g. to emit it once in front of a stream of records"""
+        return {
+            obis_id: {"field": field, "type": data_type, "description": description}
+            for obis_id, field, data_type, description in zip(self.obis_ids, self.fields, self.types, self.descriptions)
+        }
+
+
+DEFAULT_SCHEMA = TelegramSchema()
+
+
+class TelegramBatch:
+    """A column wise container for many telegrams
+
+    Numeric OBIS values are stored in an array('d') per OBIS code, missing values are NaN. Strings (source, header,
+    serial number, ...) are dictionary encoded: one list of the unique values and an array('I') of indices per column.
+    """
+
+    def __init__(self, schema: TelegramSchema = None):
+        """
+        :param schema:  The schema of the batch. Default value: DEFAULT_SCHEMA
+        :type schema:   TelegramSchema
+        """
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+
+        self.timestamps = array('d')
+        self.sources = array('I')
+        self.headers = array('I')
+        self.columns = [array('I') if data_type == 'str' else array('d') for data_type in self.schema.types]
+        self.dictionary = [None]
+
+        self._dictionary_index = {None: 0}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getstate__(self) -> dict:
+        # The lookup index of the dictionary can be rebuilt, no need to pickle it:
+        state = self.__dict__.copy()
+        del state['_dictionary_index']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._dictionary_index = {value: index for index, value in enumerate(self.dictionary)}
+
+    def _encode(self, value) -> int:
+        """Get the dictionary index of a string, add it when needed"""
+        index = self._dictionary_index.get(value)
+        if index is None:
+            index = self._dictionary_index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return index
+
+    def append(self, telegram: Union[Telegram, TelegramRecord], timestamp: float = None):
+        """Add a telegram or a record
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+
+        :param timestamp:   Time of the telegram. Default value: the time of the telegram or record
+        :type timestamp:    float
+        """
+        if isinstance(telegram, TelegramRecord):
+            source, header = telegram.source, telegram.header
+            timestamp = timestamp if timestamp is not None else telegram.timestamp
+            values = (telegram.get(obis_id) for obis_id in self.schema.obis_ids)
+        else:
+            source, header = telegram.source, telegram.telegram['header']
+            timestamp = timestamp if timestamp is not None else telegram.telegram['updatedatetime']
+            data = telegram.telegram['data']
+            values = (data.get(obis_id) for obis_id in self.schema.obis_ids)
+
+        self.timestamps.append(timestamp)
+        self.sources.append(self._encode(source))
+        self.headers.append(self._encode(header))
+
+        for column, data_type, value in zip(self.columns, self.schema.types, values):
+            if data_type == 'str':
+                column.append(self._encode(value))
+            else:
+                column.append(value if value is not None else math.nan)
+
+    def extend(self, telegrams):
+        """Add many telegrams or records"""
+        for telegram in telegrams:
+            self.append(telegram)
+
+    def column(self, obis_id: str) -> Union[array, list]:
+        """All values of one OBIS code
+
+        :return:    The array of a numeric code (NaN for missing values), a list of values for strings (None for missing
+                    values)
+        """
+        column = self.columns[self.schema.index[obis_id]]
+        if column.typecode == 'I':
+            return [self.dictionary[index] for index in column]
+        return column
+
+    def _value(self, position: int, field: int):
+        value = self.columns[field][position]
+        data_type = self.schema.types[field]
+        if data_type == 'str':
+            return self.dictionary[value]
+        if math.isnan(value):
+            return None
+        return int(value) if data_type == 'int' else value
+
+    def __getitem__(self, position: int) -> TelegramRecord:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("TelegramBatch index out of range")
+
+        return self.schema.record_class(
+            source=self.dictionary[self.sources[position]],
+            header=self.dictionary[self.headers[position]],
+            timestamp=self.timestamps[position],
+            values=tuple(self._value(position, field) for field in range(len(self.schema)))
+        )
+
+    def __iter__(self) -> Iterator[TelegramRecord]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def telegrams(self) -> Iterator[Telegram]:
+        """Rebuild Telegram objects from the columns
+
+        :rtype:     Iterator[Telegram]
+        """
+        for record in self:
+            yield record.to_telegram()
+
+    def column_names(self) -> List[str]:
+        """Names of the columns, in the order used by rows()"""
+        return ['timestamp', 'source', 'header'] + list(self.schema.obis_ids)
+
+    def rows(self) -> Iterator[list]:
+        """Yield the telegrams as rows of values in the order of column_names(), missing values are empty strings
+
+        :rtype:     Iterator[list]
+        """
+        for record in self:
+            yield [record.timestamp, record.source, record.header] + [
+                value if value is not None else "" for value in record.values()
+            ]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the batch"""
+        arrays = [self.timestamps, self.sources, self.headers] + self.columns
+        return sum(column.itemsize * len(column) for column in arrays)
@@ -0,0 +1,168 @@
+"""Replay captured telegram dumps
+
+A capture is the raw output of a P1 port (see smartmeter_output_sample.txt), possibly many telegrams
+concatenated into one large archive. The file is memory mapped, so it is never read into memory as a whole.
+"""
+import logging
+import mmap
+import os
+import re
+import time
+from typing import Iterator, List, Optional, Tuple, Union
+
+from smartmeter.p1.data import Telegram, parse_timestamp
+from smartmeter.p1.frame import check_crc, iter_frames
+
+
+# The timestamp of a DSMR 4/5 telegram, e.g. '0-0:1.0.0(101209113020W)':
+TIMESTAMP_REGEX = re.compile(rb'0-0:1\.0\.0\(([0-9]{12}[SW]?)\)')
+
+
+def frame_timestamp(frame: bytes) -> Optional[float]:
+    """Get the timestamp of the meter from a raw telegram
+
+    :param frame:   The raw telegram
+    :type frame:    bytes
+
+    :return:        The timestamp in seconds since the epoch (see parse_timestamp()), None when the telegram has no
+                    timestamp (DSMR 2/3) or an invalid one
+    :rtype:         Optional[float]
+    """
+    matches = TIMESTAMP_REGEX.search(frame)
+    if matches is None:
+        return None
+    try:
+        return parse_timestamp(matches.group(1).decode("ascii"))
+    except ValueError:
+        return None
+
+
+class ReplayTelegrams:
+    """Yield the telegrams of a capture file as Telegram objects, like the serial readers do
+
+    Two modes are supported:
+    - as fast as possible (default)
+    - real-time pacing, the time between telegrams follows the timestamps of the meter ('0-0:1.0.0'). Telegrams
+      without a timestamp are paced by a fixed interval.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            realtime: bool = False,
+            speed: float = 1.0,
+            interval: float = 1.0,
+            verify_crc: bool = True,
+            source: str = None
+    ):
+        """
+        :param filename:    The capture file to replay
+        :type filename:     str
+
+        :param realtime:    Pace the telegrams by their original timestamps. Default value: False
+        :type realtime:     bool
+
+        :param speed:       Speed factor for real-time pacing, e.g. 60 replays one minute per second. Default value: 1.0
+        :type speed:        float
+
+        :param interval:    Seconds between telegrams without a timestamp in real-time mode. Default value: 1.0
+        :type interval:     float
+
+        :param verify_crc:  Skip telegrams with an invalid checksum. Default value: True
+        :type verify_crc:   bool
+
+        :param source:      Name to tag the telegrams with. Default value: the filename
+        :type source:       str
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if speed <= 0:
+            raise ValueError("speed must be larger than 0")
+
+        self.filename = filename
+        self.realtime = realtime
+        self.speed = speed
+        self.interval = interval
+        self.verify_crc = verify_crc
+        self.source = source if source is not None else filename
+
+        # Counters:
+        self.telegrams = 0
+        self.crc_errors = 0
+
+        self._frames = None
+
+    def __iter__(self) -> Iterator[Telegram]:
+        for frame in self.frames():
+            telegram = Telegram.parse_bytes(frame, source=self.source)
+            if telegram.has_header():
+                self.telegrams += 1
+                yield telegram
+
+    def read_frames(self, timeout: float = None) -> Union[List[Tuple[str, bytes]], None]:
+        """Return the next raw telegram, the same interface as ReadTelegrams.read_frames()
+
+        :param timeout:     Not used, replaying never waits longer than the pacing
+        :type timeout:      float
+
+        :return:            A list with one tuple of (source, raw telegram), None at the end of the file
+        :rtype:             Union[List[Tuple[str, bytes]], None]
+        """
+        if self._frames is None:
+            self._frames = self.frames()
+
+        frame = next(self._frames, None)
+        if frame is None:
+            return None
+        self.telegrams += 1
+        return [(self.source, frame)]
+
+    def frames(self) -> Iterator[bytes]:
+        """Yield the raw telegrams of the capture file, paced when real-time mode is enabled
+
+        :rtype:     Iterator[bytes]
+        """
+        if os.path.getsize(self.filename) == 0:
+            return
+
+        with open(self.filename, "rb") as file_handler, \
+                mmap.mmap(file_handler.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pacer = self._pace() if self.realtime else None
+            if pacer is not None:
+                next(pacer)
+
+            for frame_start, end_marker, frame_end in iter_frames(data):
+                frame = data[frame_start:frame_end]
+
+                if self.verify_crc and check_crc(frame, end_marker - frame_start) is False:
+                    self.logger.debug(f"Telegram at offset {frame_start} with invalid checksum skipped")
+                    self.crc_errors += 1
+                    continue
+
+                if pacer is not None:
+                    pacer.send(frame)
+                yield frame
+
+    def _pace(self):
+        """Generator which sleeps until each frame sent to it is due"""
+        started = time.monotonic()
+        first_timestamp = None
+        offset = 0.0
+
+        while True:
+            frame = yield
+            timestamp = frame_timestamp(frame)
+
+            if timestamp is None:
+                # No timestamp from the meter, pace by the fixed interval:
+                due = offset
+                offset += self.interval
+            else:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                due = timestamp - first_timestamp
+                offset = due + self.interval
+
+            delay = started + due / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
@@ -0,0 +1,268 @@
+"""Incremental rollups of telegrams per time window
+
+The RollupEngine consumes telegrams as they arrive and keeps one open window per meter and window size. For power
+('1-0:1.7.0', '1-0:2.7.0') it keeps the minimum, maximum, mean and last value, for the cumulative registers
+('1-0:1.8.x', '1-0:2.8.x') the energy delta per tariff ('0-0:96.14.0'). A window is closed and emitted as soon as a
+telegram of a later window arrives.
+
+The quarter-hour windows also feed the peak tracking for capacity tariffs: the highest quarter-hour average power
+delivered per meter and month.
+"""
+import datetime
+import logging
+from typing import Callable, Dict, List, Tuple, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import meter_timestamp, TelegramRecord
+
+
+POWER_OBIS_CODES = ("1-0:1.7.0", "1-0:2.7.0")
+ENERGY_OBIS_CODES = ("1-0:1.8.1", "1-0:1.8.2", "1-0:2.8.1", "1-0:2.8.2")
+DELIVERED_OBIS_CODES = ("1-0:1.8.1", "1-0:1.8.2")
+TARIFF_OBIS_CODE = "0-0:96.14.0"
+
+DEFAULT_WINDOWS = {
+    "1m": 60,
+    "15m": 900,
+    "1h": 3600
+}
+
+QUARTER_HOUR = 900
+
+
+class PowerStatistics:
+    """Running statistics of a power value"""
+
+    __slots__ = ("count", "minimum", "maximum", "total", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.last = None
+
+    def add(self, value: float):
+        if self.count == 0:
+            self.minimum = self.maximum = value
+        elif value < self.minimum:
+            self.minimum = value
+        elif value > self.maximum:
+            self.maximum = value
+        self.count += 1
+        self.total += value
+        self.last = value
+
+    @property
+    def mean(self) -> Union[float, None]:
+        return self.total / self.count if self.count else None
+
+    def as_dict(self) -> dict:
+        return {"min": self.minimum, "max": self.maximum, "mean": self.mean, "last": self.last, "count": self.count}
+
+
+class Rollup:
+    """The aggregates of one window of one meter"""
+
+    __slots__ = ("source", "name", "start", "end", "telegrams", "power", "energy")
+
+    def __init__(self, source: str, name: str, start: float, size: int):
+        """
+        :param source:  Name of the meter
+        :param name:    Name of the window size, e.g. '15m'
+        :param start:   Start of the window in seconds since the epoch
+        :param size:    Size of the window in seconds
+        """
+        self.source = source
+        self.name = name
+        self.start = start
+        self.end = start + size
+        self.telegrams = 0
+        self.power = {obis_id: PowerStatistics() for obis_id in POWER_OBIS_CODES}
+        # Energy delta per tariff, per register:
+        self.energy: Dict[int, Dict[str, float]] = {}
+
+    def add_energy(self, tariff: int, obis_id: str, delta: float):
+        registers = self.energy.get(tariff)
+        if registers is None:
+            registers = self.energy[tariff] = {}
+        registers[obis_id] = registers.get(obis_id, 0.0) + delta
+
+    def energy_total(self, obis_ids: Tuple[str, ...] = DELIVERED_OBIS_CODES) -> float:
+        """The energy delta of the window summed over all tariffs and the given registers, in kWh"""
+        return sum(delta for registers in self.energy.values()
+                   for obis_id, delta in registers.items() if obis_id in obis_ids)
+
+    @property
+    def average_power_delivered(self) -> float:
+        """The average power delivered over the whole window in kW, calculated from the energy registers"""
+        return self.energy_total(DELIVERED_OBIS_CODES) * 3600 / (self.end - self.start)
+
+    def as_dict(self) -> dict:
+        return {
+            "source": self.source,
+            "window": self.name,
+            "start": self.start,
+            "end": self.end,
+            "telegrams": self.telegrams,
+            "power": {obis_id: statistics.as_dict() for obis_id, statistics in self.power.items()},
+            "energy": {str(tariff): registers for tariff, registers in self.energy.items()}
+        }
+
+    def __repr__(self):
+        return f"Rollup({self.as_dict()})"
+
+
+class RollupEngine:
+    """Maintain rollups of all meters for a set of window sizes"""
+
+    def __init__(self, windows: Dict[str, int] = None, on_window: Callable[[Rollup], None] = None):
+        """
+        :param windows:     The window sizes by name, in seconds. Default value: 1m, 15m and 1h
+        :type windows:      Dict[str, int]
+
+        :param on_window:   Called with every closed window, next to returning them from add()
+        :type on_window:    Callable[[Rollup], None]
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.windows = windows if windows is not None else DEFAULT_WINDOWS.copy()
+        self.on_window = on_window
+
+        # Open window per (source, window name):
+        self._current: Dict[Tuple[str, str], Rollup] = {}
+        # Last value of the energy registers per source:
+        self._counters: Dict[str, Dict[str, float]] = {}
+        # Highest quarter-hour average power delivered per (source, 'YYYY-MM'): (kW, start of the quarter):
+        self.quarter_peaks: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        # Time of the last telegram added per source:
+        self._last_timestamps: Dict[str, float] = {}
+
+        # Counters:
+        self.late_telegrams = 0
+
+    def current(self, name: str, source: str = None) -> Union[Rollup, None]:
+        """The open window of a meter
+
+        :param name:    Name of the window size, e.g. '15m'
+        :param source:  Name of the meter
+
+        :rtype:         Union[Rollup, None]
+        """
+        return self._current.get((source, name))
+
+    def add(self, telegram: Union[Telegram, TelegramRecord], timestamp: float = None) -> List[Rollup]:
+        """Add a telegram to the open windows of its meter
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+
+        :param timestamp:   Time of the telegram. Default value: the timestamp of the meter ('0-0:1.0.0') or, when the
+                            telegram has none, the time of the telegram or record
+        :type timestamp:    float
+
+        :return:            The windows closed by this telegram. A telegram which is not newer than the previous
+                            telegram of its meter (late or duplicated) is dropped, windows are never reopened.
+        :rtype:             List[Rollup]
+        """
+        if isinstance(telegram, TelegramRecord):
+            get = telegram.get
+        else:
+            get = telegram.telegram['data'].get
+        if timestamp is None:
+            timestamp = meter_timestamp(telegram)
+        source = telegram.source
+
+        last_timestamp = self._last_timestamps.get(source)
+        if last_timestamp is not None and timestamp <= last_timestamp:
+            self.logger.debug(f"Telegram of {timestamp} of meter {source} is not newer than the previous telegram "
+                              f"({last_timestamp}), dropped")
+            self.late_telegrams += 1
+            return []
+        self._last_timestamps[source] = timestamp
+
+        closed = []
+        rollups = []
+        for name, size in self.windows.items():
+            rollup = self._current.get((source, name))
+            if rollup is None or timestamp >= rollup.end:
+                if rollup is not None:
+                    closed.append(rollup)
+                rollup = self._current[(source, name)] = Rollup(source, name, timestamp - timestamp % size, size)
+            rollups.append(rollup)
+
+        # Power:
+        for obis_id in POWER_OBIS_CODES:
+            value = get(obis_id)
+            if value is not None:
+                for rollup in rollups:
+                    rollup.power[obis_id].add(value)
+
+        # Energy delta since the previous telegram, attributed to the current tariff:
+        tariff = get(TARIFF_OBIS_CODE) or 0
+        counters = self._counters.get(source)
+        if counters is None:
+            counters = self._counters[source] = {}
+        for obis_id in ENERGY_OBIS_CODES:
+            value = get(obis_id)
+            if value is None:
+                continue
+            previous = counters.get(obis_id)
+            counters[obis_id] = value
+            if previous is None:
+                continue
+            delta = value - previous
+            if delta < 0:
+                self.logger.warning(f"Register {obis_id} of meter {source} went back from {previous} to {value}")
+                continue
+            if delta > 0:
+                for rollup in rollups:
+                    rollup.add_energy(tariff, obis_id, delta)
+
+        for rollup in rollups:
+            rollup.telegrams += 1
+
+        for rollup in closed:
+            self._close(rollup)
+        return closed
+
+    def flush(self) -> List[Rollup]:
+        """Close all open windows, e.g. at the end of a replay
+
+        :rtype:     List[Rollup]
+        """
+        closed = list(self._current.values())
+        self._current.clear()
+        for rollup in closed:
+            self._close(rollup)
+        return closed
+
+    def _close(self, rollup: Rollup):
+        if rollup.end - rollup.start == QUARTER_HOUR:
+            self._track_peak(rollup)
+        if self.on_window is not None:
+            self.on_window(rollup)
+
+    def _track_peak(self, rollup: Rollup):
+        """Keep the highest quarter-hour average power delivered per meter and month"""
+        month = datetime.datetime.fromtimestamp(rollup.start, tz=datetime.timezone.utc).strftime("%Y-%m")
+        power = rollup.average_power_delivered
+        if power == 0 and rollup.power["1-0:1.7.0"].count:
+            # Registers not available or not moving, fall back to the sampled power:
+            power = rollup.power["1-0:1.7.0"].mean
+
+        peak = self.quarter_peaks.get((rollup.source, month))
+        if peak is None or power > peak[0]:
+            self.quarter_peaks[(rollup.source, month)] = (power, rollup.start)
+
+    def peak(self, source: str = None, month: str = None) -> Union[Tuple[float, float], None]:
+        """The highest quarter-hour average power delivered of a meter in a month
+
+        :param source:  Name of the meter
+        :param month:   The month as 'YYYY-MM'. Default value: the current month (UTC)
+
+        :return:        (power in kW, start of the quarter-hour) or None when there is no closed quarter yet
+        """
+        if month is None:
+            month = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m")
+        return self.quarter_peaks.get((source, month))
@@ -0,0 +1,391 @@
+"""Vectorized analytics of stored meter readings, with NumPy
+
+A time range of readings of one meter is loaded into a History: an array of timestamps and one float64 array per
+OBIS code (NaN for missing values), from a TimeSeriesStore, an ArchiveReader or a TelegramBatch. The functions below
+work on whole arrays instead of a Python loop per reading:
+
+    history = load_store(TimeSeriesStore("/var/lib/p1"), start, end)
+    per_tariff = energy_per_tariff(history)
+    quarters, power = resample(history.timestamps, history.column("1-0:1.7.0"), 900)
+    peak_time, peak_power = peak(quarters, power)
+
+NumPy is an optional dependency ('pip install smartmeter[analytics]'). It is imported on the first call, so the rest
+of the package, and importing this module, works without it.
+"""
+import os
+from typing import Dict, Iterable, Tuple, Union
+
+from smartmeter.p1.record import TelegramBatch
+from smartmeter.p1.rollup import DELIVERED_OBIS_CODES, TARIFF_OBIS_CODE
+from smartmeter.storage.archive import ArchiveReader
+from smartmeter.storage.timeseries import RECORD, STORED_OBIS_CODES, TimeSeriesStore, _as_timestamp
+
+
+RECEIVED_OBIS_CODES = ("1-0:2.8.1", "1-0:2.8.2")
+
+RESAMPLE_METHODS = ("mean", "sum", "min", "max", "first", "last")
+
+_numpy = None
+
+
+def _np():
+    """The numpy module, imported on first use
+
+    :exception:     ImportError when NumPy is not installed
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError as e:
+            raise ImportError(
+                "smartmeter.storage.analytics needs NumPy, install it with 'pip install smartmeter[analytics]'"
+            ) from e
+        _numpy = numpy
+    return _numpy
+
+
+def _record_dtype():
+    """The NumPy layout of a record of a TimeSeriesStore segment, see RECORD"""
+    np = _np()
+    fields = [("timestamp", "<f8")]
+    fields.extend((obis_id, "<f8") for obis_id in STORED_OBIS_CODES[:-1])
+    fields.append((STORED_OBIS_CODES[-1], "<u2"))
+    fields.append(("padding", f"V{RECORD.size - 8 * len(STORED_OBIS_CODES) - 2}"))
+    return np.dtype(fields)
+
+
+class History:
+    """The readings of one meter in a time range, column wise and in order of time"""
+
+    def __init__(self, timestamps, columns: Dict[str, object], source: str = None):
+        """
+        :param timestamps:  Seconds since the epoch, one per reading
+        :type timestamps:   numpy.ndarray
+
+        :param columns:     A float64 array per OBIS code, as long as timestamps, NaN for missing values
+        :type columns:      Dict[str, numpy.ndarray]
+
+        :param source:      Name of the meter. Default value: None
+        :type source:       str
+        """
+        self.timestamps = timestamps
+        self.columns = columns
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def obis_ids(self) -> Tuple[str, ...]:
+        return tuple(self.columns)
+
+    def column(self, obis_id: str):
+        """All values of one OBIS code
+
+        :exception:     KeyError when the history has no column for the OBIS code
+        :rtype:         numpy.ndarray
+        """
+        return self.columns[obis_id]
+
+    def select(self, start: float = None, end: float = None) -> 'History':
+        """The readings with start <= timestamp < end, as views on the arrays of this history
+
+        :rtype:     History
+        """
+        np = _np()
+        low = 0 if start is None else int(np.searchsorted(self.timestamps, start, side="left"))
+        high = len(self) if end is None else int(np.searchsorted(self.timestamps, end, side="left"))
+        return History(
+            self.timestamps[low:high],
+            {obis_id: column[low:high] for obis_id, column in self.columns.items()},
+            source=self.source
+        )
+
+
+def load_store(
+        store: TimeSeriesStore,
+        start: float,
+        end: float,
+        source: str = None
+) -> History:
+    """Load the readings of a meter with start <= timestamp < end from a time-series store
+
+    Every segment is read with a single numpy.fromfile() call instead of unpacking record by record. Missing tariffs
+    (stored as 0) become NaN like the other missing values.
+
+    :param store:   The store
+    :type store:    TimeSeriesStore
+
+    :param start:   Start of the range, seconds since the epoch or a datetime
+    :type start:    float
+
+    :param end:     End of the range (exclusive), seconds since the epoch or a datetime
+    :type end:      float
+
+    :param source:  The meter. Default value: the default meter (telegrams without source)
+    :type source:   str
+
+    :rtype:         History
+    """
+    np = _np()
+    dtype = _record_dtype()
+    start = _as_timestamp(start)
+    end = _as_timestamp(end)
+
+    parts = {name: [] for name in ("timestamp",) + STORED_OBIS_CODES}
+    for segment in store.segments(start, end, source):
+        records = np.fromfile(segment.filename, dtype=dtype, count=os.path.getsize(segment.filename) // RECORD.size)
+        low, high = np.searchsorted(records["timestamp"], (start, end), side="left")
+        records = records[low:high]
+        # Copy the columns out of the records per segment, so only one segment of full records is in memory:
+        for name, part in parts.items():
+            part.append(records[name].astype(np.float64))
+
+    columns = {
+        name: np.concatenate(part) if part else np.empty(0, dtype=np.float64)
+        for name, part in parts.items()
+    }
+    tariffs = columns[TARIFF_OBIS_CODE]
+    tariffs[tariffs == 0] = np.nan
+    timestamps = columns.pop("timestamp")
+    return History(timestamps, columns, source=source)
+
+
+def load_batch(batch: TelegramBatch, obis_ids: Iterable[str] = None, source: str = None) -> History:
+    """Load the numeric columns of a TelegramBatch
+
+    :param batch:       The telegrams
+    :type batch:        TelegramBatch
+
+    :param obis_ids:    The OBIS codes to load. Default value: all numeric OBIS codes of the schema of the batch
+    :type obis_ids:     Iterable[str]
+
+    :param source:      Only the readings of this meter. Default value: all readings, which should be of one meter
+    :type source:       str
+
+    :exception:         KeyError when an OBIS code is not part of the schema, ValueError when it is not numeric
+
+    :rtype:             History
+    """
+    np = _np()
+    schema = batch.schema
+    if obis_ids is None:
+        obis_ids = [obis_id for obis_id, data_type in zip(schema.obis_ids, schema.types) if data_type != 'str']
+
+    # Copy the arrays: a NumPy view would keep the array('d') of the batch from growing
+    timestamps = np.frombuffer(batch.timestamps, dtype=np.float64).copy()
+    columns = {}
+    for obis_id in obis_ids:
+        position = schema.index[obis_id]
+        if schema.types[position] == 'str':
+            raise ValueError(f"OBIS code {obis_id} is not numeric")
+        columns[obis_id] = np.frombuffer(batch.columns[position], dtype=np.float64).copy()
+
+    selection = None
+    if source is not None:
+        sources = np.frombuffer(batch.sources, dtype=np.uint32)
+        if source in batch.dictionary:
+            selection = sources == batch.dictionary.index(source)
+        else:
+            selection = np.zeros(len(batch), dtype=bool)
+    if len(timestamps) > 1 and np.any(np.diff(timestamps if selection is None else timestamps[selection]) < 0):
+        order = np.argsort(timestamps, kind="stable")
+        selection = order if selection is None else order[selection[order]]
+
+    if selection is not None:
+        timestamps = timestamps[selection]
+        columns = {obis_id: column[selection] for obis_id, column in columns.items()}
+    return History(timestamps, columns, source=source)
+
+
+def load_archive(
+        reader: ArchiveReader,
+        start: float = None,
+        end: float = None,
+        source: str = None,
+        obis_ids: Iterable[str] = None
+) -> History:
+    """Load the records with start <= timestamp < end from an archive, see ArchiveReader.query() and load_batch()
+
+    :rtype:     History
+    """
+    return load_batch(reader.batch(start, end, source), obis_ids=obis_ids)
+
+
+def resample(timestamps, values, interval: float, how: str = "mean", origin: float = 0.0) -> Tuple[object, object]:
+    """Aggregate the values per window of a fixed size, e.g. the average power per quarter-hour
+
+    Missing values are skipped and windows without any value are left out.
+
+    :param timestamps:  Seconds since the epoch, in order of time
+    :type timestamps:   numpy.ndarray
+
+    :param values:      One value per timestamp, NaN for missing values
+    :type values:       numpy.ndarray
+
+    :param interval:    The window size in seconds
+    :type interval:     float
+
+    :param how:         One of RESAMPLE_METHODS. Default value: mean
+    :type how:          str
+
+    :param origin:      A window starts at origin plus a multiple of the interval. Default value: 0.0 (the epoch)
+    :type origin:       float
+
+    :exception:         ValueError on an unknown method
+
+    :return:            The start of every window with values and the aggregated value of the window
+    :rtype:             Tuple[numpy.ndarray, numpy.ndarray]
+    """
+    if how not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resample method '{how}', use one of {', '.join(RESAMPLE_METHODS)}")
+
+    np = _np()
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    timestamps = timestamps[valid]
+    values = values[valid]
+    if len(values) == 0:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+
+    windows = np.floor((timestamps - origin) / interval)
+    # The position of the first value of every window:
+    firsts = np.flatnonzero(np.concatenate(([True], windows[1:] != windows[:-1])))
+    starts = windows[firsts] * interval + origin
+
+    if how == "mean":
+        counts = np.diff(np.append(firsts, len(values)))
+        return starts, np.add.reduceat(values, firsts) / counts
+    if how == "sum":
+        return starts, np.add.reduceat(values, firsts)
+    if how == "min":
+        return starts, np.minimum.reduceat(values, firsts)
+    if how == "max":
+        return starts, np.maximum.reduceat(values, firsts)
+    if how == "first":
+        return starts, values[firsts]
+    return starts, values[np.append(firsts[1:], len(values)) - 1]
+
+
+def energy_deltas(values):
+    """The energy used between consecutive readings of a cumulative register, e.g. '1-0:1.8.1'
+
+    The delta of a reading is the increase since the previous reading with a value: 0 for the first reading and for
+    missing readings. A reading lower than the previous one is a counter reset (e.g. a replaced meter or a register
+    which wrapped around), the register started again from zero so the delta is the new reading itself.
+
+    :param values:  The readings of the register, in order of time, NaN for missing readings
+    :type values:   numpy.ndarray
+
+    :return:        One delta per reading, they sum up to the total use over the readings
+    :rtype:         numpy.ndarray
+    """
+    np = _np()
+    values = np.asarray(values, dtype=np.float64)
+    deltas = np.zeros(len(values), dtype=np.float64)
+    present = np.flatnonzero(~np.isnan(values))
+    if len(present) < 2:
+        return deltas
+
+    readings = values[present]
+    steps = np.diff(readings)
+    resets = steps < 0
+    steps[resets] = readings[1:][resets]
+    deltas[present[1:]] = steps
+    return deltas
+
+
+def split_by_tariff(values, tariffs) -> Dict[int, float]:
+    """Sum values per tariff, e.g. the energy deltas by the tariff indicator '0-0:96.14.0'
+
+    :param values:  The values, NaN values are skipped
+    :type values:   numpy.ndarray
+
+    :param tariffs: The tariff of every value, values with a missing (NaN) tariff are skipped
+    :type tariffs:  numpy.ndarray
+
+    :return:        The sum per tariff, for the tariffs which occur
+    :rtype:         Dict[int, float]
+    """
+    np = _np()
+    values = np.asarray(values, dtype=np.float64)
+    tariffs = np.asarray(tariffs, dtype=np.float64)
+    valid = ~np.isnan(values) & ~np.isnan(tariffs)
+    codes = tariffs[valid].astype(np.int64)
+    if len(codes) == 0:
+        return {}
+
+    totals = np.bincount(codes, weights=values[valid])
+    return {int(tariff): float(totals[tariff]) for tariff in np.flatnonzero(np.bincount(codes))}
+
+
+def energy_per_tariff(history: History, obis_ids: Iterable[str] = DELIVERED_OBIS_CODES) -> Dict[int, float]:
+    """The energy of cumulative registers per tariff, like the energy of the rollups of smartmeter.p1.rollup
+
+    The delta since the previous reading is attributed to the tariff of the reading. The delivered registers are
+    summed by default, use RECEIVED_OBIS_CODES for the energy returned to the grid (e.g. to compute self-consumption
+    with the production of the solar inverter).
+
+    :param history:     The readings
+    :type history:      History
+
+    :param obis_ids:    The registers to sum. Default value: DELIVERED_OBIS_CODES
+    :type obis_ids:     Iterable[str]
+
+    :rtype:             Dict[int, float]
+    """
+    np = _np()
+    deltas = np.zeros(len(history), dtype=np.float64)
+    for obis_id in obis_ids:
+        deltas += energy_deltas(history.column(obis_id))
+    return split_by_tariff(deltas, history.column(TARIFF_OBIS_CODE))
+
+
+def quantiles(values, levels: Union[float, Iterable[float]] = (0.5, 0.9, 0.99)):
+    """Quantiles of the values, missing values are skipped
+
+    :param values:  The values, e.g. the power delivered
+    :type values:   numpy.ndarray
+
+    :param levels:  The quantiles to compute, between 0 and 1. Default value: (0.5, 0.9, 0.99)
+    :type levels:   Union[float, Iterable[float]]
+
+    :return:        The quantiles, NaN when there are no values
+    :rtype:         numpy.ndarray
+    """
+    np = _np()
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    levels = np.asarray(levels, dtype=np.float64)
+    if len(values) == 0:
+        return np.full(levels.shape, np.nan)
+    return np.quantile(values, levels)
+
+
+def load_duration_curve(values):
+    """The values sorted from high to low, e.g. to plot for how long the load is above a level
+
+    :param values:  The values, e.g. the resampled power delivered, missing values are skipped
+    :type values:   numpy.ndarray
+
+    :rtype:         numpy.ndarray
+    """
+    np = _np()
+    values = np.asarray(values, dtype=np.float64)
+    return np.sort(values[~np.isnan(values)])[::-1]
+
+
+def peak(timestamps, values) -> Tuple[float, float]:
+    """The highest value and its timestamp, e.g. the highest quarter-hour average power for capacity tariffs
+
+    :return:    (timestamp, value), (None, None) when there are no values
+    :rtype:     Tuple[float, float]
+    """
+    np = _np()
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0 or np.all(np.isnan(values)):
+        return None, None
+    position = int(np.nanargmax(values))
+    return float(timestamps[position]), float(values[position])
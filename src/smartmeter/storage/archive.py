@@ -0,0 +1,447 @@
+"""Compact compressed archive of parsed telegrams
+
+An archive file is a header followed by independently compressed blocks:
+
+    header: b"SMARCHV1", length of the schema (uint32), the schema (JSON: OBIS codes, types and scales)
+    block:  b"SMB1", compressed length, record count, CRC32 of the compressed payload (uint32),
+            lowest and highest timestamp (double), the zlib compressed payload
+
+The block headers are not compressed: a reader finds the blocks of a time range by skipping from header to header,
+without decompressing anything. A block which was not written completely (e.g. power loss) is ignored.
+
+The payload of a block stores the records column wise, every value as an unsigned LEB128 varint:
+- a dictionary of the strings of the block (source, header, serial number, ...), index 0 is None
+- timestamps in milliseconds, delta encoded
+- source and header as dictionary index
+- per OBIS code: strings as dictionary index, numbers as scaled integers (e.g. kWh and kW in 0.001 resolution, the
+  resolution of DSMR), delta encoded. The cumulative registers barely move, so most deltas fit in a single byte before
+  compression even starts.
+"""
+import json
+import logging
+import os
+import struct
+import zlib
+from typing import Iterator, List, NamedTuple, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import DEFAULT_SCHEMA, TelegramBatch, TelegramRecord, TelegramSchema
+
+
+MAGIC = b"SMARCHV1"
+BLOCK_MAGIC = b"SMB1"
+BLOCK_HEADER = struct.Struct("<4sIIIdd")
+_LENGTH = struct.Struct("<I")
+
+# Numbers are stored as integers in this resolution, DSMR values have at most 3 decimals:
+DEFAULT_SCALES = {"int": 1, "float": 1000}
+TIMESTAMP_SCALE = 1000
+
+
+class BlockInfo(NamedTuple):
+    """The location and time range of one block"""
+    offset: int
+    length: int
+    count: int
+    crc: int
+    min_timestamp: float
+    max_timestamp: float
+
+
+def _append_varints(out: bytearray, values):
+    """Append unsigned integers as LEB128 varints"""
+    append = out.append
+    for value in values:
+        while value > 0x7F:
+            append((value & 0x7F) | 0x80)
+            value >>= 7
+        append(value)
+
+
+def _read_varints(data: bytes, offset: int, count: int):
+    """Read a number of varints, return them as a list and the offset after the last one"""
+    values = []
+    append = values.append
+    for _ in range(count):
+        byte = data[offset]
+        offset += 1
+        if byte < 0x80:
+            append(byte)
+            continue
+        value = byte & 0x7F
+        shift = 7
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(value)
+    return values, offset
+
+
+def _encode_deltas(scaled: List[Union[int, None]]) -> List[int]:
+    """Delta and zigzag encode a column of integers, missing values (None) become 0, all others are shifted by 1"""
+    codes = []
+    previous = 0
+    for value in scaled:
+        if value is None:
+            codes.append(0)
+            continue
+        delta = value - previous
+        previous = value
+        codes.append((delta << 1 if delta >= 0 else (-delta << 1) - 1) + 1)
+    return codes
+
+
+def _decode_deltas(codes: List[int]) -> List[Union[int, None]]:
+    """Reverse of _encode_deltas()"""
+    values = []
+    previous = 0
+    for code in codes:
+        if code == 0:
+            values.append(None)
+            continue
+        code -= 1
+        previous += (code >> 1) ^ -(code & 1)
+        values.append(previous)
+    return values
+
+
+def _schema_header(schema: TelegramSchema, scales: List[int]) -> bytes:
+    content = json.dumps({
+        "obiscodes": {
+            obis_id: {"type": data_type, "description": description, "scale": scale}
+            for obis_id, data_type, description, scale in zip(
+                schema.obis_ids, schema.types, schema.descriptions, scales
+            )
+        }
+    }).encode("utf-8")
+    return MAGIC + _LENGTH.pack(len(content)) + content
+
+
+def _read_schema_header(file_handler):
+    """Read the file header, return the schema, the scales and the offset of the first block"""
+    if file_handler.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a telegram archive")
+    length, = _LENGTH.unpack(file_handler.read(_LENGTH.size))
+    obis_codes = json.loads(file_handler.read(length).decode("utf-8"))["obiscodes"]
+
+    scales = [code["scale"] for code in obis_codes.values()]
+    if tuple(obis_codes) == DEFAULT_SCHEMA.obis_ids:
+        schema = DEFAULT_SCHEMA
+    else:
+        schema = TelegramSchema({
+            obis_id: {"type": code["type"], "description": code["description"]} for obis_id, code in obis_codes.items()
+        })
+    return schema, scales, len(MAGIC) + _LENGTH.size + length
+
+
+def _scan_blocks(file_handler, offset: int) -> List[BlockInfo]:
+    """Find all complete blocks by skipping from block header to block header"""
+    file_size = os.fstat(file_handler.fileno()).st_size
+    blocks = []
+    while offset + BLOCK_HEADER.size <= file_size:
+        file_handler.seek(offset)
+        magic, length, count, crc, min_timestamp, max_timestamp = BLOCK_HEADER.unpack(
+            file_handler.read(BLOCK_HEADER.size)
+        )
+        if magic != BLOCK_MAGIC or offset + BLOCK_HEADER.size + length > file_size:
+            break
+        blocks.append(BlockInfo(offset + BLOCK_HEADER.size, length, count, crc, min_timestamp, max_timestamp))
+        offset += BLOCK_HEADER.size + length
+    return blocks
+
+
+class ArchiveWriter:
+    """Append telegrams to an archive file, in blocks of a fixed amount of records"""
+
+    def __init__(
+            self,
+            filename: str,
+            schema: TelegramSchema = None,
+            block_size: int = 3600,
+            compression_level: int = 6
+    ):
+        """
+        :param filename:            The archive file. An existing archive is appended to, it must have the same schema
+        :type filename:             str
+
+        :param schema:              The schema of the stored telegrams. Default value: the schema of the existing
+                                    archive, DEFAULT_SCHEMA for a new one
+        :type schema:               TelegramSchema
+
+        :param block_size:          Amount of records per block. Default value: 3600
+        :type block_size:           int
+
+        :param compression_level:   zlib compression level (1-9). Default value: 6
+        :type compression_level:    int
+
+        :exception:                 ValueError when the existing file is not an archive of the same schema
+        """
+        self.logger = logging.getLogger(__name__)
+
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+
+        self.filename = filename
+        self.schema = schema if schema is not None else DEFAULT_SCHEMA
+        self.block_size = block_size
+        self.compression_level = compression_level
+        self.scales = [DEFAULT_SCALES.get(data_type, 1) for data_type in self.schema.types]
+
+        self._records: List[TelegramRecord] = []
+
+        # Counters:
+        self.records_written = 0
+        self.blocks_written = 0
+        self.bytes_written = 0
+
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self._file = open(filename, "r+b")
+            file_schema, self.scales, offset = _read_schema_header(self._file)
+            if file_schema.obis_ids != self.schema.obis_ids:
+                if schema is not None:
+                    self._file.close()
+                    raise ValueError(f"Archive '{filename}' has a different schema")
+                # E.g. an archive written before OBIS codes were added to the default schema:
+                self.logger.warning(f"Archive '{filename}' has a different schema than the default one, using its own")
+                self.schema = file_schema
+            blocks = _scan_blocks(self._file, offset)
+            if blocks:
+                offset = blocks[-1].offset + blocks[-1].length
+            # Cut off a block which was not written completely:
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        else:
+            self._file = open(filename, "wb")
+            self._file.write(_schema_header(self.schema, self.scales))
+
+    def __enter__(self) -> 'ArchiveWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, telegram: Union[Telegram, TelegramRecord], timestamp: float = None):
+        """Add a telegram or a record, a block is written when it is full
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+
+        :param timestamp:   Time of the telegram. Default value: the time of the telegram or record
+        :type timestamp:    float
+        """
+        if not isinstance(telegram, TelegramRecord) or telegram.schema is not self.schema:
+            if isinstance(telegram, TelegramRecord):
+                telegram = telegram.to_telegram()
+            telegram = self.schema.record(telegram, timestamp)
+        elif timestamp is not None:
+            telegram = self.schema.new_record(telegram.source, telegram.header, timestamp, telegram.values())
+
+        self._records.append(telegram)
+        if len(self._records) >= self.block_size:
+            self.flush()
+
+    def extend(self, telegrams):
+        """Add many telegrams or records"""
+        for telegram in telegrams:
+            self.append(telegram)
+
+    def flush(self):
+        """Write the buffered records as a (possibly smaller) block"""
+        if not self._records:
+            return
+
+        records = self._records
+        self._records = []
+
+        payload = self.encode_block(records)
+        compressed = zlib.compress(payload, self.compression_level)
+        self._file.write(BLOCK_HEADER.pack(
+            BLOCK_MAGIC,
+            len(compressed),
+            len(records),
+            zlib.crc32(compressed),
+            min(record.timestamp for record in records),
+            max(record.timestamp for record in records)
+        ))
+        self._file.write(compressed)
+        self._file.flush()
+
+        self.records_written += len(records)
+        self.blocks_written += 1
+        self.bytes_written += BLOCK_HEADER.size + len(compressed)
+
+    def encode_block(self, records: List[TelegramRecord]) -> bytes:
+        """Encode records as the (uncompressed) payload of a block
+
+        :rtype:     bytes
+        """
+        dictionary = {None: 0}
+
+        def index(value):
+            position = dictionary.get(value)
+            if position is None:
+                position = dictionary[value] = len(dictionary)
+            return position
+
+        columns = [
+            _encode_deltas([round(record.timestamp * TIMESTAMP_SCALE) for record in records]),
+            [index(record.source) for record in records],
+            [index(record.header) for record in records]
+        ]
+        rows = [record.values() for record in records]
+        for field, (data_type, scale) in enumerate(zip(self.schema.types, self.scales)):
+            if data_type == 'str':
+                columns.append([index(row[field]) for row in rows])
+            else:
+                columns.append(_encode_deltas([
+                    round(row[field] * scale) if row[field] is not None else None for row in rows
+                ]))
+
+        payload = bytearray()
+        _append_varints(payload, (len(records), len(dictionary) - 1))
+        for value in list(dictionary)[1:]:
+            encoded = value.encode("utf-8")
+            _append_varints(payload, (len(encoded),))
+            payload += encoded
+        for column in columns:
+            _append_varints(payload, column)
+        return bytes(payload)
+
+    def close(self):
+        """Write the buffered records and close the file"""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+class ArchiveReader:
+    """Read records from an archive file"""
+
+    def __init__(self, filename: str):
+        """
+        :param filename:    The archive file
+        :type filename:     str
+
+        :exception:         ValueError when the file is not an archive
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.filename = filename
+        self._file = open(filename, "rb")
+        try:
+            self.schema, self.scales, offset = _read_schema_header(self._file)
+        except Exception:
+            self._file.close()
+            raise
+        self.blocks = _scan_blocks(self._file, offset)
+
+    def __enter__(self) -> 'ArchiveReader':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(block.count for block in self.blocks)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read_block(self, number: int) -> List[TelegramRecord]:
+        """Decompress and decode one block
+
+        :param number:  The index of the block in self.blocks
+        :type number:   int
+
+        :rtype:         List[TelegramRecord]
+
+        :exception:     ValueError when the block is corrupt
+        """
+        block = self.blocks[number]
+        self._file.seek(block.offset)
+        compressed = self._file.read(block.length)
+        if zlib.crc32(compressed) != block.crc:
+            raise ValueError(f"Block {number} of '{self.filename}' is corrupt")
+        return self.decode_block(zlib.decompress(compressed))
+
+    def decode_block(self, payload: bytes) -> List[TelegramRecord]:
+        """Decode the (uncompressed) payload of a block
+
+        :rtype:     List[TelegramRecord]
+        """
+        (count, dictionary_size), offset = _read_varints(payload, 0, 2)
+        dictionary = [None]
+        for _ in range(dictionary_size):
+            (length,), offset = _read_varints(payload, offset, 1)
+            dictionary.append(payload[offset:offset + length].decode("utf-8"))
+            offset += length
+
+        values, _ = _read_varints(payload, offset, count * (3 + len(self.schema)))
+        columns = [values[position:position + count] for position in range(0, len(values), count)]
+
+        timestamps = [value / TIMESTAMP_SCALE for value in _decode_deltas(columns[0])]
+        sources = [dictionary[value] for value in columns[1]]
+        headers = [dictionary[value] for value in columns[2]]
+
+        fields = []
+        for column, data_type, scale in zip(columns[3:], self.schema.types, self.scales):
+            if data_type == 'str':
+                fields.append([dictionary[value] for value in column])
+            elif data_type == 'int':
+                fields.append([value // scale if value is not None else None for value in _decode_deltas(column)])
+            else:
+                fields.append([value / scale if value is not None else None for value in _decode_deltas(column)])
+
+        new_record = self.schema.new_record
+        return [
+            new_record(source, header, timestamp, values)
+            for source, header, timestamp, values in zip(sources, headers, timestamps, zip(*fields))
+        ]
+
+    def __iter__(self) -> Iterator[TelegramRecord]:
+        for number in range(len(self.blocks)):
+            yield from self.read_block(number)
+
+    def query(self, start: float = None, end: float = None, source: str = None) -> Iterator[TelegramRecord]:
+        """Yield the records with start <= timestamp < end, only the blocks overlapping the range are read
+
+        :param start:   Start of the range in seconds since the epoch. Default value: the first record
+        :type start:    float
+
+        :param end:     End of the range (exclusive). Default value: after the last record
+        :type end:      float
+
+        :param source:  Only records of this meter. Default value: all meters
+        :type source:   str
+
+        :rtype:         Iterator[TelegramRecord]
+        """
+        for number, block in enumerate(self.blocks):
+            if start is not None and block.max_timestamp < start:
+                continue
+            if end is not None and block.min_timestamp >= end:
+                continue
+            for record in self.read_block(number):
+                if start is not None and record.timestamp < start:
+                    continue
+                if end is not None and record.timestamp >= end:
+                    continue
+                if source is not None and record.source != source:
+                    continue
+                yield record
+
+    def batch(self, start: float = None, end: float = None, source: str = None) -> TelegramBatch:
+        """The records of a time range as a TelegramBatch, see query()
+
+        :rtype:     TelegramBatch
+        """
+        batch = TelegramBatch(self.schema)
+        batch.extend(self.query(start, end, source))
+        return batch
@@ -0,0 +1,324 @@
+"""Append-only binary time-series store for meter readings
+
+Each meter (Telegram.source) gets its own directory with one segment file per UTC day. A segment is a sequence of
+fixed-width records, ordered by time:
+
+    timestamp, 1-0:1.8.1, 1-0:1.8.2, 1-0:2.8.1, 1-0:2.8.2, 1-0:1.7.0, 1-0:2.7.0 (doubles, NaN when missing),
+    0-0:96.14.0 (unsigned short), padding to 64 bytes
+
+Appending a record is a single write to a file opened in append mode. Range queries memory map the segments and use
+a sparse in-memory index (the timestamp of every Nth record) to binary search the first record of the range.
+"""
+from array import array
+import bisect
+import datetime
+import logging
+import math
+import mmap
+import os
+import struct
+from typing import Dict, Iterator, List, NamedTuple, Union
+
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import meter_timestamp, TelegramRecord
+
+
+RECORD = struct.Struct("<7dH6x")
+
+STORED_OBIS_CODES = (
+    "1-0:1.8.1",
+    "1-0:1.8.2",
+    "1-0:2.8.1",
+    "1-0:2.8.2",
+    "1-0:1.7.0",
+    "1-0:2.7.0",
+    "0-0:96.14.0"
+)
+
+SEGMENT_EXTENSION = ".seg"
+
+
+class Reading(NamedTuple):
+    """One stored record, missing values are NaN (tariff 0)"""
+    timestamp: float
+    delivered_tariff1: float
+    delivered_tariff2: float
+    received_tariff1: float
+    received_tariff2: float
+    power_delivered: float
+    power_received: float
+    tariff: int
+
+
+def _as_timestamp(value: Union[float, datetime.datetime]) -> float:
+    """Convert a datetime to seconds since the epoch, naive datetimes are interpreted as local time"""
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def _segment_day(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class Segment:
+    """One day of records of one meter"""
+
+    def __init__(self, filename: str, index_interval: int = 64):
+        """
+        :param filename:        The segment file
+        :type filename:         str
+
+        :param index_interval:  Keep the timestamp of every Nth record in the sparse index. Default value: 64
+        :type index_interval:   int
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.filename = filename
+        self.index_interval = index_interval
+
+        # Timestamp of record 0, N, 2N, ...:
+        self.index = array('d')
+        self.records = 0
+        self.last_timestamp = -math.inf
+
+        self._fd = None
+
+    def refresh(self):
+        """Extend the sparse index with records appended since the last refresh (e.g. by another process)"""
+        size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+        records = size // RECORD.size
+        if records <= self.records:
+            return
+
+        with open(self.filename, "rb") as file_handler, \
+                mmap.mmap(file_handler.fileno(), records * RECORD.size, access=mmap.ACCESS_READ) as data:
+            next_indexed = len(self.index) * self.index_interval
+            for position in range(next_indexed, records, self.index_interval):
+                self.index.append(RECORD.unpack_from(data, position * RECORD.size)[0])
+            self.last_timestamp = RECORD.unpack_from(data, (records - 1) * RECORD.size)[0]
+
+        self.records = records
+
+    def append(self, values: tuple):
+        """Append a packed record, the timestamp must not be before the last record
+
+        :param values:  The values in the order of the Reading fields
+        :type values:   tuple
+        """
+        if self._fd is None:
+            self.refresh()
+            # Cut off a record which was not written completely (e.g. a power failure), the records appended after it
+            # would be misaligned:
+            size = os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+            if size > self.records * RECORD.size:
+                self.logger.warning(f"Segment {self.filename} ends with an incomplete record of "
+                                    f"{size - self.records * RECORD.size} bytes, cut off")
+                os.truncate(self.filename, self.records * RECORD.size)
+            self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        os.write(self._fd, RECORD.pack(*values))
+
+        if self.records % self.index_interval == 0:
+            self.index.append(values[0])
+        self.records += 1
+        self.last_timestamp = values[0]
+
+    def query(self, start: float, end: float) -> Iterator[Reading]:
+        """Yield all readings with start <= timestamp < end
+
+        :rtype:     Iterator[Reading]
+        """
+        self.refresh()
+        if self.records == 0:
+            return
+
+        # The sparse index narrows the search down to one block of index_interval records, the last block which
+        # starts before 'start' (records equal to 'start' can be at its end):
+        block = max(bisect.bisect_left(self.index, start) - 1, 0)
+        low = block * self.index_interval
+        high = min(low + self.index_interval, self.records)
+
+        with open(self.filename, "rb") as file_handler, \
+                mmap.mmap(file_handler.fileno(), self.records * RECORD.size, access=mmap.ACCESS_READ) as data:
+            # Binary search the first record in the block:
+            while low < high:
+                middle = (low + high) // 2
+                if RECORD.unpack_from(data, middle * RECORD.size)[0] < start:
+                    low = middle + 1
+                else:
+                    high = middle
+
+            for position in range(low, self.records):
+                reading = Reading._make(RECORD.unpack_from(data, position * RECORD.size))
+                if reading.timestamp >= end:
+                    break
+                yield reading
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class TimeSeriesStore:
+    """Store readings of one or more meters and query them by time range"""
+
+    def __init__(self, path: str, index_interval: int = 64):
+        """
+        :param path:            The directory of the store, created when needed
+        :type path:             str
+
+        :param index_interval:  Keep the timestamp of every Nth record in the sparse index. Default value: 64
+        :type index_interval:   int
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.path = path
+        self.index_interval = index_interval
+
+        self._segments: Dict[str, Segment] = {}
+        self._writers: Dict[str, Segment] = {}
+
+        # Counters:
+        self.records_written = 0
+        self.records_dropped = 0
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def __enter__(self) -> 'TimeSeriesStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _source_name(source: str) -> str:
+        """The directory name of a meter"""
+        if not source:
+            return "default"
+        return "".join(character if character.isalnum() or character in "-_." else "_" for character in source)
+
+    def _segment(self, source: str, day: str) -> Segment:
+        filename = os.path.join(self.path, self._source_name(source), day + SEGMENT_EXTENSION)
+        segment = self._segments.get(filename)
+        if segment is None:
+            segment = self._segments[filename] = Segment(filename, self.index_interval)
+        return segment
+
+    def append(self, telegram: Union[Telegram, TelegramRecord], timestamp: float = None) -> bool:
+        """Append the readings of a telegram
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+
+        :param timestamp:   Time of the telegram. Default value: the timestamp of the meter ('0-0:1.0.0') or, when the
+                            telegram has none, the time of the telegram or record
+        :type timestamp:    float
+
+        :return:            False when the record was dropped because it is older than the last stored record
+        :rtype:             bool
+        """
+        if isinstance(telegram, TelegramRecord):
+            get = telegram.get
+        else:
+            get = telegram.telegram['data'].get
+        if timestamp is None:
+            timestamp = meter_timestamp(telegram)
+
+        source = telegram.source
+        day = _segment_day(timestamp)
+
+        segment = self._writers.get(source)
+        if segment is None or not segment.filename.endswith(day + SEGMENT_EXTENSION):
+            # New meter or a new day, roll over to the segment of that day:
+            if segment is not None:
+                segment.close()
+            segment = self._writers[source] = self._segment(source, day)
+            os.makedirs(os.path.dirname(segment.filename), exist_ok=True)
+            segment.refresh()
+
+        if timestamp < segment.last_timestamp:
+            self.logger.warning(f"Reading of {timestamp} is older than the last stored reading, dropped")
+            self.records_dropped += 1
+            return False
+
+        values = [timestamp]
+        for obis_id in STORED_OBIS_CODES[:-1]:
+            value = get(obis_id)
+            values.append(value if value is not None else math.nan)
+        values.append(get(STORED_OBIS_CODES[-1]) or 0)
+
+        segment.append(tuple(values))
+        self.records_written += 1
+        return True
+
+    def query(
+            self,
+            start: Union[float, datetime.datetime],
+            end: Union[float, datetime.datetime],
+            source: str = None
+    ) -> Iterator[Reading]:
+        """Yield all readings of a meter with start <= timestamp < end, in order of time
+
+        :param start:   Start of the range, seconds since the epoch or a datetime
+        :type start:    Union[float, datetime.datetime]
+
+        :param end:     End of the range (exclusive), seconds since the epoch or a datetime
+        :type end:      Union[float, datetime.datetime]
+
+        :param source:  The meter. Default value: the default meter (telegrams without source)
+        :type source:   str
+
+        :rtype:         Iterator[Reading]
+        """
+        start = _as_timestamp(start)
+        end = _as_timestamp(end)
+        for segment in self.segments(start, end, source):
+            yield from segment.query(start, end)
+
+    def segments(
+            self,
+            start: Union[float, datetime.datetime],
+            end: Union[float, datetime.datetime],
+            source: str = None
+    ) -> List[Segment]:
+        """The existing segments of a meter which may hold readings with start <= timestamp < end, in order of time
+
+        E.g. to read whole segments at once (see smartmeter.storage.analytics), the records are laid out as RECORD.
+
+        :param start:   Start of the range, seconds since the epoch or a datetime
+        :type start:    Union[float, datetime.datetime]
+
+        :param end:     End of the range (exclusive), seconds since the epoch or a datetime
+        :type end:      Union[float, datetime.datetime]
+
+        :param source:  The meter. Default value: the default meter (telegrams without source)
+        :type source:   str
+
+        :rtype:         List[Segment]
+        """
+        start = _as_timestamp(start)
+        end = _as_timestamp(end)
+        segments = []
+        if end <= start:
+            return segments
+
+        day = datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc).date()
+        last_day = datetime.datetime.fromtimestamp(end, tz=datetime.timezone.utc).date()
+        while day <= last_day:
+            segment = self._segment(source, day.isoformat())
+            if os.path.exists(segment.filename):
+                segments.append(segment)
+            day += datetime.timedelta(days=1)
+        return segments
+
+    def sources(self) -> List[str]:
+        """The directory names of all meters in the store"""
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
+
+    def close(self):
+        """Close all segments opened for writing"""
+        for segment in self._writers.values():
+            segment.close()
+        self._writers.clear()
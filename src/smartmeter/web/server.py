@@ -0,0 +1,287 @@
+"""Embedded asyncio HTTP server for the live web view
+
+Routes:
+- /                         Redirect to view_latest.html
+- /<file>                   Static files of the document root (view_latest.html, styles.css)
+- /smartmeter_latest.json   The latest telegram
+- /events                   Server-Sent Events, every new telegram is pushed to the browser
+- /poll?since=<id>          Long-poll fallback, returns the first telegram newer than <id>
+
+Every telegram is serialized once by publish(), all clients share the encoded bytes. A client always gets the latest
+telegram: a slow client skips telegrams instead of queueing them.
+"""
+import asyncio
+import logging
+import mimetypes
+import os
+from typing import Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from smartmeter.output.ndjson import encode, telegram_as_dict
+from smartmeter.p1.data import Telegram
+from smartmeter.p1.record import TelegramRecord
+
+
+# The web view, installed as package data:
+DEFAULT_DOCUMENT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+STATUS_TEXTS = {
+    200: "OK",
+    302: "Found",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable"
+}
+
+
+def write_atomic(filename: str, content: bytes):
+    """Replace a file atomically: readers see either the old or the new content, never a partial file
+
+    :param filename:    The file to write
+    :type filename:     str
+
+    :param content:     The new content
+    :type content:      bytes
+    """
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary_filename, "wb") as file_handler:
+        file_handler.write(content)
+    os.replace(temporary_filename, filename)
+
+
+class TelegramHttpServer:
+    """Serve the web view and push telegrams to connected browsers"""
+
+    def __init__(
+            self,
+            host: str = "127.0.0.1",
+            port: int = 8080,
+            document_root: str = None,
+            latest_file: str = None,
+            keepalive: float = 15.0,
+            poll_timeout: float = 25.0
+    ):
+        """
+        :param host:            The address to listen on. Default value: 127.0.0.1
+        :type host:             str
+
+        :param port:            The port to listen on. Default value: 8080
+        :type port:             int
+
+        :param document_root:   Directory of the static files. Default value: the web view of the package
+        :type document_root:    str
+
+        :param latest_file:     Also write every telegram atomically to this file, e.g. for a static web server.
+                                Default value: off
+        :type latest_file:      str
+
+        :param keepalive:       Seconds between keep-alive comments on idle event streams. Default value: 15.0
+        :type keepalive:        float
+
+        :param poll_timeout:    Maximum seconds a long-poll request waits for a telegram. Default value: 25.0
+        :type poll_timeout:     float
+        """
+        self.logger = logging.getLogger(__name__)
+
+        self.host = host
+        self.port = port
+        self.document_root = os.path.abspath(document_root if document_root is not None else DEFAULT_DOCUMENT_ROOT)
+        self.latest_file = latest_file
+        self.keepalive = keepalive
+        self.poll_timeout = poll_timeout
+
+        self._server = None
+        self._id = 0
+        self._json = None
+        self._event = None
+        self._changed = None
+        # The connections being handled, disconnected by close():
+        self._writers = set()
+
+        # Counters:
+        self.clients = 0
+        self.requests = 0
+
+    async def start(self):
+        """Start listening"""
+        self._changed = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.logger.info(f"Serving {self.document_root} on http://{self.host}:{self.port}/")
+
+    async def close(self):
+        """Stop listening, connected clients are disconnected"""
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        server.close()
+
+        # Wake up all waiting clients so they notice the shutdown, and disconnect them: wait_closed() waits for all
+        # connections to be closed (as of Python 3.12.1)
+        if self._changed is not None:
+            self._changed.set()
+        for writer in list(self._writers):
+            writer.close()
+        await server.wait_closed()
+
+    async def __aenter__(self) -> 'TelegramHttpServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def publish(self, telegram: Union[Telegram, TelegramRecord]):
+        """Make a telegram the latest one and push it to all clients
+
+        :param telegram:    The parsed telegram or a record
+        :type telegram:     Union[Telegram, TelegramRecord]
+        """
+        self._id += 1
+        self._json = encode(telegram_as_dict(telegram)).encode("utf-8")
+        self._event = b"id: %d\nevent: telegram\ndata: %s\n\n" % (self._id, self._json)
+
+        if self.latest_file is not None:
+            write_atomic(self.latest_file, self._json)
+
+        if self._changed is not None:
+            changed, self._changed = self._changed, asyncio.Event()
+            changed.set()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle one connection, one request per connection"""
+        self.requests += 1
+        self._writers.add(writer)
+        try:
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                return
+
+            request_line, _, header_block = request.decode("latin-1").partition("\r\n")
+            parts = request_line.split(" ")
+            if len(parts) != 3:
+                await self._respond(writer, 400)
+                return
+            method, target, _ = parts
+            if method not in ("GET", "HEAD"):
+                await self._respond(writer, 405)
+                return
+
+            headers = {}
+            for header_line in header_block.split("\r\n"):
+                name, _, value = header_line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            url = urlsplit(target)
+            path = unquote(url.path)
+
+            if path == "/":
+                await self._respond(writer, 302, extra_headers={"Location": "/view_latest.html"})
+            elif path == "/smartmeter_latest.json":
+                await self._respond_latest(writer)
+            elif path == "/events":
+                await self._stream_events(writer, headers.get("last-event-id"))
+            elif path == "/poll":
+                since = parse_qs(url.query).get("since", ["0"])[0]
+                await self._long_poll(writer, int(since) if since.isdigit() else 0)
+            else:
+                await self._respond_file(writer, path, head=method == "HEAD")
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(
+            self,
+            writer: asyncio.StreamWriter,
+            status: int,
+            body: bytes = b"",
+            content_type: str = "text/plain; charset=utf-8",
+            extra_headers: dict = None,
+            head: bool = False
+    ):
+        headers = {
+            "Content-Type": content_type,
+            "Content-Length": str(len(body)),
+            "Cache-Control": "no-cache",
+            "Connection": "close"
+        }
+        if extra_headers:
+            headers.update(extra_headers)
+        response = [f"HTTP/1.1 {status} {STATUS_TEXTS.get(status, '')}"]
+        response += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(response) + "\r\n\r\n").encode("latin-1"))
+        if not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _respond_latest(self, writer: asyncio.StreamWriter):
+        if self._json is None:
+            await self._respond(writer, 503, b"No telegram received yet")
+            return
+        await self._respond(writer, 200, self._json, "application/json", {"X-Telegram-Id": str(self._id)})
+
+    async def _respond_file(self, writer: asyncio.StreamWriter, path: str, head: bool = False):
+        filename = os.path.abspath(os.path.join(self.document_root, path.lstrip("/")))
+        if not filename.startswith(self.document_root + os.sep) or not os.path.isfile(filename):
+            await self._respond(writer, 404, b"Not found")
+            return
+
+        with open(filename, "rb") as file_handler:
+            body = file_handler.read()
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        await self._respond(writer, 200, body, content_type, head=head)
+
+    async def _wait(self, last_id: int, timeout: float) -> bool:
+        """Wait until a telegram newer than last_id is published
+
+        :return:    False when the timeout expired or the server is closing
+        """
+        while self._id <= last_id:
+            if self._server is None:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return False
+        return self._server is not None
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, last_event_id: str = None):
+        """Push every new telegram as a Server-Sent Event until the client disconnects"""
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n"
+                     b"\r\n"
+                     b"retry: 3000\n\n")
+
+        # Start with the latest telegram, unless the client already has it:
+        last_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+        if self._event is not None and self._id != last_id:
+            writer.write(self._event)
+        last_id = self._id
+        await writer.drain()
+
+        self.clients += 1
+        try:
+            while self._server is not None:
+                if await self._wait(last_id, self.keepalive):
+                    last_id = self._id
+                    writer.write(self._event)
+                else:
+                    writer.write(b": keepalive\n\n")
+                # A slow client waits here, it will get the latest telegram after the drain:
+                await writer.drain()
+        finally:
+            self.clients -= 1
+
+    async def _long_poll(self, writer: asyncio.StreamWriter, since: int):
+        """Respond with the first telegram newer than 'since', or 304 when none arrived within the poll timeout"""
+        if self._id > since or await self._wait(since, self.poll_timeout):
+            await self._respond_latest(writer)
+        else:
+            await self._respond(writer, 304, extra_headers={"X-Telegram-Id": str(self._id)})